@@ -0,0 +1,388 @@
+"""
+Storage class for the data of a column
+
+@license: Gnu Public Licence
+"""
+__version__ = "Version 1.0"
+
+import types
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class ColumnBuffer(object):
+    """
+    Class to store the data of a column
+
+    Integer and float data are stored in a typed numpy buffer
+    (8 bytes per element) with a boolean mask for the 'None'
+    elements. The buffer grows by doubling, such that adding
+    elements one by one stays cheap. String data, data of an
+    undefined column and integers too large for 64 bit are
+    kept in a Python list, as is everything if numpy is
+    not available.
+
+    Towards the column the class behaves like a list,
+    elements are given and returned as Python objects
+    with 'None' for NULL elements.
+    """
+    def __init__(self, data=None, coltype=None, mask=None):
+        """
+        The class constructor
+
+        @param data: the initial data
+        @type data: list/numpy array
+        @param coltype: the type of the data, None for a list storage
+        @type coltype: <types>-name
+        @param mask: the NULL mask for data given as numpy array
+        @type mask: numpy array
+        """
+        if data is None:
+            data = []
+
+        self._list   = None
+        self._values = None
+        self._mask   = None
+        self._nrows  = 0
+
+        if numpy is not None and isinstance(data, numpy.ndarray):
+            # take the numpy array as it is
+            self._set_array(data, mask)
+        else:
+            # set the list storage
+            self._list  = list(data)
+            self._nrows = len(self._list)
+
+            # convert to the typed storage
+            if coltype != None:
+                self.set_type(coltype)
+
+    def _set_array(self, values, mask=None):
+        """
+        Set the typed storage from a numpy array
+
+        @param values: the data values
+        @type values: numpy array
+        @param mask: the NULL mask, None for no NULL elements
+        @type mask: numpy array
+        """
+        self._nrows  = len(values)
+        self._values = values
+        if mask is None:
+            self._mask = numpy.zeros(self._nrows, dtype=bool)
+        else:
+            self._mask = numpy.asarray(mask, dtype=bool)
+        self._list = None
+
+    def _dtype(self, coltype):
+        """
+        The numpy type for a column type
+
+        @param coltype: the column type
+        @type coltype: <types>-name
+
+        @return: the numpy type, None for a list storage
+        @rtype: numpy type
+        """
+        if numpy is None:
+            return None
+        elif coltype == types.IntType:
+            return numpy.int64
+        elif coltype == types.FloatType:
+            return numpy.float64
+        else:
+            return None
+
+    def set_type(self, coltype):
+        """
+        Convert the storage to a new type
+
+        The values are converted as in the element-by-element
+        transformation: int to float, and anything to a string
+        through 'str()' of the Python value.
+
+        @param coltype: the new column type
+        @type coltype: <types>-name
+        """
+        dtype = self._dtype(coltype)
+
+        if dtype is None:
+            # strings are stored in a list
+            data = self.tolist()
+            if coltype == types.StringType:
+                data = [None if item == None else str(item) for item in data]
+            self._list   = data
+            self._values = None
+            self._mask   = None
+
+        elif self._values is not None:
+            # change the numpy type
+            if self._values.dtype != dtype:
+                self._values = self._values[:self._nrows].astype(dtype)
+                self._mask   = self._mask[:self._nrows].copy()
+
+        else:
+            # move the list into the numpy buffer
+            data = self._list
+            mask = numpy.array([item == None for item in data], dtype=bool)
+            try:
+                values = numpy.array([0 if item == None else item
+                                      for item in data], dtype=dtype)
+            except OverflowError:
+                # keep very long integers in the list
+                return
+            self._set_array(values, mask)
+
+    def is_typed(self):
+        """
+        Whether the data is in the typed numpy storage
+
+        @return: 1/0
+        @rtype: integer
+        """
+        return self._values is not None
+
+    def _grow(self, nrows):
+        """
+        Make room in the numpy buffer for at least nrows elements
+
+        @param nrows: the number of elements needed
+        @type nrows: integer
+        """
+        if nrows <= len(self._values):
+            return
+
+        # double the capacity
+        capacity = max(nrows, 2*len(self._values), 16)
+        values = numpy.zeros(capacity, dtype=self._values.dtype)
+        mask   = numpy.zeros(capacity, dtype=bool)
+        values[:self._nrows] = self._values[:self._nrows]
+        mask[:self._nrows]   = self._mask[:self._nrows]
+        self._values = values
+        self._mask   = mask
+
+    def _to_list(self):
+        """
+        Move the data from the numpy buffer back into a list
+        """
+        self._list   = self.tolist()
+        self._values = None
+        self._mask   = None
+
+    def _check_index(self, index):
+        """
+        Transform a negative index and check the range
+
+        @param index: the index
+        @type index: integer
+
+        @return: the positive index
+        @rtype: integer
+        """
+        if index < 0:
+            index += self._nrows
+        if index < 0 or index >= self._nrows:
+            raise IndexError('list index out of range')
+        return index
+
+    def __len__(self):
+        """
+        The number of elements
+
+        @return: the number of elements
+        @rtype: integer
+        """
+        return self._nrows
+
+    def __getitem__(self, index):
+        """
+        Return an element or a slice
+
+        A slice of the typed storage is a numpy view on the data,
+        a masked array if there are NULL elements in the slice.
+
+        @param index: the index or slice
+        @type index: integer/slice
+
+        @return: the element
+        @rtype: string/integer/float
+        """
+        if self._values is None:
+            return self._list[index]
+
+        if isinstance(index, slice):
+            values = self._values[:self._nrows][index]
+            mask   = self._mask[:self._nrows][index]
+            if mask.any():
+                return numpy.ma.array(values, mask=mask, copy=False)
+            return values
+
+        index = self._check_index(index)
+        if self._mask[index]:
+            return None
+        return self._values.item(index)
+
+    def __setitem__(self, index, value):
+        """
+        Set an element
+
+        @param index: the index
+        @type index: integer
+        @param value: the new element
+        @type value: string/integer/float
+        """
+        if self._values is None:
+            self._list[index] = value
+            return
+
+        index = self._check_index(index)
+        if value == None:
+            self._mask[index] = True
+            self._values[index] = 0
+        else:
+            try:
+                self._values[index] = value
+            except OverflowError:
+                self._to_list()
+                self._list[index] = value
+                return
+            self._mask[index] = False
+
+    def append(self, value):
+        """
+        Append an element
+
+        @param value: the new element
+        @type value: string/integer/float
+        """
+        if self._values is None:
+            self._list.append(value)
+            self._nrows += 1
+            return
+
+        self._grow(self._nrows+1)
+        self._nrows += 1
+        self[self._nrows-1] = value
+
+    def __delitem__(self, index):
+        """
+        Delete an element or a slice
+
+        @param index: the index or slice
+        @type index: integer/slice
+        """
+        if self._values is None:
+            del self._list[index]
+            self._nrows = len(self._list)
+            return
+
+        if isinstance(index, slice):
+            keep = numpy.ones(self._nrows, dtype=bool)
+            keep[index] = False
+        else:
+            keep = numpy.ones(self._nrows, dtype=bool)
+            keep[self._check_index(index)] = False
+
+        self._values = self._values[:self._nrows][keep]
+        self._mask   = self._mask[:self._nrows][keep]
+        self._nrows  = len(self._values)
+
+    def __delslice__(self, start, end):
+        """
+        Delete a slice
+
+        @param start: starting index
+        @type start: integer
+        @param end: ending index
+        @type end: integer
+        """
+        self.__delitem__(slice(start, end))
+
+    def __contains__(self, item):
+        """
+        Check for an element, mostly used for 'None'
+
+        @param item: the element to look for
+        @type item: any type
+
+        @return: True/False
+        @rtype: boolean
+        """
+        if self._values is None:
+            return item in self._list
+
+        if item == None:
+            return bool(self._mask[:self._nrows].any())
+        return item in self.tolist()
+
+    def __iter__(self):
+        """
+        Provide an iterator over the elements
+        """
+        return iter(self.tolist())
+
+    def tolist(self):
+        """
+        Return the data as a list
+
+        @return: the elements, 'None' for NULL elements
+        @rtype: list
+        """
+        if self._values is None:
+            return list(self._list)
+
+        data = self._values[:self._nrows].tolist()
+        if self._mask[:self._nrows].any():
+            for index in numpy.flatnonzero(self._mask[:self._nrows]):
+                data[index] = None
+        return data
+
+    def tonumpy(self):
+        """
+        Return the data as numpy array
+
+        The typed storage is returned without a copy,
+        as masked array if there are NULL elements.
+
+        @return: the data
+        @rtype: numpy/numpy masked array
+        """
+        if self._values is None:
+            if None in self._list:
+                make_mask = lambda x: x == None
+                return numpy.ma.array(self._list, mask=map(make_mask, self._list))
+            return numpy.array(self._list)
+
+        return self[:]
+
+    def take(self, indices):
+        """
+        Return a new buffer with the elements in the order of an index
+
+        @param indices: the indices of the elements
+        @type indices: [integer]
+
+        @return: the reordered data
+        @rtype: ColumnBuffer
+        """
+        if self._values is None:
+            return ColumnBuffer([self._list[index] for index in indices])
+
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        new_buffer = ColumnBuffer()
+        new_buffer._set_array(self._values[:self._nrows][indices],
+                              self._mask[:self._nrows][indices])
+        return new_buffer
+
+    def copy(self):
+        """
+        Return a copy of the buffer
+
+        @return: the copy
+        @rtype: ColumnBuffer
+        """
+        if self._values is None:
+            return ColumnBuffer(self._list)
+        return self.take(numpy.arange(self._nrows))
@@ -0,0 +1,290 @@
+"""
+Binary cache for parsed ascii tables
+
+@license: Gnu Public Licence
+"""
+__version__ = "Version 1.0"
+
+import os, json, types, hashlib
+from asciiheader import *
+from asciicolumn import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class CatalogCache(object):
+    """
+    Class to keep a parsed ascii table in binary sidecar files
+
+    After a table has been parsed, the column data are written
+    next to the table into '<filename>.adcache.npy', a numpy
+    structured array with one field per column and one boolean
+    field per column for the NULL elements. Header, column
+    names, types and formats go to '<filename>.adcache.json',
+    together with size, modification time and md5 checksum of
+    the table.
+
+    When the table is opened again and the sidecar is still
+    valid, the structured array is memory mapped (copy on write)
+    instead of parsing the text again. If size or modification
+    time of the table changed, the checksum decides whether
+    the sidecar can be used, and if so the new modification
+    time is written to the metadata.
+
+    The strings of the metadata are kept as latin-1, so that
+    headers with any bytes can be cached.
+    """
+    def __init__(self, filename, null, delimiter, comment_char):
+        """
+        The class constructor
+
+        @param filename: the name of the ascii table
+        @type filename: string
+        @param null: the strings interpreted as NULL
+        @type null: [string]
+        @param delimiter: the delimiter
+        @type delimiter: string
+        @param comment_char: the comment character
+        @type comment_char: string
+        """
+        self.filename  = filename
+        self.data_file = filename+'.adcache.npy'
+        self.meta_file = filename+'.adcache.json'
+
+        # the options the table was parsed with
+        self._options = {'null':null, 'delimiter':delimiter,
+                         'comment_char':comment_char}
+
+    def _checksum(self):
+        """
+        The md5 checksum of the table
+
+        @return: the checksum
+        @rtype: string
+        """
+        md5 = hashlib.md5()
+        fstream = file(self.filename, 'rb')
+        for chunk in iter(lambda: fstream.read(2**20), ''):
+            md5.update(chunk)
+        fstream.close()
+        return md5.hexdigest()
+
+    def _stamp(self):
+        """
+        Size and modification time of the table
+
+        @return: size and modification time
+        @rtype: (integer, float)
+        """
+        stat = os.stat(self.filename)
+        return stat.st_size, stat.st_mtime
+
+    def _read_meta(self):
+        """
+        Read the metadata of a valid sidecar
+
+        @return: the metadata, None if there is no valid sidecar
+        @rtype: dictionary
+        """
+        if numpy is None or not os.path.isfile(self.meta_file) \
+               or not os.path.isfile(self.data_file):
+            return None
+
+        try:
+            meta = json.load(file(self.meta_file, 'r'))
+        except ValueError:
+            return None
+
+        # check the options
+        if meta.get('options') != self._options:
+            return None
+
+        # check the table itself
+        size, mtime = self._stamp()
+        if meta['size'] != size or meta['mtime'] != mtime:
+            if meta['size'] != size or meta['md5'] != self._checksum():
+                return None
+
+            # the same table with a new modification time,
+            # so the checksum is not needed next time
+            meta['mtime'] = mtime
+            try:
+                self._write_meta(meta)
+            except (IOError, OSError):
+                pass
+
+        return meta
+
+    def _write_meta(self, meta):
+        """
+        Write the metadata
+
+        @param meta: the metadata
+        @type meta: dictionary
+        """
+        tmp_file = self.meta_file+'.tmp'
+        fstream = file(tmp_file, 'w')
+        json.dump(meta, fstream, encoding='latin-1')
+        fstream.close()
+        os.rename(tmp_file, self.meta_file)
+
+    def _str(self, value):
+        """
+        A string of the metadata as it was written
+
+        @param value: the string from the metadata
+        @type value: string or unicode
+
+        @return: the string
+        @rtype: string
+        """
+        if isinstance(value, types.UnicodeType):
+            return value.encode('latin-1')
+        return str(value)
+
+    def load(self, asciiData):
+        """
+        Load header and columns from the sidecar into an AsciiData object
+
+        @param asciiData: the AsciiData object to fill
+        @type asciiData: AsciiData
+
+        @return: 1 if the sidecar was used, 0 if the table must be parsed
+        @rtype: integer
+        """
+        meta = self._read_meta()
+        if meta == None:
+            return 0
+
+        # map the data
+        narray = numpy.load(self.data_file, mmap_mode='c')
+
+        # restore the header
+        header = Header(None, self._str(meta['header']['comment_char']))
+        header.hdata          = [self._str(line) for line in meta['header']['hdata']]
+        header.Fullhdata      = [self._str(line) for line in meta['header']['Fullhdata']]
+        header.CollInfo       = [info and dict([(self._str(key), self._str(value))
+                                                for key, value in info.items()])
+                                 for info in meta['header']['CollInfo']]
+        header.SExtractorFlag = meta['header']['SExtractorFlag']
+        header._nentry        = len(header.hdata)
+
+        # restore the columns
+        columns = []
+        for index in range(len(meta['columns'])):
+            cmeta = meta['columns'][index]
+            column = AsciiColumn(element=[], colname=self._str(cmeta['colname']),
+                                 null=asciiData._null)
+            field     = 'c'+str(index)
+            coltype   = self._get_type(cmeta['type'])
+            colformat = [self._str(item) for item in cmeta['format']]
+            if cmeta['storage'] == 'array':
+                mask = numpy.array(narray['m'+str(index)])
+                if coltype == types.StringType:
+                    # strings are kept in a list
+                    data = narray[field].tolist()
+                    for row in numpy.flatnonzero(mask):
+                        data[row] = None
+                    column.set_data(data, coltype, colformat)
+                else:
+                    # numbers stay in the mapped file
+                    values = narray[field].view(numpy.ndarray)
+                    column.set_data(values, coltype, colformat, mask)
+            else:
+                column.set_data(cmeta['data'], coltype, colformat)
+            column._defined = cmeta['defined']
+            if cmeta['unit']:
+                column.set_unit(self._str(cmeta['unit']))
+            if cmeta['colcomment']:
+                column.set_colcomment(self._str(cmeta['colcomment']))
+            columns.append(column)
+
+        asciiData.header  = header
+        asciiData.columns = columns
+        return 1
+
+    def save(self, asciiData):
+        """
+        Write the sidecar for a parsed AsciiData object
+
+        Problems in writing the sidecar (e.g. a read-only
+        directory) are ignored, the cache is then simply not used.
+
+        @param asciiData: the AsciiData object
+        @type asciiData: AsciiData
+        """
+        if numpy is None or not asciiData.columns:
+            return
+
+        size, mtime = self._stamp()
+        meta = {'size':size, 'mtime':mtime, 'md5':self._checksum(),
+                'options':self._options,
+                'header':{'comment_char':asciiData.header._comment_char,
+                          'hdata':asciiData.header.hdata,
+                          'Fullhdata':asciiData.header.Fullhdata,
+                          'CollInfo':asciiData.header.CollInfo,
+                          'SExtractorFlag':asciiData.header.SExtractorFlag},
+                'columns':[]}
+
+        # assemble the structured array
+        fields = []
+        for index in range(len(asciiData.columns)):
+            column = asciiData.columns[index]
+            cmeta  = {'colname':column.colname, 'type':column.get_type().__name__,
+                      'format':column._format, 'defined':column.get_defined(),
+                      'unit':column.get_unit(), 'colcomment':column.get_colcomment(),
+                      'storage':'array'}
+
+            if column._data.is_typed():
+                values = column._data[:]
+                if isinstance(values, numpy.ma.MaskedArray):
+                    mask   = numpy.ma.getmaskarray(values)
+                    values = values.data
+                else:
+                    mask = numpy.zeros(len(values), dtype=bool)
+            elif column.get_defined() and column.get_type() == types.StringType:
+                data   = column._data.tolist()
+                mask   = numpy.array([item == None for item in data], dtype=bool)
+                maxlen = max([len(item) for item in data if item != None] + [1])
+                values = numpy.array([item or '' for item in data],
+                                     dtype='S'+str(maxlen))
+            else:
+                # undefined columns and very long integers
+                cmeta['storage'] = 'list'
+                cmeta['data'] = column._data.tolist()
+                values = None
+
+            if values is not None:
+                fields.append(('c'+str(index), values))
+                fields.append(('m'+str(index), mask))
+            meta['columns'].append(cmeta)
+
+        narray = numpy.empty(asciiData.columns[0].get_nrows(),
+                             dtype=[(name, values.dtype) for name, values in fields])
+        for name, values in fields:
+            narray[name] = values
+
+        # write the sidecar, the metadata last
+        try:
+            tmp_file = self.data_file+'.tmp.npy'
+            numpy.save(tmp_file, narray)
+            os.rename(tmp_file, self.data_file)
+
+            self._write_meta(meta)
+        except (IOError, OSError):
+            pass
+
+    def _get_type(self, name):
+        """
+        The column type from its name
+
+        @param name: the name of the type
+        @type name: string
+
+        @return: the type
+        @rtype: <types>-name
+        """
+        return {'int':types.IntType, 'float':types.FloatType,
+                'str':types.StringType}.get(name, types.StringType)
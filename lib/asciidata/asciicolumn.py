@@ -15,6 +15,7 @@ import string
 from asciielement import *
 from asciierror   import *
 from asciiutils   import *
+from asciibuffer  import ColumnBuffer
 
 class NullColumn(object):
     """
@@ -40,7 +41,7 @@ class NullColumn(object):
 
         # append the reuqested number of None
         # perhaps a bit faster than the above lines
-        self._data = map(dummy_list.append, range(nrows))
+        self._data = ColumnBuffer(map(dummy_list.append, range(nrows)))
 
         # set the row number
         self._nrows   = nrows
@@ -55,7 +56,8 @@ class AsciiColumn(NullColumn):
         Constructor for the column class.
 
         Instances of this column class hold the data in
-        a private list. Moreover there exist few
+        a private ColumnBuffer, which stores integer and
+        float data in a numpy array. Moreover there exist few
         attributes in addition. A column does have
         a type, which is either string/integer/float.
         The column can be undefined, which means it contains
@@ -69,7 +71,7 @@ class AsciiColumn(NullColumn):
         self.colname = colname
         self.unit = ''
         self.colcomment =''
-        self._data    = []
+        self._data    = ColumnBuffer()
         self._defined = 0
         self._type    = types.StringType
         self._format  = ['%10s','%10s']
@@ -95,6 +97,7 @@ class AsciiColumn(NullColumn):
                         elem = ForElement(item)
                         self._type   = elem.get_type()
                         self._format = elem.get_fvalue()
+                        self._data.set_type(self._type)
                         self._data.append(elem.get_tvalue())
                         self._defined = 1
                         self._nrows += 1
@@ -122,6 +125,10 @@ class AsciiColumn(NullColumn):
         @return: the column value
         @rtype: string/integer/float
         """
+        # a slice of a numeric column is a numpy view
+        if isinstance(index, slice):
+            return self._data[index]
+
         # check whether the requested index is available.
         # raise an error if not
         # [BUG] ?  self._nrows-1: ->  self._nrows:
@@ -164,6 +171,7 @@ class AsciiColumn(NullColumn):
                 self._type    = val.get_type()
                 self._format  = val.get_fvalue()
                 self._defined = 1
+                self._data.set_type(self._type)
 
             else:
 
@@ -224,11 +232,8 @@ class AsciiColumn(NullColumn):
         # set the type to the one in the transformator object
         self._type    = t_trans.higher_type
 
-        # go over all data
-        for index in range(len(self._data)):
-            if self._data[index] != None:
-                # transform all non-Null entries
-                self._data[index] = t_trans.to_higher_type(self._data[index])
+        # transform all non-Null entries
+        self._data.set_type(self._type)
 
     def _get_nullformat(self, newformat):
         """
@@ -394,6 +399,7 @@ class AsciiColumn(NullColumn):
                 self._type    = elem.get_type()
                 self._format  = elem.get_fvalue()
                 self._defined = 1
+                self._data.set_type(self._type)
 
             else:
                 # create an element object
@@ -432,6 +438,31 @@ class AsciiColumn(NullColumn):
         self._nrows += 1
 
 
+    def set_data(self, data, coltype, colformat, mask=None):
+        """
+        Sets all column data at once
+
+        The method replaces the column data with a list or
+        numpy array of values already in the column type,
+        e.g. from the fast loader. 'None' elements or
+        elements flagged in the mask are NULL. No type
+        checking is performed.
+
+        @param data: the column data
+        @type data: [string/integer/float]/numpy array
+        @param coltype: the column type
+        @type coltype: <types>-name
+        @param colformat: the column format and null format
+        @type colformat: [string]
+        @param mask: the NULL mask for data given as numpy array
+        @type mask: numpy array
+        """
+        self._data    = ColumnBuffer(data, coltype, mask)
+        self._type    = coltype
+        self._format  = colformat
+        self._defined = 1
+        self._nrows   = len(self._data)
+
     def fprint_elem(self, index):
         """
         Create and return a formatted string representation for an element.
@@ -479,20 +510,23 @@ class AsciiColumn(NullColumn):
         if None in self._data:
             raise Exception('There are "None" elements in the column. They can not be\ntransformed to numarrays!')
 
+        # get the data as list
+        data = self._data.tolist()
+
         # check for string column
         if self._type == types.StringType:
             # import CharArrays
             import numarray.strings
             # transform the array to CharArrays
-            narray = numarray.strings.array(self._data)
+            narray = numarray.strings.array(data)
 
         elif self._type == types.IntType:
             # transform the data to integer numarray
-            narray = numarray.array(self._data, type='Int32')
+            narray = numarray.array(data, type='Int32')
 
         elif self._type == types.FloatType:
             # transform the data to float numarray
-            narray = numarray.array(self._data, type='Float64')
+            narray = numarray.array(data, type='Float64')
 
         else:
             # raise an exception in case of string column
@@ -506,33 +540,15 @@ class AsciiColumn(NullColumn):
         Transforms column to a numpy
 
         The column data is transformed to a numpy object
-        and returned.
+        and returned. Integer and float columns are
+        returned without a copy, changing the numpy
+        object changes the column.
 
         @return: the numpy representation of the data
         @rtype: numpy/numpy masked array
         """
-        import numpy
-        from numpy import ma
-
-        # initialize the return
-        narray = None
-
-        if None in self._data:
-
-            # define a lambda function
-            # to create the mask array
-            make_mask = lambda x: x == None
-
-            # create the numpy array,
-            # making on the fly the mask
-            narray = numpy.ma.array(self._data, mask=map(make_mask, self._data))
-
-        else:
-            # convert the list to a numpy object
-            narray = numpy.array(self._data)
-
         # return the numpy object
-        return narray
+        return self._data.tonumpy()
 
 
     def copy(self):
@@ -545,15 +561,15 @@ class AsciiColumn(NullColumn):
         @return: the copy of the current column
         @rtype: AsciiColumn
         """
-        data_copy = []
+        # create an empty column
+        self_copy = AsciiColumn(element=[], colname=self.colname,
+                                null=self._null)
 
         # make a copy of the data
-        for ii in range(self._nrows):
-            data_copy.append(self._data[ii])
-
-        # explicitly create a column from the data copy
-        self_copy = AsciiColumn(element=data_copy, colname=self.colname,
-                                null=self._null)
+        self_copy._data    = self._data.copy()
+        self_copy._nrows   = self._nrows
+        self_copy._type    = self._type
+        self_copy._defined = self._defined
 
         # explicitly transport the format
         self_copy._format = self._format
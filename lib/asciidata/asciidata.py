@@ -18,6 +18,8 @@ import string, sys, os, types,copy
 from asciiheader import *
 from asciicolumn import *
 from asciisorter import *
+from asciiloader import FastLoader
+from asciicache  import CatalogCache
 from asciierror  import *
 from asciiutils  import *
 
@@ -79,7 +81,8 @@ class AsciiData(NullData):
     for the
     """
     def __init__(self, filename=None, ncols=0, nrows=0, null=None,
-                 delimiter=None, comment_char=None, columnInfo=0, headerComment=1):
+                 delimiter=None, comment_char=None, columnInfo=0, headerComment=1,
+                 cache=0):
         """
         Constructor for the AsciiData Class
 
@@ -100,6 +103,8 @@ class AsciiData(NullData):
         @type delimiter: string
         @param comment_char: string to be used as comment character
         @type comment: string
+        @param cache: keep the parsed data in a binary sidecar file
+        @type cache: integer
         """
         self.ncols = 0
         self.nrows = 0
@@ -123,8 +128,21 @@ class AsciiData(NullData):
         # set the separator
         self._separator = Separator(delimiter)
 
+        # take the data from the binary cache,
+        # or read the file only once
+        lines  = None
+        cached = 0
+        if filename != None and os.path.exists(filename):
+            if cache:
+                cat_cache = CatalogCache(filename, self._null, delimiter,
+                                         self._comment_char)
+                cached = cat_cache.load(self)
+            if not cached:
+                lines = file(filename, 'r').readlines()
+
         # create the header
-        self.header = Header(filename, self._comment_char)
+        if not cached:
+            self.header = Header(filename, self._comment_char, lines)
 
         # check whether a filename is given
         if filename != None:
@@ -144,8 +162,14 @@ class AsciiData(NullData):
                 self.headerComment = 1
 
            # load in all data from the files
-            self.columns = self._load_columns(filename, self._null,
-                                              self._comment_char, self._separator)
+            if not cached:
+                self.columns = self._load_columns(filename, self._null,
+                                                  self._comment_char, self._separator,
+                                                  lines)
+
+                # store the parsed data for the next time
+                if cache:
+                    cat_cache.save(self)
         else:
             # set the filename to none
             self.filename = None
@@ -773,38 +797,43 @@ class AsciiData(NullData):
 
     def sort(self, colname, descending=0, ordered=0):
         """
-        Sorts the entries along the values in one column
+        Sorts the entries along the values in one or several columns
 
         The method sorts all columns of the AsciiData object according
         to the order in one specified column. Both, sorting in ascending
-        and descending order is possible.
-
-        @param colname: the column to use for sorting
-        @type colname: string/integer
-        @param descending: indicates ascending (=0) or descending (=1) sorting
-        @type descending: integer
+        and descending order is possible. For a list of columns the
+        rows are sorted along the first column, rows with equal values
+        along the second column and so on. The sorting is stable.
+
+        @param colname: the column(s) to use for sorting
+        @type colname: string/integer/[string/integer]
+        @param descending: indicates ascending (=0) or descending (=1) sorting, one value or one per column
+        @type descending: integer/[integer]
         @param ordered: indicates ordered (1) or non-ordered sorting
         @type ordered: integer
         """
-        # initialize a temporary array
-        sort_data = []
+        # get the list of sort columns
+        if type(colname) in [types.ListType, types.TupleType]:
+            colnames = colname
+        else:
+            colnames = [colname]
 
-        # transfer the data from the sort column
-        # to the temporary array
-        for index in range(self.nrows):
-            sort_data.append(self[colname][index])
+        # transfer the data from the sort columns
+        sort_cols = []
+        for name in colnames:
+            sort_cols.append(self[name]._data)
 
         # create the sorting index
         sorter = ColumnIndex()
 
-        # sort according to the data in the temporary array
-        sorter.sort(sort_data, descending, ordered)
+        # sort according to the data in the sort columns
+        sorter.multisort(sort_cols, descending)
 
         # go over all colums
         for index in range(self.ncols):
             # reorder the data in the column according
             # to the sorting order
-            self[index]._data = sorter.enindex(self[index]._data)
+            self[index]._data = self[index]._data.take(sorter.index_col)
 
     def rstrip(self,x=None):
         '''
@@ -1008,12 +1037,14 @@ class AsciiData(NullData):
         # return the index
         return index
 
-    def _load_columns(self, filename, null, comment_char, separator):
+    def _load_columns(self, filename, null, comment_char, separator, lines=None):
         """
             Transforms the content of a file into columns
 
         Opens the file, defines the columns, adds all data rows,
-        and returns the columns.
+        and returns the columns. Numeric columns are converted
+        at once by the FastLoader, all other columns are
+        filled element by element.
 
         @param filename: the filename to create the AsciiData from
         @type filename: string
@@ -1023,29 +1054,65 @@ class AsciiData(NullData):
         @type separator: string
         @param comment_char: string to be used as comment character
         @type comment_char: string
+        @param lines: the lines of the file, if already read
+        @type lines: [string]
 
         @return: the columns loaded
         @rtype: [AsciiColumn]
         """
 
-        undef_cols = []
         collist    = []
+        data_lines = []
 
-        # open the file, and parse through all rows
-        for line in file(filename, 'r'):
+        # open the file, unless the lines are given
+        if lines == None:
+            lines = file(filename, 'r')
+
+        # collect all data rows
+        for line in lines:
 
             # throw away trailing and leading whitespaces
             str_line = string.strip(line)
             if len(str_line) < 1 or str_line[0] == comment_char:
                 continue
 
-                # if collumns exist, add a row
-            if collist:
+            data_lines.append(line)
+
+        # no data, no columns
+        if not data_lines:
+            return collist
+
+        # define the columns from the first row
+        collist = self._define_cols(data_lines[0],  null, separator)
+
+        # try to convert whole columns at once
+        columns = FastLoader(null, separator).parse(data_lines)
+        if columns == None or len(columns) != len(collist):
+            # add the rows one by one
+            for line in data_lines[1:]:
                 self._add_row(collist, line,  null, separator)
-                # if columns do not exist, define them
-            else:
-                collist = self._define_cols(line,  null, separator)
 
+            # return the column list
+            return collist
+
+        # go over each column
+        irregular = []
+        for index in range(len(columns)):
+            if columns[index] != None:
+                # set the converted data
+                collist[index].set_data(*columns[index])
+            else:
+                irregular.append(index)
+
+        # add the items of irregular columns one by one
+        if irregular:
+            for line in data_lines[1:]:
+                items = separator.separate(line)
+                for index in irregular:
+                    if null.count(string.strip(items[index])) > 0:
+                        collist[index].add_element(None)
+                    else:
+                        collist[index].add_element(items[index])
 
         # return the column list
         return collist
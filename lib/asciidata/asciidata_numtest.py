@@ -76,6 +76,32 @@ class Test_AsciiNumpy(unittest.TestCase):
         self.assertEqual(numpy_col[2], 'cc')
         self.assertEqual(numpy_col[3], 'dddd')
 
+    def testNoCopy(self):
+        """
+        Test that numeric columns are given to numpy without a copy
+        """
+        import numpy
+
+        # check the numpy types
+        self.assertEqual(self.tdata[0].tonumpy().dtype, numpy.int64)
+        self.assertEqual(self.tdata[1].tonumpy().dtype, numpy.float64)
+
+        # change the numpy object and check the column
+        numpy_col = self.tdata[1].tonumpy()
+        numpy_col[2] = 40.5
+        self.assertEqual(self.tdata[1][2], 40.5)
+
+        # a slice is a view on the column data
+        numpy_col = self.tdata[1][1:3]
+        self.assertEqual(len(numpy_col), 2)
+        self.assertEqual(numpy_col[0], 10.2)
+        numpy_col[0] = 11.5
+        self.assertEqual(self.tdata[1][1], 11.5)
+
+        # the elements are still python types
+        self.assertEqual(type(self.tdata[0][1]), type(1))
+        self.assertEqual(type(self.tdata[1][1]), type(1.0))
+
 
 class Test_AsciiNumpyNone(unittest.TestCase):
     """
@@ -163,6 +189,201 @@ class Test_AsciiNumpyNone(unittest.TestCase):
         self.assertEqual(numpy_col._mask[3], True)
 
 
+class Test_AsciiChunks(unittest.TestCase):
+    """
+    A test class for reading a table in blocks
+    """
+    def setUp(self):
+        """
+        Store a string into a temporary file
+
+        The method creates a named temporary file and writes
+        a string given on input into it.
+        The file reference to the temporary file is returned
+        for further use of it.
+        """
+        import tempfile
+
+        # define the data
+        data = """#   1 NUMBER          Running object number
+#   2 MAG_AUTO        Kron-like elliptical aperture magnitude         [mag]
+#   3 CLASS           Object class
+1  20.0  aaa
+ 13  Null  bb
+# a comment line
+  1  30.33  cc
+ 26  10.44  dddd
+ 27  11  e"""
+
+        # create an open test file
+        self.tfile = tempfile.NamedTemporaryFile()
+
+        # fill data into the test file and flush
+        self.tfile.write(data)
+        self.tfile.flush()
+
+    def testBlocks(self):
+        """
+        Test the number and size of the blocks
+        """
+        # read the table in blocks of two rows
+        blocks = list(asciifunction.iter_chunks(self.tfile.name, chunksize=2))
+
+        # check the number of blocks and rows
+        self.assertEqual(len(blocks), 3)
+        self.assertEqual(len(blocks[0]), 2)
+        self.assertEqual(len(blocks[2]), 1)
+
+        # check the column names from the header
+        self.assertEqual(blocks[0].dtype.names, ('NUMBER', 'MAG_AUTO', 'CLASS'))
+
+    def testValues(self):
+        """
+        Test the values in the blocks against the full table
+        """
+        import numpy
+
+        # read the table in blocks and as a whole
+        blocks = list(asciifunction.iter_chunks(self.tfile.name, chunksize=2))
+        tdata  = asciifunction.open(self.tfile.name)
+
+        # the NULL element is masked
+        self.assert_(isinstance(blocks[0], numpy.ma.MaskedArray))
+        self.assertEqual(blocks[0]['MAG_AUTO'].mask[1], True)
+
+        # compare the values
+        self.assertEqual(blocks[0]['NUMBER'][1], tdata['NUMBER'][1])
+        self.assertEqual(blocks[1]['MAG_AUTO'][0], tdata['MAG_AUTO'][2])
+        self.assertEqual(blocks[1]['CLASS'][1], 'dddd')
+
+        # the integer in the last block is a float
+        self.assertEqual(blocks[2]['MAG_AUTO'].dtype, numpy.float64)
+        self.assertEqual(blocks[2]['MAG_AUTO'][0], 11.0)
+
+
+class Test_AsciiCache(unittest.TestCase):
+    """
+    A test class for the binary cache
+    """
+    def setUp(self):
+        """
+        Store a string into a temporary file
+
+        The method creates a named temporary file and writes
+        a string given on input into it.
+        The file reference to the temporary file is returned
+        for further use of it.
+        """
+        import tempfile
+
+        # define the data
+        data = """#   1 NUMBER          Running object number
+#   2 MAG_AUTO        Kron-like elliptical aperture magnitude         [mag]
+#   3 CLASS           Object class
+1  20.0  aaa
+ 13  Null  bb
+  1  30.33  cc
+ 26  10.44  Null"""
+
+        # create an open test file
+        self.tfile = tempfile.NamedTemporaryFile()
+
+        # fill data into the test file and flush
+        self.tfile.write(data)
+        self.tfile.flush()
+
+    def tearDown(self):
+        """
+        Remove the cache files
+        """
+        for cache_file in [self.tfile.name+'.adcache.npy',
+                           self.tfile.name+'.adcache.json']:
+            if os.path.isfile(cache_file):
+                os.unlink(cache_file)
+
+    def testCache(self):
+        """
+        Test the table from the cache against the parsed table
+        """
+        # parse the table and write the cache
+        tdata = asciifunction.open(self.tfile.name, cache=True)
+        self.assert_(os.path.isfile(self.tfile.name+'.adcache.npy'))
+
+        # load the table from the cache
+        cdata = asciifunction.open(self.tfile.name, cache=True)
+
+        # compare the tables
+        self.assertEqual(cdata.nrows, tdata.nrows)
+        self.assertEqual(str(cdata), str(tdata))
+        for index in range(tdata.ncols):
+            self.assertEqual(cdata[index].colname, tdata[index].colname)
+            self.assertEqual(cdata[index].get_type(), tdata[index].get_type())
+            self.assertEqual(cdata[index].get_unit(), tdata[index].get_unit())
+            for ii in range(tdata.nrows):
+                self.assertEqual(cdata[index][ii], tdata[index][ii])
+
+        # the cached table can be changed
+        cdata[0][0] = 5
+        self.assertEqual(cdata[0][0], 5)
+        cdata.insert(1)
+        self.assertEqual(cdata.nrows, tdata.nrows+1)
+
+    def testChangedFile(self):
+        """
+        Test that a changed table is parsed again
+        """
+        # parse the table and write the cache
+        tdata = asciifunction.open(self.tfile.name, cache=True)
+
+        # add a row
+        self.tfile.write("\n 27  11.0  e")
+        self.tfile.flush()
+
+        # the table must be parsed again
+        cdata = asciifunction.open(self.tfile.name, cache=True)
+        self.assertEqual(cdata.nrows, tdata.nrows+1)
+        self.assertEqual(string.strip(cdata[2][4]), 'e')
+
+    def testTouchedFile(self):
+        """
+        Test that the new time of an unchanged table is cached
+        """
+        import json
+
+        # parse the table and write the cache
+        tdata = asciifunction.open(self.tfile.name, cache=True)
+
+        # only change the modification time
+        mtime = os.stat(self.tfile.name).st_mtime + 10.
+        os.utime(self.tfile.name, (mtime, mtime))
+
+        # the cache is used and has the new time
+        cdata = asciifunction.open(self.tfile.name, cache=True)
+        self.assertEqual(str(cdata), str(tdata))
+        meta = json.load(file(self.tfile.name+'.adcache.json'))
+        self.assertEqual(meta['mtime'], os.stat(self.tfile.name).st_mtime)
+
+    def testLatin1Header(self):
+        """
+        Test a table with latin-1 in the header
+        """
+        # a comment in latin-1
+        self.tfile.seek(0)
+        data = self.tfile.read()
+        self.tfile.seek(0)
+        self.tfile.write("# Fl\xfcsse\n"+data)
+        self.tfile.flush()
+
+        # parse the table and write the cache
+        tdata = asciifunction.open(self.tfile.name, cache=True)
+        self.assert_(os.path.isfile(self.tfile.name+'.adcache.json'))
+
+        # load the table from the cache
+        cdata = asciifunction.open(self.tfile.name, cache=True)
+        self.assertEqual(str(cdata), str(tdata))
+        self.assertEqual(str(cdata.header), str(tdata.header))
+
+
 class Test_AsciiNumarray(unittest.TestCase):
     """
     A test class for the conversion to numarray
@@ -246,6 +467,12 @@ if __name__ == '__main__':
     suite = unittest.makeSuite(Test_AsciiNumpyNone)
     unittest.TextTestRunner(verbosity=2).run(suite)
 
+    suite = unittest.makeSuite(Test_AsciiChunks)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.makeSuite(Test_AsciiCache)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
     suite = unittest.makeSuite(Test_AsciiNumarray)
     unittest.TextTestRunner(verbosity=2).run(suite)
 
@@ -1605,6 +1605,106 @@ class Test_SExData(unittest.TestCase):
         cindex = adata.find('Float2')
         self.assertEqual(cindex, 3)
 
+class Test_FastLoader(unittest.TestCase):
+    """
+    A test class for the fast loading of columns
+    """
+    def setUp(self):
+        """
+        Automatic set up for the class
+
+        set up data used in the tests.
+        setUp is called before each test function execution.
+        """
+        # define the data, with an integer column,
+        # a column which changes from integer to float,
+        # a column with NULL entries and a string column
+        self.data = """    1   10   1.5e3  a
+    2   20    Null  b
+    3  30.5  2.5e3  c
+    4   40   3.5e3  1"""
+
+        # define a test file
+        # delete in case it just exists
+        self.testfile = 'test_file.tmp'
+        if os.path.isfile(self.testfile):
+            os.unlink(self.testfile)
+
+        # open the test file
+        tfile = open(self.testfile, 'w')
+
+        # fill data into the test file
+        tfile.write(self.data)
+
+        #close the test file
+        tfile.close()
+
+        # create the test instance
+        self.tdata = asciifunction.open(self.testfile)
+
+    def tearDown(self):
+        """
+        Automatic destruction after test
+        """
+        # explicitly destroy important class data
+        del self.data
+        del self.tdata
+
+        # remove the file
+        if os.path.isfile(self.testfile):
+            os.unlink(self.testfile)
+
+    def testBasics(self):
+        """
+        Check types, values and formats of the loaded columns
+        """
+        # check the column types
+        self.assertEqual(self.tdata[0].get_type(), type(1))
+        self.assertEqual(self.tdata[1].get_type(), type(1.0))
+        self.assertEqual(self.tdata[2].get_type(), type(1.0))
+        self.assertEqual(self.tdata[3].get_type(), type('test'))
+
+        # check the values
+        self.assertEqual(self.tdata[0][3], 4)
+        self.assertEqual(self.tdata[1][0], 10.0)
+        self.assertEqual(self.tdata[1][2], 30.5)
+        self.assertEqual(self.tdata[2][1], None)
+        self.assertEqual(self.tdata[2][2], 2500.0)
+        self.assertEqual(self.tdata[3][3], '1')
+
+        # the format of the changed column comes
+        # from the first float element
+        self.assertEqual(self.tdata[1].get_format(), '% 4.1f')
+        self.assertEqual(self.tdata[2].get_format(), '% 7.1e')
+
+    def testSameAsElementwise(self):
+        """
+        Check the fast loading against the loading element by element
+        """
+        import asciiloader
+
+        # load the data again without numpy,
+        # this switches off the fast loading
+        numpy = asciiloader.numpy
+        asciiloader.numpy = None
+        try:
+            slow_data = asciifunction.open(self.testfile)
+        finally:
+            asciiloader.numpy = numpy
+
+        # compare the columns
+        for index in range(self.tdata.ncols):
+            self.assertEqual(self.tdata[index].get_type(),
+                             slow_data[index].get_type())
+            self.assertEqual(self.tdata[index].get_format(),
+                             slow_data[index].get_format())
+            for ii in range(self.tdata.nrows):
+                self.assertEqual(self.tdata[index][ii], slow_data[index][ii])
+
+        # compare the output
+        self.assertEqual(str(self.tdata), str(slow_data))
+
+
 class Test_AsciiFits(unittest.TestCase):
     """
     A test class for all fits related methods
@@ -1789,6 +1889,32 @@ class Test_AsciiSort(unittest.TestCase):
         for index in range(1,self.tdata.nrows):
             self.assert_(self.tdata['column2'][index] >= self.tdata['column2'][index-1])
 
+    def testMultiColumnSort(self):
+        """
+        Test for sorting on several columns at once
+        """
+        # execute the sorting command, ascending on the
+        # first and descending on the second column
+        self.tdata.sort([2, 1], [0, 1])
+
+        # go along the column
+        for index in range(1,self.tdata.nrows):
+            value1 = self.tdata[2][index]
+            value2 = self.tdata[2][index-1]
+            # check the sorting on the primary column
+            self.assert_(value1 >= value2)
+
+            # in case of equal values in the primary column
+            if value1 == value2:
+                # check the sorting on the secondary column
+                self.assert_(self.tdata[1][index] <= self.tdata[1][index-1])
+
+        # check the order of the rows
+        self.assertEqual(self.tdata[3][0], 'dd')
+        self.assertEqual(self.tdata[3][1], 'cc')
+        self.assertEqual(self.tdata[3][2], 'bb')
+        self.assertEqual(self.tdata[3][3], 'aa')
+
     def testCharAscSort(self):
         """
         Test for ascending sort on a string column
@@ -2007,6 +2133,9 @@ if __name__ == '__main__':
     suite = unittest.makeSuite(Test_NullData)
     unittest.TextTestRunner(verbosity=2).run(suite)
 
+    suite = unittest.makeSuite(Test_FastLoader)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
     suite = unittest.makeSuite(Test_AsciiFits)
     unittest.TextTestRunner(verbosity=2).run(suite)
 
@@ -14,10 +14,16 @@ $HeadURL: http://astropy.scipy.org/svn/astrolib/trunk/asciidata/Lib/asciifunctio
 __version__ = "Version 1.1 $LastChangedRevision: 234 $"
 
 from asciidata import *
+from asciiloader import ChunkReader
 
-def open(filename, null=None, delimiter=None, comment_char=None):
+def open(filename, null=None, delimiter=None, comment_char=None, cache=False):
     """
     Constructor for the AsciiData class
+
+    With 'cache' set, the parsed table is stored in binary
+    sidecar files next to the table ('<filename>.adcache.npy'
+    and '<filename>.adcache.json') and memory mapped the next
+    time the unchanged table is opened.
     
     @param filename: the filename to create the AsciiData from
     @type filename: string
@@ -27,12 +33,42 @@ def open(filename, null=None, delimiter=None, comment_char=None):
     @type delimiter: string
     @param comment_char: string to be used as comment_char
     @type comment_char: string
+    @param cache: use the binary sidecar cache
+    @type cache: boolean
 
     @return: the created AsciiData instance
     @rtype: AsciiData
     """
     return AsciiData(filename=filename, null=null, delimiter=delimiter,\
-                     comment_char=comment_char)
+                     comment_char=comment_char, cache=cache)
+
+
+def iter_chunks(filename, chunksize=100000, null=None, delimiter=None,
+                comment_char=None):
+    """
+    Iterator over an ascii table in blocks of rows
+
+    The header is parsed once and the table is read in blocks
+    of 'chunksize' rows, each given as numpy structured array
+    (masked array for blocks with NULL elements). The column
+    names are in 'block.dtype.names'.
+
+    @param filename: the filename to read the blocks from
+    @type filename: string
+    @param chunksize: the number of rows in a block
+    @type chunksize: integer
+    @param null: string to be interpretet as NULL
+    @type null: string
+    @param delimiter: string to be used as delimiter
+    @type delimiter: string
+    @param comment_char: string to be used as comment_char
+    @type comment_char: string
+
+    @return: the iterator over the blocks
+    @rtype: ChunkReader
+    """
+    return ChunkReader(filename, chunksize=chunksize, null=null,
+                       delimiter=delimiter, comment_char=comment_char)
 
 
 def create(ncols, nrows, null=None, delimiter=None):
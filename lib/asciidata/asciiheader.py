@@ -27,7 +27,7 @@ class Header(object):
     This additional information may just be present at the
     beginning of the data file or later be added.
     """
-    def __init__(self, filename=None, comment_char=None):
+    def __init__(self, filename=None, comment_char=None, lines=None):
         """
         Constructor for the Header class
 
@@ -35,6 +35,8 @@ class Header(object):
         @type filename: string
         @param comment_char: the comment_char string
         @type comment_char: string
+        @param lines: the lines of the data file, if already read
+        @type lines: [string]
         """
         # store the comment_char
         self._comment_char = comment_char
@@ -59,10 +61,10 @@ class Header(object):
         # retrieve the comment from the data file
         # hdata is the header minus the column info lines
         # in case the header column info is invalid at loading hdata defaults to Fullhdata
-        if filename == None:
+        if filename == None and lines == None:
             self.hdata = []
         else:
-            self.hdata = self._load_header(filename, comment_char)
+            self.hdata = self._load_header(filename, comment_char, lines)
 
         # set the number of elements
         self._nentry = len(self.hdata)
@@ -211,7 +213,7 @@ class Header(object):
 
 
 
-    def _load_header(self, filename, comment_char):
+    def _load_header(self, filename, comment_char, lines=None):
         """
         Loads the header from the data file
 
@@ -219,6 +221,8 @@ class Header(object):
         @type filename: string
         @param comment_char: the comment_char string
         @type comment_char: string
+        @param lines: the lines of the data file, if already read
+        @type lines: [string]
         """
 
         # start the item list
@@ -228,8 +232,11 @@ class Header(object):
         # Define patterns for some common header formats
         commentpattern = re.compile(comment_char)
         sextractor_header = re.compile('^#\s*(\d+)\s+([+*-/()\w]+)([^\[]*)(\[\w+\])?(.*)\n')
-        # open the data file and go over its rows
-        for line in file(filename, 'r'):
+        # open the data file, unless the lines
+        # are given, and go over its rows
+        if lines == None:
+            lines = file(filename, 'r')
+        for line in lines:
             if commentpattern.match(line):
                 #append everything after the comment_char separator to Fullhdata
                 line_with_comment_char_stripped_off = commentpattern.sub('',line,count=1)
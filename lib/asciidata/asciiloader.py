@@ -0,0 +1,393 @@
+"""
+Fast loader for the columns of an ascii table
+
+@license: Gnu Public Licence
+"""
+__version__ = "Version 1.0"
+
+import string, types
+from asciielement import *
+from asciiheader  import *
+from asciiutils   import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class FastLoader(object):
+    """
+    Class to parse the data rows of an ascii table column by column
+
+    Instead of analyzing each item on its own, the column type
+    is guessed from a sample of the column, and all items of
+    the column are converted to integer or float in one numpy call.
+    Columns which can not be converted this way (strings, columns
+    with mixed types, integers too large for 64 bit) are marked as
+    irregular and are left for the item-by-item loading in the
+    AsciiColumn class, so that the result is identical.
+    """
+    def __init__(self, null, separator, sample=100):
+        """
+        The class constructor
+
+        @param null: the strings to be interpreted as NULL
+        @type null: [string]
+        @param separator: the separator to split the lines into items
+        @type separator: Separator
+        @param sample: the number of items used to guess the column type
+        @type sample: integer
+        """
+        self._null      = null
+        self._separator = separator
+        self._sample    = sample
+
+    def parse(self, lines):
+        """
+        Parse the data lines into columns
+
+        For each column either a tuple (data, type, format, mask) is
+        returned, with the data as a numpy array and the mask
+        flagging the NULL items (None if there are none), or None
+        if the column is irregular and must be loaded item by item.
+
+        @param lines: the data lines of the table
+        @type lines: [string]
+
+        @return: the parsed columns, None if the fast loading is not possible
+        @rtype: [(numpy array, <types>-name, [string], numpy array)]
+        """
+        # numpy is needed for the bulk conversion
+        if numpy is None or not lines:
+            return None
+
+        # rows with a different number of items are
+        # reported by the item-by-item loading
+        rows = self.split(lines)
+        if rows == None:
+            return None
+
+        # go over each column
+        columns = []
+        for items in zip(*rows):
+            columns.append(self.parse_column(items))
+
+        return columns
+
+    def split(self, lines):
+        """
+        Split the data lines into stripped items
+
+        @param lines: the data lines of the table
+        @type lines: [string]
+
+        @return: the items of each line, None if the number of items differs
+        @rtype: [[string]]
+        """
+        # split the lines into items
+        if self._separator._delimiter == None:
+            rows = [line.split() for line in lines]
+        else:
+            rows = [map(string.strip, self._separator.separate(line))
+                    for line in lines]
+
+        # check the number of items
+        if len(set(map(len, rows))) != 1:
+            return None
+
+        return rows
+
+    def parse_column(self, items):
+        """
+        Parse the items of one column
+
+        @param items: the stripped items of the column
+        @type items: (string)
+
+        @return: (data, type, format, mask) or None for an irregular column
+        @rtype: (numpy array, <types>-name, [string], numpy array)
+        """
+        # separate the NULL items
+        nullset = set(self._null)
+        if nullset.intersection(items):
+            values = [item for item in items if item not in nullset]
+        else:
+            nullset = None
+            values  = list(items)
+
+        # a column of only NULL items stays undefined
+        if not values:
+            return None
+
+        # guess the column type from the sample
+        coltype = types.IntType
+        for item in values[:self._sample]:
+            coltype = Element(item).get_type()
+            if coltype != types.IntType:
+                break
+        if coltype == types.StringType:
+            return None
+
+        # convert all items at once
+        narray = numpy.array(values)
+        try:
+            if coltype == types.IntType:
+                try:
+                    data = narray.astype(numpy.int64)
+                except ValueError:
+                    # floats further down the column
+                    coltype = types.FloatType
+            if coltype == types.FloatType:
+                data = narray.astype(numpy.float64)
+        except (ValueError, OverflowError):
+            return None
+
+        # the format comes from the first item of the final type,
+        # as when the column type is changed item by item
+        fitem = values[0]
+        if coltype == types.FloatType:
+            for item in values:
+                if Element(item).get_type() == types.FloatType:
+                    fitem = item
+                    break
+        colformat = ForElement(fitem).get_fvalue()
+
+        # put back the NULL items
+        mask = None
+        if nullset:
+            mask = numpy.array([item in nullset for item in items], dtype=bool)
+            values = numpy.zeros(len(items), dtype=data.dtype)
+            values[~mask] = data
+            data = values
+
+        return data, coltype, colformat, mask
+
+
+class ChunkReader(object):
+    """
+    Class to read an ascii table in blocks of rows
+
+    The header is parsed once, then the data rows are read
+    in blocks of 'chunksize' rows. Each block is returned as a
+    numpy structured array with one field per column, named
+    as the columns of an AsciiData object. Blocks with NULL
+    elements are returned as masked arrays. Only one block
+    is kept in memory.
+
+    The column types are taken from the data, and can only
+    become wider from one block to the next (integer to float,
+    numbers to strings). String elements are stripped.
+    """
+    def __init__(self, filename, chunksize=100000, null=None,
+                 delimiter=None, comment_char=None):
+        """
+        The class constructor
+
+        @param filename: the name of the ascii table
+        @type filename: string
+        @param chunksize: the number of rows in a block
+        @type chunksize: integer
+        @param null: string to be interpretet as NULL
+        @type null: string
+        @param delimiter: string to be used as delimiter
+        @type delimiter: string
+        @param comment_char: string to be used as comment character
+        @type comment_char: string
+        """
+        if numpy is None:
+            raise ImportError('The chunk reader needs numpy!')
+
+        # set the default comment_char
+        if comment_char:
+            self._comment_char = comment_char
+        else:
+            self._comment_char = '#'
+
+        # set the default null string
+        if null:
+            self._null = [string.strip(null)]
+        else:
+            self._null  = ['Null', 'NULL', 'None', '*']
+
+        self.filename  = filename
+        self.chunksize = chunksize
+        self.header    = None
+        self.colnames  = None
+
+        self._separator = Separator(delimiter)
+        self._loader    = FastLoader(self._null, self._separator)
+        self._types     = None
+        self._strlen    = None
+
+    def __iter__(self):
+        """
+        Provide the iterator over the blocks
+        """
+        fstream = file(self.filename, 'r')
+        try:
+            # read up to the first data row
+            hlines = []
+            lines  = []
+            for line in fstream:
+                hlines.append(line)
+                if self._is_data(line):
+                    lines.append(line)
+                    break
+
+            # parse the header
+            self.header = Header(self.filename, self._comment_char, hlines)
+
+            # read the blocks
+            for line in fstream:
+                if not self._is_data(line):
+                    continue
+                lines.append(line)
+                if len(lines) >= self.chunksize:
+                    yield self._to_array(lines)
+                    lines = []
+
+            if lines:
+                yield self._to_array(lines)
+        finally:
+            fstream.close()
+
+    def _is_data(self, line):
+        """
+        Whether a line is a data row
+
+        @param line: the line
+        @type line: string
+
+        @return: 1/0
+        @rtype: integer
+        """
+        str_line = string.strip(line)
+        return len(str_line) > 0 and str_line[0] != self._comment_char
+
+    def _set_colnames(self, ncols):
+        """
+        Set the column names from the header
+
+        @param ncols: the number of columns
+        @type ncols: integer
+        """
+        self.colnames = []
+        for index in range(ncols):
+            if self.header.SExtractorFlag:
+                colname = self.header.getCollInfo(index)[0]
+            else:
+                colname = 'column'+str(index+1)
+
+            # field names must be unique
+            if colname in self.colnames:
+                colname = 'column'+str(index+1)
+            self.colnames.append(colname)
+
+        self._types  = ncols * [None]
+        self._strlen = ncols * [1]
+
+    def _to_array(self, lines):
+        """
+        Convert a block of data rows into a structured array
+
+        @param lines: the data rows
+        @type lines: [string]
+
+        @return: the block
+        @rtype: numpy structured/masked array
+        """
+        # split the lines
+        rows = self._loader.split(lines)
+        if self.colnames == None:
+            self._set_colnames(len(self._separator.separate(lines[0])))
+        if rows == None or len(rows[0]) != len(self.colnames):
+            for line in lines:
+                if len(self._separator.separate(line)) != len(self.colnames):
+                    err_msg = "Number of columns does not fit to number of items in " + line
+                    raise Exception(err_msg)
+
+        # convert the columns
+        arrays = []
+        masks  = []
+        for index, items in enumerate(zip(*rows)):
+            data, mask = self._convert(index, items)
+            arrays.append(data)
+            masks.append(mask)
+
+        # assemble the structured array
+        dtype  = [(self.colnames[index], arrays[index].dtype)
+                  for index in range(len(arrays))]
+        narray = numpy.empty(len(rows), dtype=dtype)
+        for index in range(len(arrays)):
+            narray[self.colnames[index]] = arrays[index]
+
+        # check for NULL elements
+        if not [mask for mask in masks if mask is not None]:
+            return narray
+
+        nmask = numpy.zeros(len(rows), dtype=[(name, bool) for name in self.colnames])
+        for index in range(len(masks)):
+            if masks[index] is not None:
+                nmask[self.colnames[index]] = masks[index]
+        return numpy.ma.array(narray, mask=nmask)
+
+    def _convert(self, index, items):
+        """
+        Convert the items of one column in a block
+
+        @param index: the column index
+        @type index: integer
+        @param items: the stripped items
+        @type items: (string)
+
+        @return: the data and the NULL mask (None for no NULL elements)
+        @rtype: (numpy array, numpy array)
+        """
+        coltype = self._types[index]
+        parsed  = None
+        if coltype != types.StringType:
+            parsed = self._loader.parse_column(items)
+
+        if parsed != None:
+            data, ptype, colformat, mask = parsed
+
+            # types only become wider
+            if ptype == types.FloatType or coltype == types.FloatType:
+                self._types[index] = types.FloatType
+                return data.astype(numpy.float64), mask
+            self._types[index] = types.IntType
+            return data, mask
+
+        # find the NULL elements
+        nullset = set(self._null)
+        mask    = numpy.array([item in nullset for item in items], dtype=bool)
+        if not mask.any():
+            mask = None
+
+        # a block of only NULL elements
+        if mask is not None and mask.all():
+            if coltype == None or coltype == types.FloatType:
+                self._types[index] = types.FloatType
+                return numpy.zeros(len(items), dtype=numpy.float64), mask
+            elif coltype == types.IntType:
+                return numpy.zeros(len(items), dtype=numpy.int64), mask
+
+        # very long integers are stored as floats
+        if coltype != types.StringType:
+            try:
+                data = numpy.array(items)
+                if mask is not None:
+                    data[mask] = '0'
+                data = data.astype(numpy.float64)
+                self._types[index] = types.FloatType
+                return data, mask
+            except ValueError:
+                pass
+
+        # all others are strings
+        self._types[index] = types.StringType
+        data = numpy.array(items)
+        if mask is not None:
+            data[mask] = ''
+        self._strlen[index] = max(self._strlen[index], data.dtype.itemsize)
+        return data.astype('S'+str(self._strlen[index])), mask
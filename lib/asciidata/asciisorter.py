@@ -12,6 +12,13 @@ $HeadURL: http://astropy.scipy.org/svn/astrolib/trunk/asciidata/Lib/asciisorter.
 """
 __version__ = "Version 1.0 $LastChangedRevision: 113 $"
 
+import types
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class ColumnIndex(object):
     """
     External column index to allow variations in the index
@@ -92,281 +99,155 @@ class ColumnIndex(object):
         """
         Implementation of a sort algorithm
         
-        The method is a frontend to a sorting algorithm.
-        Under this method it is possible to implement
-        various sorting algortihms, which are called
-        according the specifications of according
-        to the user request.
+        The method is a frontend to the sorting algorithm.
+        The sorting is stable, elements with equal values
+        keep their order, such that the result of previous
+        sortings is NOT unnecessarily disrupted. The 'ordered'
+        flagg is therefore kept only for compatibility.
  
         @param sort_col: the first column to sort for
         @type sort_col: []
         @param descending: boolean to fix ascending (=0) or descending (1) sort order
         @type descending: int
+        @param ordered: indicates ordered (1) or non-ordered sorting
+        @type ordered: int
         """
-        # check whether the index is defined
-        if not self.index_col:
-            # create the initial index
-            self.index_col = range(len(sort_col))
-
-        # check whether ordered sort is requested
-        if ordered:
-            # use the insertion sort for ordered search,
-            # which is rather slow
-            if descending:
-                self._insertion_sort_desc(self.index_col, sort_col)
-            else:
-                self._insertion_sort_asc(self.index_col, sort_col)
-        else:
-            # quick sort is supposed to be rather fast
-            self._rand_quick_sort(self.index_col, sort_col, 0, len(sort_col)-1)
-            if descending:
-                self.index_col.reverse()
-            
+        self.multisort([sort_col], [descending])
 
-        # set the sort flagg
-        self.sorted = 1
- 
 
-    def _quick_sort(self, index_col, sort_col, first, last):
-        """
-        Implementation of the quick sort algorithm
-        
-        An implementation of the classical quick sort algorithm.
-       
-        @param index_col: the index column
-        @type index_col: []
-        @param sort_col: the sort column
-        @type sort_col: []
-        @param first: index to start sorting
-        @type first: int
-        @param last: index to end sorting
-        @type last: int
+    def multisort(self, sort_cols, descending=0):
         """
-        # check whether something has to be ordered
-        if first < last:
-
-            # rearrange the pivot element
-            div_index = self._partition(index_col, sort_col, first, last)
-
-            # sort from start to the pivot elemetn
-            self._quick_sort(index_col, sort_col, first  , div_index-1)
+        Sort along several columns
 
-            # sort from the pivot to the end 
-            self._quick_sort(index_col, sort_col, div_index+1, last  )
-
-
-    def _partition(self, index_col, sort_col, first, last):
-        """
-        Rearrange the array using the last element as pivot
-        
-        The method selects the last element from the sort column
-        as pivot. Then it rearranges the sort column and the index
-        column such that all indices higher than the pivot have
-        higher values and the indices lower than the pivot have lower
-        values, respectively.
-
-        @param index_col: the index column
-        @type index_col: []
-        @param sort_col: the sort column
-        @type sort_col: []
-        @param first: index to start sorting
-        @type first: int
-        @param last: index to end sorting
-        @type last: int
+        The rows are sorted along the first column, rows with
+        equal values in the first column along the second
+        column and so on. 'None' elements are sorted before
+        all other values, as in Python comparisons.
 
-        @return: index of the pivot
-        @rtype: int
+        @param sort_cols: the columns to sort for, the first one is the primary column
+        @type sort_cols: [[]]
+        @param descending: ascending (=0) or descending (=1) sort order, for all columns or a list with one flagg per column
+        @type descending: int/[int]
         """
-        # get the pivot value
-        pivot_value = sort_col[last]
-
-        # intitialize the order index
-        i = first - 1
+        # get one flagg per column
+        if type(descending) not in [types.ListType, types.TupleType]:
+            descending = len(sort_cols) * [descending]
 
-        # go along the whole array
-        for index in range(first, last):
-
-            # check whether the current element
-            # is smaller than the pivot
-            if sort_col[index] <= pivot_value:
-
-                # increase the order index
-                i += 1
+        # check whether the index is defined
+        if not self.index_col:
+            # create the initial index
+            self.index_col = range(len(sort_cols[0]))
 
-                # exchange elements in the sort
-                # and the index column
-                self._exchange_elements(sort_col, index, i)
-                self._exchange_elements(index_col, index, i)
+        # get the sort order
+        order = None
+        if numpy is not None:
+            order = self._numpy_order(sort_cols, descending)
+        if order is None:
+            order = self._list_order(sort_cols, descending)
 
-        # exchange the pivot in the sort
-        # and index column
-        self._exchange_elements(sort_col, last, i+1)
-        self._exchange_elements(index_col, last, i+1)
-            
-        # return the order index
-        return i+1
+        # reorder the index
+        self.index_col = [self.index_col[index] for index in order]
 
+        # set the sort flagg
+        self.sorted = 1
 
-    def _exchange_elements(self, array, index1, index2):
-        """
-        Exchange two elements in a vector
 
-        @param array: the array
-        @type array: []
-        @param index1: first index to exchange
-        @type index1: int
-        @param index2: second index to exchange
-        @type index2: int
+    def _numpy_order(self, sort_cols, descending):
         """
-        # exchange the pivot in the index column
-        tmp = array[index1]
-        array[index1] = array[index2]
-        array[index2] = tmp
-       
+        Find the sort order with numpy
 
-    def _rand_quick_sort(self, index_col, sort_col, first, last):
-        """
-        Implementation of a randomized quick sort algorithm
-        
-        An implementation of the classical quick sort algorithm,
-        however using a random element and NOT the last element
-        as a pivot.
-        
-        @param index_col: the index column
-        @type index_col: []
-        @param sort_col: the sort column
-        @type sort_col: []
-        @param first: index to start sorting
-        @type first: int
-        @param last: index to end sorting
-        @type last: int
-        """
-        # check whether something has to be ordered
-        if first < last:
+        Each column is transformed to integer ranks, which
+        are sorted with a stable lexicographic sort.
 
-            # rearrange the pivot element
-            div_index = self._rand_partition(index_col, sort_col, first, last)
+        @param sort_cols: the columns to sort for
+        @type sort_cols: [[]]
+        @param descending: one sort flagg per column
+        @type descending: [int]
 
-            # sort from start to the pivot elemetn
-            self._rand_quick_sort(index_col, sort_col, first  , div_index-1)
+        @return: the sort order, None if a column can not be ranked
+        @rtype: numpy array
+        """
+        keys = []
+        for index in range(len(sort_cols)):
+            rank = self._rank(sort_cols[index])
+            if rank is None:
+                return None
+            if descending[index]:
+                rank = -rank
+            keys.append(rank)
 
-            # sort from the pivot to the end 
-            self._rand_quick_sort(index_col, sort_col, div_index+1, last  )    
+        # the last key is the primary key for lexsort
+        keys.reverse()
+        return numpy.lexsort(keys)
 
 
-    def _rand_partition(self, index_col, sort_col, first, last):
+    def _rank(self, sort_col):
         """
-        Rearrange the array using the a random element as pivot
+        Transform a column into integer ranks
 
-        The method selects a random element from the sort column
-        as pivot. Then it rearranges the sort column and the index
-        column such that all indices higher than the pivot have
-        higher values and the indices lower than the pivot have lower
-        values, respectively.
+        Equal values get the same rank, 'None' elements
+        get the rank -1.
 
-        @param index_col: the index column
-        @type index_col: []
-        @param sort_col: the sort column
+        @param sort_col: the column
         @type sort_col: []
-        @param first: index to start sorting
-        @type first: int
-        @param last: index to end sorting
-        @type last: int
 
-        @return: index of the pivot
-        @rtype: int
+        @return: the ranks, None if the column can not be ranked
+        @rtype: numpy array
         """
-        import random
-        
-        # get a random index
-        rand_index = random.randint(first, last)
+        # get a numpy object from the column
+        if hasattr(sort_col, 'tonumpy'):
+            sort_col = sort_col.tonumpy()
+
+        # separate the 'None' elements
+        if isinstance(sort_col, numpy.ma.MaskedArray):
+            mask   = numpy.ma.getmaskarray(sort_col)
+            values = numpy.asarray(sort_col.data)
+        else:
+            values = numpy.asarray(sort_col)
+            mask   = None
+            if values.dtype == object:
+                mask = numpy.array([item is None for item in values], dtype=bool)
 
-        # exchange the last element with the
-        # one at the random index
-        self._exchange_elements(sort_col, rand_index, last)
-        self._exchange_elements(index_col, rand_index, last)
+        if mask is not None:
+            values = values[~mask]
+            if values.dtype == object:
+                values = numpy.array(values.tolist())
 
-        # perform the usual rearranging
-        # and return the index of the pivot
-        return self._partition(index_col, sort_col, first, last)
+        # mixed types are left to Python
+        if values.dtype == object or values.ndim != 1:
+            return None
 
+        # get the ranks of the values
+        inverse = numpy.unique(values, return_inverse=True)[1]
+        if mask is None:
+            return inverse
 
-    def _insertion_sort_asc(self, index_col, sort_col):
-        """
-        The ascending insertion sort algorithm
+        rank = -numpy.ones(len(mask), dtype=inverse.dtype)
+        rank[~mask] = inverse
+        return rank
 
-        An implementation of the insertion sort algortihm. This algorithm
-        sort in ASCENDING order.
-        It is suited for order sequences. The result of previous sortings
-        is NOT unnecessarily disrupted.
 
-        @param index_col: the index column
-        @type index_col: []
-        @param sort_col: the sort column
-        @type sort_col: []
+    def _list_order(self, sort_cols, descending):
         """
-        # go along the array
-        for jj in range(1, len(index_col)):
-            
-            # choose the current element
-            sort_key  = sort_col[jj]
-            index_key = index_col[jj]
+        Find the sort order with Python sorting
 
-            # select the position before
-            # and place the current element
-            # into that sub-array
-            ii = jj - 1
-            while ii > -1 and sort_col[ii] > sort_key:
+        The stable Python sort is applied for each column,
+        from the last to the primary column.
 
-                # move the element to the left
-                sort_col[ii+1]  = sort_col[ii]
-                index_col[ii+1] = index_col[ii]
-                
-                # decrease the index
-                ii -= 1
+        @param sort_cols: the columns to sort for
+        @type sort_cols: [[]]
+        @param descending: one sort flagg per column
+        @type descending: [int]
 
-            # place the current element
-            sort_col[ii+1]  = sort_key
-            index_col[ii+1] = index_key
-
-
-    def _insertion_sort_desc(self, index_col, sort_col):
+        @return: the sort order
+        @rtype: [int]
         """
-        The descending insertion sort algorithm
-    
-        An implementation of the insertion sort algortihm. This algorithm
-        sort in DESCENDING order.
-        It is suited for order sequences. The result of previous sortings
-        is NOT unnecessarily disrupted.
-
-        @param index_col: the index column
-        @type index_col: []
-        @param sort_col: the sort column
-        @type sort_col: []
-        """
-        # go along the array
-        for jj in range(1, len(index_col)):
-            
-            # choose the current element
-            sort_key  = sort_col[jj]
-            index_key = index_col[jj]
-
-            # select the position before
-            # and place the current element
-            # into that sub-array
-            ii = jj - 1
-            while ii > -1 and sort_col[ii] < sort_key:
-
-                # move the element to the left
-                sort_col[ii+1]  = sort_col[ii]
-                index_col[ii+1] = index_col[ii]
-                
-                # decrease the index
-                ii -= 1
-
-            # place the current element
-            sort_col[ii+1]  = sort_key
-            index_col[ii+1] = index_key
+        order = range(len(sort_cols[0]))
+        for index in range(len(sort_cols)-1, -1, -1):
+            sort_col = sort_cols[index]
+            order.sort(key=lambda row: sort_col[row],
+                       reverse=bool(descending[index]))
+        return order
 
 
     def deindex(self, array):
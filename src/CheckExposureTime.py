@@ -7,7 +7,7 @@ So I need to check for these and raise flags
 '''
 
 
-import pyfits as fits
+import header_index as header_index
 import glob as glob
 import numpy as np
 import os as os
@@ -21,15 +21,16 @@ def CheckExposureTime( sort=False):
     '''
     RawFitsFiles = np.array(glob.glob('j*_raw.fits'))
 
+    headers = header_index.read_headers( list(RawFitsFiles) )
+
     ExposureTime = []
     
     for iFits in RawFitsFiles:
 
-        RawFits = fits.open(iFits)
-        ExposureTime.append(RawFits[0].header['EXPTIME'])
-        if RawFits[0].header['EXPTIME'] == 0:
+        ExposureTime.append(headers[iFits]['EXPTIME'])
+        if headers[iFits]['EXPTIME'] == 0:
             print('Failed Exposure Time (%s: %s)' \
-                    % (iFits, RawFits[0].header['EXPTIME']))
+                    % (iFits, headers[iFits]['EXPTIME']))
 
     if np.any(np.array(ExposureTime)) == 0:
         raise ValueError("Found exposures with 0 exposure time, please remove")
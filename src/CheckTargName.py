@@ -1,4 +1,4 @@
-import pyfits as fits
+import header_index as header_index
 import glob as glob
 import numpy as np
 import os as os
@@ -13,14 +13,15 @@ def CheckTargName( sort=False):
     
     RawFitsFiles = np.array(glob.glob('j*_raw.fits'))
 
+    headers = header_index.read_headers( list(RawFitsFiles) )
+
     TargNames = []
     
     for iFits in RawFitsFiles:
 
-        RawFits = fits.open(iFits)
-        TargNames.append(RawFits[0].header['TARGNAME'])
+        TargNames.append(headers[iFits]['TARGNAME'])
         
-        print('%s: %s' % (iFits, RawFits[0].header['TARGNAME']))
+        print('%s: %s' % (iFits, headers[iFits]['TARGNAME']))
 
     TargNames = np.array(TargNames)
     if not np.all(np.array(TargNames) == TargNames[0]):
@@ -6,6 +6,9 @@
 
 
 import sys, os
+import shutil
+import tempfile
+import time
 
 import numpy as np 
 from astropy.io import fits
@@ -17,13 +20,27 @@ from arctic_prg import arctic_prg
 
 
 class ACS_image( object ):
-    def __init__( self, filename, args, verbose=False, dark_mode=False, action='full' ):
+    def __init__( self, filename, args, verbose=False, dark_mode=False, action='full',
+                  tmp_dir=None, workers=1 ):
         self._filename     = filename
         self._args         = args
         self._dark_mode    = dark_mode
         self._action       = action
         self._verbose      = verbose
 
+        # number of amplifiers corrected at the same time
+        self._workers      = max( 1, int( workers ) )
+
+        # scratch directory for the single amplifier images,
+        # by default in memory (/dev/shm) so the split images
+        # never touch the (network) disk of the data
+        if tmp_dir is None:
+            tmp_dir = os.environ.get( 'ARCTIC_TMPDIR', None )
+        if ( tmp_dir is None ) and os.access( '/dev/shm', os.W_OK ):
+            tmp_dir = '/dev/shm'
+        self._tmp_dir      = tmp_dir
+        self._workdir      = None
+
         # filename parts
         self._basename     = ''
         self._prefix       = ''
@@ -56,6 +73,15 @@ class ACS_image( object ):
         return t.jd
 
     
+    def _amp_name( self, kind, amp ):
+        # name of a single amplifier image, in the scratch
+        # directory for a full run, next to the image otherwise
+        name = self._basename + '_' + kind + amp + '.' + self._suffix
+        if ( self._workdir is not None ):
+            name = os.path.join( self._workdir, os.path.basename( name ) )
+        return name
+
+    
     def _split_image( self, data, header, amps ):
 
         # check image units
@@ -89,8 +115,8 @@ class ACS_image( object ):
         if ( amps == 'AB' ):
             data = data[::-1]
         
-        # left image
-        fname = self._basename + '_' + self._prefix + amps[0] + '.' + self._suffix
+        # left image, the quadrants and flips are views of data
+        fname = self._amp_name( self._prefix, amps[0] )
 
         left_image = data[:,0:split_x]
 
@@ -103,7 +129,7 @@ class ACS_image( object ):
 
 
         # right image
-        fname = self._basename + '_' + self._prefix + amps[1] + '.' + self._suffix
+        fname = self._amp_name( self._prefix, amps[1] )
         
         right_image = data[:,split_x:data.shape[1]]
 
@@ -119,29 +145,35 @@ class ACS_image( object ):
 
     def _unsplit_image( self, amps, orig_header ):
 
-        left_name  = self._basename + '_' + 'cte' + amps[0] + '.' + self._suffix
-        right_name = self._basename + '_' + 'cte' + amps[1] + '.' + self._suffix
+        left_name  = self._amp_name( 'cte', amps[0] )
+        right_name = self._amp_name( 'cte', amps[1] )
 
         print( '  Loading left image %s ...' % left_name ),
-        left_image  = fits.open( left_name, 'readonly' )
+        left_image  = fits.open( left_name, 'readonly', memmap=True )
         print( 'Done.' )
 
         print( '  Loading right image %s ...' % right_name ),
-        right_image = fits.open( right_name, 'readonly' )
+        right_image = fits.open( right_name, 'readonly', memmap=True )
         print( 'Done.' )
 
         print( '  Reorganizing data (amplifier %s) ...' % amps ),
         left_data  = left_image[0].data
         right_data = right_image[0].data
 
-        # reverse right image
-        right_data = right_data[:,::-1]
-
-        data = np.append( left_data, right_data, axis=1 )
+        # fill the chip directly, rather than appending and
+        # flipping copies: the right image is reversed and
+        # the upper image (AB) is flipped by writing through views
+        split_x = left_data.shape[1]
+        data = np.empty( ( left_data.shape[0], split_x + right_data.shape[1] ),
+                         dtype=left_data.dtype )
 
-        # flip if this is the upper image
         if ( amps == 'AB' ):
-            data = data[::-1]
+            chip = data[::-1]
+        else:
+            chip = data
+
+        chip[:,0:split_x] = left_data
+        chip[:,split_x:]  = right_data[:,::-1]
 
 
         # correct units
@@ -264,13 +296,12 @@ class ACS_image( object ):
 
         print( ' Correcting ACS sub images ...')
         prg = arctic_prg( self._args )
-            
+
+        todo = []
         for chip in 'ABCD':
-            ifname = self._basename + '_' + self._prefix + chip + '.' + self._suffix
-            ofname = self._basename + '_' + 'cte' + chip + '.' + self._suffix
+            ifname = self._amp_name( self._prefix, chip )
+            ofname = self._amp_name( 'cte', chip )
 
-            print( '  Correcting image %s ...' % ifname )
-            
             #print ifname, ofname
             
             if ( os.access( ifname, os.R_OK ) ):
@@ -279,15 +310,51 @@ class ACS_image( object ):
                 print( 'WARNING: Can\'t access \'%s\'! Splitting was incorrect!' % ifname )
                 return -1
 
-            ret = prg.execute( ifname, ofname )
+            todo.append( ( chip, ifname, ofname ) )
 
-            if ( os.access( ofname, os.R_OK ) ):
-                pass
-            else:
-                print( 'WARNING: Can\'t access \'%s\'! Correction was not successful!' % ofname )
-                return -1
 
-            print( '  Done.' )
+        # the four amplifiers are independent, so up to
+        # self._workers arctic processes are run at once
+        running = []
+        failed  = []
+        while ( len( todo ) > 0 ) or ( len( running ) > 0 ):
+
+            while ( len( failed ) == 0 ) and ( len( todo ) > 0 ) \
+                    and ( len( running ) < self._workers ):
+                chip, ifname, ofname = todo.pop( 0 )
+                print( '  Correcting image %s ...' % ifname )
+                running.append( ( chip, ifname, ofname, prg.start( ifname, ofname ) ) )
+
+            if ( len( failed ) > 0 ):
+                # fail fast, stop the other amplifiers
+                for chip, ifname, ofname, proc in running:
+                    if ( proc.poll() is None ):
+                        proc.terminate()
+                    proc.wait()
+                break
+
+            time.sleep( 0.1 )
+
+            for job in list( running ):
+                chip, ifname, ofname, proc = job
+                ret = proc.poll()
+                if ( ret is None ):
+                    continue
+
+                running.remove( job )
+
+                if ( ret != 0 ):
+                    print( 'WARNING: arctic failed on amplifier %s (\'%s\') with return code %i!' % ( chip, ifname, ret ) )
+                    failed.append( chip )
+                elif ( os.access( ofname, os.R_OK ) ):
+                    print( '  Done amplifier %s.' % chip )
+                else:
+                    print( 'WARNING: Can\'t access \'%s\'! Correction of amplifier %s was not successful!' % ( ofname, chip ) )
+                    failed.append( chip )
+
+        if ( len( failed ) > 0 ):
+            print( 'WARNING: Correction failed for amplifier(s) %s!' % ', '.join( failed ) )
+            return -1
 
         print( ' Done.' )
             
@@ -310,13 +377,22 @@ class ACS_image( object ):
             print( '  suffix   = %s' %  self._suffix )
 
         if ( self._action == 'full' ):
-            ret = self.split() 
-
-            if ( ret == 0 ):
-                ret = self.correct()
-
-            if ( ret == 0 ):
-                ret = self.unsplit()
+            # the single amplifier images only live for this run
+            self._workdir = tempfile.mkdtemp( prefix='arctic_', dir=self._tmp_dir )
+            if self._verbose:
+                print( '  scratch    = %s' % self._workdir )
+
+            try:
+                ret = self.split() 
+
+                if ( ret == 0 ):
+                    ret = self.correct()
+
+                if ( ret == 0 ):
+                    ret = self.unsplit()
+            finally:
+                shutil.rmtree( self._workdir, ignore_errors=True )
+                self._workdir = None
         elif ( self._action == 'split' ):
              ret = self.split()
         elif ( self._action == 'unsplit' ):
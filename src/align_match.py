@@ -0,0 +1,210 @@
+'''
+align_match.py
+
+A fast first guess of the offset of each drizzled visit to the
+reference catalogue, to seed TweakReg in drizzle.drizzle_fields.
+
+Left to itself TweakReg finds the offset from a histogram of the
+offsets within searchrad, which fails when the images hardly
+overlap or the offset is larger than searchrad (see
+docs/ALIGNING_IMAGES.TXT), and each failed attempt costs minutes.
+Here the brightest sources of the _sex.cat catalogue of each visit
+and of reference.cat are put in the pixel frame of the reference
+image, and the offset is the peak of the 2d histogram of the
+offsets of all pairs of sources over a much larger search box. A
+small range of rotations about the centre of the reference image
+is tried as well and the one with the most significant peak is
+kept. For a few hundred sources this takes milliseconds.
+
+The offsets follow TweakReg : image - reference in pixels of the
+reference frame, so they are given to TweakReg as xoffset and
+yoffset (with use2dhist=False). TweakReg is not given the rotation,
+so its tolerance has to allow for the rotation times the radius of
+the sources from the centre (see seed_tolerance).
+
+Usage :
+    offsets = align_match.match_offsets( 'catfile', 'reference.cat',
+                                         '1_drz_sci.fits' )
+    print offsets['2_drz_sci.fits']['xoffset']
+
+'''
+import numpy as np
+
+#the number of brightest sources of each catalogue used
+default_nsources = 300
+
+#a peak has to be this many sigma above the background of
+#chance pairs in the histogram to be trusted
+default_min_significance = 5.
+
+
+def read_catfile( catfile_name ):
+    '''
+    Read the TweakReg catfile
+
+    OUTPUT : a list of (image, catalogue) pairs in the order of the file
+    '''
+    pairs = []
+    for iLine in open( catfile_name ):
+        iLine = iLine.split()
+        if len(iLine) > 1:
+            pairs.append( (iLine[0], iLine[1]) )
+
+    return pairs
+
+def read_catalogue( cat_name, xcol=1, ycol=2, fluxcol=3,
+                    nsources=default_nsources ):
+    '''
+    Read the positions of the brightest sources of a sextractor
+    ascii catalogue, the columns are counted from 1 as in TweakReg
+
+    OUTPUT : the x and y (or ra and dec) of the sources
+    '''
+    cat = np.loadtxt( cat_name, usecols=(xcol-1, ycol-1, fluxcol-1),
+                      ndmin=2 )
+
+    brightest = np.argsort( -cat[:, 2], kind='mergesort' )[:nsources]
+
+    return cat[brightest, 0], cat[brightest, 1]
+
+def histogram_offset( xy, ref_xy, max_shift, bin_size=1. ):
+    '''
+    The offset of xy to ref_xy from the peak of the 2d histogram of
+    the offsets of all pairs of positions within max_shift
+
+    INPUT : XY : an (N, 2) array of positions
+            REF_XY : an (M, 2) array of reference positions
+            MAX_SHIFT : the largest offset searched (pixels)
+
+    OUTPUT : the offset in x and y, the number of pairs in the peak
+             and its significance above the chance pairs
+    '''
+    dx = ( xy[:, 0][:, np.newaxis] - ref_xy[:, 0][np.newaxis, :] ).ravel()
+    dy = ( xy[:, 1][:, np.newaxis] - ref_xy[:, 1][np.newaxis, :] ).ravel()
+    near = ( np.abs(dx) < max_shift ) & ( np.abs(dy) < max_shift )
+    dx = dx[near]
+    dy = dy[near]
+
+    if len(dx) == 0:
+        return 0., 0., 0, 0.
+
+    nbins = int( np.ceil( 2.*max_shift / bin_size ) )
+    hist, xedges, yedges = np.histogram2d( dx, dy, bins=nbins,
+                                           range=[[-max_shift, max_shift],
+                                                  [-max_shift, max_shift]] )
+
+    #the peak summed over 2x2 bins, so a peak split over bins is found
+    hist2 = hist[:-1, :-1] + hist[1:, :-1] + hist[:-1, 1:] + hist[1:, 1:]
+    iPeak, jPeak = np.unravel_index( np.argmax( hist2 ), hist2.shape )
+
+    #refine to the mean offset of the pairs in the peak
+    inPeak = ( dx >= xedges[iPeak] ) & ( dx < xedges[iPeak+2] ) & \
+        ( dy >= yedges[jPeak] ) & ( dy < yedges[jPeak+2] )
+    npeak = inPeak.sum()
+
+    #the expected number of chance pairs in 2x2 bins
+    background = 4.*len(dx) / float(nbins*nbins)
+    significance = ( npeak - background ) / np.sqrt( background + 1. )
+
+    return dx[inPeak].mean(), dy[inPeak].mean(), npeak, significance
+
+def rotate( xy, angle, centre ):
+    '''
+    Rotate the positions by angle (degrees) about the centre
+    '''
+    angle = np.radians( angle )
+    x = xy[:, 0] - centre[0]
+    y = xy[:, 1] - centre[1]
+
+    return np.column_stack( ( centre[0] + np.cos(angle)*x - np.sin(angle)*y,
+                              centre[1] + np.sin(angle)*x + np.cos(angle)*y ) )
+
+def find_offset( xy, ref_xy, max_shift, centre=(0., 0.),
+                 max_rotation=0.5, rotation_step=0.05, bin_size=1. ):
+    '''
+    The offset and rotation of xy to ref_xy
+
+    Each rotation from -max_rotation to max_rotation (degrees) about
+    the centre is tried and the offset is taken at the rotation
+    with the most significant peak
+
+    OUTPUT : a dictionary of xoffset, yoffset, rotation, npeak,
+             significance and radius, the largest distance of the
+             sources from the centre (pixels)
+    '''
+    best = None
+    nsteps = int( round( max_rotation / rotation_step ) ) if rotation_step > 0 else 0
+    for iRotation in np.arange( -nsteps, nsteps+1 )*rotation_step:
+        dx, dy, npeak, significance = \
+            histogram_offset( rotate( xy, iRotation, centre ), ref_xy,
+                              max_shift, bin_size=bin_size )
+        if best is None or significance > best['significance']:
+            best = {'xoffset':dx, 'yoffset':dy, 'rotation':iRotation,
+                    'npeak':npeak, 'significance':significance}
+
+    if len(xy) > 0:
+        best['radius'] = np.hypot( xy[:, 0] - centre[0], xy[:, 1] - centre[1] ).max()
+    else:
+        best['radius'] = 0.
+
+    return best
+
+def seed_tolerance( offset, tolerance ):
+    '''
+    The tolerance (pixels) for TweakReg seeded with an offset but
+    not its rotation : the sources furthest from the centre are off
+    by up to the rotation times their radius
+    '''
+    return tolerance + np.abs( np.radians( offset['rotation'] ) )*offset['radius']
+
+def match_offsets( catfile_name, refcat_name, refimage, max_shift=5.,
+                   nsources=default_nsources,
+                   min_significance=default_min_significance ):
+    '''
+    Find the offset of each image in the catfile to the reference
+    catalogue
+
+    INPUT : CATFILE_NAME : the TweakReg catfile of the images and
+                           their pixel (X_IMAGE, Y_IMAGE) catalogues
+            REFCAT_NAME : the reference catalogue (X_WORLD, Y_WORLD)
+            REFIMAGE : the image defining the reference frame
+
+    KEYWORDS :
+            MAX_SHIFT : the largest offset searched (arcseconds)
+            NSOURCES : the number of brightest sources used
+            MIN_SIGNIFICANCE : the significance of the peak for
+                               an offset to be trusted
+
+    OUTPUT : a dictionary of image --> dictionary of the xoffset,
+             yoffset (pixels of the reference frame), rotation (degrees),
+             npeak and significance of the match, the radius of the
+             sources from the centre and whether it is trusted ('found')
+    '''
+    from stwcs import wcsutil
+
+    refwcs = wcsutil.HSTWCS( refimage )
+    max_shift_pix = max_shift / refwcs.pscale
+
+    ra, dec = read_catalogue( refcat_name, nsources=nsources )
+    ref_xy = np.column_stack( refwcs.all_world2pix( ra, dec, 1 ) )
+
+    centre = ( refwcs.wcs.crpix[0], refwcs.wcs.crpix[1] )
+
+    offsets = {}
+    for iImage, iCat in read_catfile( catfile_name ):
+        x, y = read_catalogue( iCat, nsources=nsources )
+        iWcs = wcsutil.HSTWCS( iImage )
+        ra, dec = iWcs.all_pix2world( x, y, 1 )
+        xy = np.column_stack( refwcs.all_world2pix( ra, dec, 1 ) )
+
+        offsets[iImage] = find_offset( xy, ref_xy, max_shift_pix, centre=centre )
+        offsets[iImage]['found'] = \
+            offsets[iImage]['significance'] >= min_significance
+
+        print 'Initial offset of %s : %0.2f %0.2f pixels, %0.2f deg ' \
+            '(%i pairs, %0.1f sigma)' % \
+            (iImage, offsets[iImage]['xoffset'], offsets[iImage]['yoffset'],
+             offsets[iImage]['rotation'], offsets[iImage]['npeak'],
+             offsets[iImage]['significance'])
+
+    return offsets
@@ -42,10 +42,21 @@ class arctic_prg( object ):
         
 
 
-    def execute( self, infile, outfile ):
+    def _get_cmd( self, infile, outfile ):
         args = ' '.join( self._args )
-        cmd = self._cmd + ' ' + args + ' ' + infile + ' ' + outfile
+        return self._cmd + ' ' + args + ' ' + infile + ' ' + outfile
+
+
+    def execute( self, infile, outfile ):
+        cmd = self._get_cmd( infile, outfile )
         ret = subprocess.call( cmd, shell=True )
         return ret 
 
+
+    def start( self, infile, outfile ):
+        # start the correction without waiting for it,
+        # exec so that terminate() reaches arctic itself
+        cmd = 'exec ' + self._get_cmd( infile, outfile )
+        return subprocess.Popen( cmd, shell=True )
+
         
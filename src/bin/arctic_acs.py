@@ -13,6 +13,8 @@ from acs_image import *
 
 verbose     = False
 action      = 'full'
+tmp_dir     = None
+workers     = 1
 arctic_args = []
 
 # check for parameters
@@ -24,7 +26,7 @@ def syntax( exitcode=0 ):
 if ( len( sys.argv ) < 1 ):
     syntax()
 
-long_options = ['neo', 'action=']   # example [ 'h1=']
+long_options = ['neo', 'action=', 'tmpdir=', 'workers=']   # example [ 'h1=']
 
 try:
     opts, args = getopt.gnu_getopt( sys.argv[1:], 'h?d:c:m:v', long_options )
@@ -49,12 +51,17 @@ for key,val in opts:
         arctic_args.append( '-neo' )
     elif ( key == '--action' ):
         action = val
+    elif ( key == '--tmpdir' ):
+        tmp_dir = val
+    elif ( key == '--workers' ):
+        workers = int( val )
 
 
 
 # main
 
 for fname in args:
-    image = ACS_image( fname, arctic_args, verbose=verbose, action=action )
+    image = ACS_image( fname, arctic_args, verbose=verbose, action=action,
+                       tmp_dir=tmp_dir, workers=workers )
     image.run()
 
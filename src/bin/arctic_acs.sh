@@ -1,3 +1,4 @@
 #!/bin/sh
 export infile=${1}
+shift
 arctic_acs.py -m ACS ${infile} $*
@@ -12,7 +12,9 @@ import glob as glob
 import get_acs_reffiles as gar
 import multi_to_single_fits as mts
 import run_arctic as rc
-def cte_correct( files='j*q_raw.fits', idl=True ):
+import instrument as instrument
+def cte_correct( files='j*q_raw.fits', idl=True, amp_workers=1,
+                 reffiles_manifest=None ):
     '''
     This code will loop through each file and correct the cte
     for each image
@@ -22,6 +24,11 @@ def cte_correct( files='j*q_raw.fits', idl=True ):
     KEYWORDS :
            idl : use the idl version of the cte correction,
                  note, that the diretory 'bin' here needs to be in the idl path
+           amp_workers : the number of amplifiers arctic corrects at the
+                 same time (up to 4, not used by the idl version)
+           reffiles_manifest : the manifest written by get_acs_reffiles.plan_acs_reffiles.
+                 If given the bias files have already been fetched for all
+                 the exposures and only this exposure's are linked in
     DEPENDENCIES : ACS-CTE Correction Binary in the PATH
     '''
     code_dir = '/'.join(os.path.abspath(__file__).split('/')[:-1])
@@ -34,18 +41,26 @@ def cte_correct( files='j*q_raw.fits', idl=True ):
             cte_file = iRaw_File[:-9]+"_cte.fits"
             out_file = iRaw_File[:-9]+"_cte_raw.fits"
             if not os.path.isfile( out_file ):
-                gar.get_acs_reffiles( iRaw_File, ext='bia', add_jref=False)
-                #The bias files cant be in the jref directory for the idl
-                if os.environ['jref'] != './':
-                    os.system('cp '+os.environ['jref']+'/*bia* .')
-                os.system( idl_command+' '+iRaw_File[:-9] )
-                os.system( "mv "+cte_file+" "+out_file)
+                with instrument.stage('cte', exposure=iRaw_File):
+                    if reffiles_manifest is None:
+                        gar.get_acs_reffiles( iRaw_File, ext='bia', add_jref=False)
+                        #The bias files cant be in the jref directory for the idl
+                        if os.environ['jref'] != './':
+                            os.system('cp '+os.environ['jref']+'/*bia* .')
+                    elif os.environ['jref'] != './':
+                        manifest = gar.read_manifest( reffiles_manifest )
+                        for iBias in manifest['exposures'][iRaw_File]:
+                            if not os.path.isfile( os.path.basename(iBias) ):
+                                os.system('cp '+iBias+' .')
+                    os.system( idl_command+' '+iRaw_File[:-9] )
+                    os.system( "mv "+cte_file+" "+out_file)
     else:
         for iRaw_File in glob.glob(files):
             out_file = iRaw_File[:-9]+"_cte_raw.fits"
             if not os.path.isfile( out_file ):
                 #Arctic cannot run multi-extension fits yet
-                rc.run_arctic( iRaw_File, out_file)
+                with instrument.stage('cte', exposure=iRaw_File):
+                    rc.run_arctic( iRaw_File, out_file, amp_workers=amp_workers)
                 
             else:
                 print("%s already corrected for CTE " %
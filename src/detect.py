@@ -0,0 +1,478 @@
+'''
+detect.py
+
+An in-process source detection for the TweakReg alignment
+catalogues, as an alternative to running sextractor through pysex.
+
+The tweak catalogues only need the position and flux of the bright
+compact sources (see tweak_sex/tweak.param), so instead of writing
+the config, filter and nnw files and forking sextractor for every
+drizzled image the detection is done on the (memory mapped) image
+with numpy :
+
+    1. A background and rms mesh of BACK_SIZE pixels, each cell
+       sigma clipped and its mode estimated as in sextractor, median
+       filtered over BACK_FILTERSIZE cells and interpolated back to
+       each pixel
+    2. A matched filter, the convolution of the background subtracted
+       image with the FILTER_NAME kernel (gauss_5.0_9x9.conv)
+    3. The pixels of the filtered image above DETECT_THRESH sigma,
+       grouped into 8-connected sources of at least DETECT_MINAREA
+       pixels
+    4. The flux weighted centroid (X_IMAGE, Y_IMAGE, 1 based as
+       sextractor) and the summed flux (FLUX_AUTO) of each source
+
+The settings are read from the same sextractor config as pysex uses
+so both give comparable catalogues. There is no deblending of
+touching sources and FLUX_AUTO is the isophotal flux, which is
+enough for matching the catalogues in TweakReg.
+
+Images larger than a tile (e.g. the final mosaics, which are tens
+of thousands of pixels a side) are detected in overlapping tiles in
+a pool of threads, see detect_tiled, so the memory is bounded by the
+size of a tile and the detection scales with the number of cores.
+
+Usage :
+    cat = detect.run('1_drz_sci.fits', cat_name='1_drz_sci_sex.cat',
+                     conf_file='tweak_sex/tweak.sex')
+    print cat['X_IMAGE'], cat['Y_IMAGE'], cat['FLUX_AUTO']
+
+'''
+import os as os
+import numpy as np
+import pyfits as fits
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+from scipy import ndimage as ndimage
+from scipy import spatial as spatial
+
+#the settings used from the sextractor config and their defaults
+default_conf = {'DETECT_THRESH':1.5, 'DETECT_MINAREA':5,
+                'BACK_SIZE':64, 'BACK_FILTERSIZE':3,
+                'FILTER':'Y', 'FILTER_NAME':None}
+
+#the columns of the catalogues, in the order of tweak.param
+catalogue_params = ['X_IMAGE', 'Y_IMAGE', 'FLUX_AUTO', 'NUMBER']
+
+#the size of the tiles (without the overlap) and the overlap
+#between neighbouring tiles in pixels, which has to be larger
+#than the sources
+default_tile_size = 4096
+default_overlap = 256
+
+
+def read_conf( conf_file=None, conf_args={} ):
+    '''
+    Read the detection settings from a sextractor config file
+
+    INPUT : CONF_FILE : the sextractor config, None for the defaults
+            CONF_ARGS : a dictionary of settings overriding the file
+
+    OUTPUT : a dictionary of the settings in default_conf
+    '''
+    conf = dict(default_conf)
+
+    if conf_file is not None:
+        for iLine in open( conf_file ):
+            iLine = iLine.split('#')[0].split()
+            if len(iLine) > 1 and iLine[0] in conf:
+                conf[iLine[0]] = iLine[1]
+
+    for iKey in conf_args:
+        if iKey in conf:
+            conf[iKey] = conf_args[iKey]
+
+    #a relative filter is next to the config
+    if conf['FILTER_NAME'] is not None and conf_file is not None and \
+            not os.path.isabs( conf['FILTER_NAME'] ) and \
+            not os.path.isfile( conf['FILTER_NAME'] ):
+        conf['FILTER_NAME'] = os.path.join( os.path.dirname( conf_file ),
+                                            conf['FILTER_NAME'] )
+
+    for iKey in ['DETECT_THRESH']:
+        conf[iKey] = float( conf[iKey] )
+    for iKey in ['DETECT_MINAREA', 'BACK_SIZE', 'BACK_FILTERSIZE']:
+        conf[iKey] = int( str(conf[iKey]).split(',')[0] )
+
+    return conf
+
+def read_conv( conv_file ):
+    '''
+    Read a sextractor convolution mask (.conv) file
+
+    OUTPUT : the kernel as a 2d array, normalised to a sum
+             of one if the file says CONV NORM
+    '''
+    lines = [ iLine.split() for iLine in open( conv_file ) ]
+
+    kernel = np.array([ [ float(iValue) for iValue in iLine ]
+                        for iLine in lines[1:]
+                        if len(iLine) > 0 and iLine[0][0] != '#' ])
+
+    if 'NORM' in lines[0]:
+        kernel /= kernel.sum()
+
+    return kernel
+
+def background( data, back_size=64, filter_size=3 ):
+    '''
+    Estimate the background and its rms at each pixel
+
+    The image is cut into a mesh of back_size x back_size cells and
+    all cells are treated at once : the pixels are clipped at 3 sigma
+    about the median and the background is the mode, 2.5*median -
+    1.5*mean, unless the cell is too crowded in which case it is the
+    median (as sextractor). The mesh is median filtered over filter_size
+    cells and interpolated bilinearly back to the pixels.
+
+    Pixels that are not finite or exactly 0 (outside of the footprint
+    of a drizzled image) are ignored.
+
+    INPUT : DATA : the 2d image
+
+    OUTPUT : the background and the rms images
+    '''
+    ny, nx = data.shape
+    my = int( np.ceil( ny / float(back_size) ) )
+    mx = int( np.ceil( nx / float(back_size) ) )
+
+    #the image padded to the mesh as cells of pixels
+    cells = np.empty( (my*back_size, mx*back_size), dtype=np.float32 )
+    cells.fill( np.nan )
+    cells[:ny, :nx] = data
+    cells[ cells == 0 ] = np.nan
+    cells = cells.reshape( my, back_size, mx, back_size ).\
+        swapaxes( 1, 2 ).reshape( my*mx, back_size*back_size )
+
+    #cells without any valid pixels take the overall value later
+    filled = np.isfinite( cells ).any( axis=1 )
+    if not filled.any():
+        return np.zeros( data.shape, dtype=np.float32 ), \
+            np.ones( data.shape, dtype=np.float32 )
+    cells = cells[ filled ]
+
+    with np.errstate( invalid='ignore' ):
+        for iClip in range(3):
+            median = np.nanmedian( cells, axis=1 )
+            sigma = np.nanstd( cells, axis=1 )
+            clipped = np.abs( cells - median[:, np.newaxis] ) > \
+                3.*sigma[:, np.newaxis]
+            cells[ clipped ] = np.nan
+
+    median = np.nanmedian( cells, axis=1 )
+    mean = np.nanmean( cells, axis=1 )
+    sigma = np.nanstd( cells, axis=1 )
+    del cells
+
+    back = np.empty( my*mx )
+    back[ filled ] = np.where( np.abs( mean - median ) < 0.3*sigma,
+                               2.5*median - 1.5*mean, median )
+    back[ ~filled ] = np.median( back[ filled ] )
+    rms = np.empty( my*mx )
+    rms[ filled ] = sigma
+    rms[ ~filled ] = np.median( sigma )
+    back = back.reshape( my, mx )
+    sigma = rms.reshape( my, mx )
+
+    if filter_size > 1:
+        back = ndimage.median_filter( back, size=filter_size, mode='nearest' )
+        sigma = ndimage.median_filter( sigma, size=filter_size, mode='nearest' )
+
+    #the mesh value is at the centre of each cell
+    y = ( np.arange( ny, dtype=np.float32 ) + 0.5 ) / back_size - 0.5
+    x = ( np.arange( nx, dtype=np.float32 ) + 0.5 ) / back_size - 0.5
+
+    return _interpolate( back, y, x ), _interpolate( sigma, y, x )
+
+def _interpolate( mesh, y, x ):
+    '''
+    Bilinear interpolation of the mesh at the rows y and columns x
+    (in mesh units), the mesh is flat beyond the outer cell centres
+    '''
+    y = np.clip( y, 0, mesh.shape[0]-1 )
+    x = np.clip( x, 0, mesh.shape[1]-1 )
+    y0 = np.minimum( y.astype(int), max( mesh.shape[0]-2, 0 ) )
+    x0 = np.minimum( x.astype(int), max( mesh.shape[1]-2, 0 ) )
+    y1 = np.minimum( y0+1, mesh.shape[0]-1 )
+    x1 = np.minimum( x0+1, mesh.shape[1]-1 )
+    wy = ( y - y0 )[:, np.newaxis]
+    wx = ( x - x0 )[np.newaxis, :]
+
+    mesh = mesh.astype( np.float32 )
+
+    return ( ( 1-wy )*( ( 1-wx )*mesh[y0][:, x0] + wx*mesh[y0][:, x1] ) +
+             wy*( ( 1-wx )*mesh[y1][:, x0] + wx*mesh[y1][:, x1] ) )
+
+def convolve( data, kernel ):
+    '''
+    Convolve the image with the detection kernel
+
+    A separable kernel, such as the gaussian filters, is applied
+    as two 1d convolutions, which is much faster than the 2d one
+    '''
+    u, s, vt = np.linalg.svd( kernel )
+
+    #the .conv files are only given to 6 digits
+    if len(s) < 2 or s[1] < 1e-4*s[0]:
+        column = u[:, 0]*np.sqrt(s[0])
+        row = vt[0]*np.sqrt(s[0])
+        filtered = ndimage.convolve1d( data, column, axis=0, mode='constant' )
+        return ndimage.convolve1d( filtered, row, axis=1, mode='constant' )
+
+    return ndimage.convolve( data, kernel, mode='constant' )
+
+def detect( data, conf=None ):
+    '''
+    Detect the sources in an image
+
+    INPUT : DATA : the 2d image
+            CONF : the settings from read_conf, None for the defaults
+
+    OUTPUT : a record array of NUMBER, X_IMAGE, Y_IMAGE, FLUX_AUTO
+             of the sources, X_IMAGE and Y_IMAGE are 1 based
+    '''
+    if conf is None:
+        conf = read_conf()
+
+    data = np.asarray( data, dtype=np.float32 )
+    valid = np.isfinite( data )
+    data = np.where( valid, data, 0. ).astype( np.float32 )
+
+    back, rms = background( data, back_size=conf['BACK_SIZE'],
+                            filter_size=conf['BACK_FILTERSIZE'] )
+    image = data - back
+    image[ ~valid ] = 0.
+    del back
+
+    if conf['FILTER'] == 'Y' and conf['FILTER_NAME'] is not None:
+        filtered = convolve( image, read_conv( conf['FILTER_NAME'] ) )
+    else:
+        filtered = image
+
+    #the 8-connected groups of pixels above the threshold
+    detected = ( filtered > conf['DETECT_THRESH']*rms ) & valid & ( data != 0 )
+    del filtered, rms
+    labels, nlabels = ndimage.label( detected, structure=np.ones((3, 3)) )
+
+    y, x = np.nonzero( labels )
+    index = labels[ y, x ]
+    flux = image[ y, x ].astype( np.float64 )
+    weight = np.clip( flux, 0, None )
+
+    area = np.bincount( index, minlength=nlabels+1 )
+    flux_sum = np.bincount( index, weights=flux, minlength=nlabels+1 )
+    weight_sum = np.bincount( index, weights=weight, minlength=nlabels+1 )
+    x_sum = np.bincount( index, weights=weight*x, minlength=nlabels+1 )
+    y_sum = np.bincount( index, weights=weight*y, minlength=nlabels+1 )
+
+    keep = np.flatnonzero( ( area >= conf['DETECT_MINAREA'] ) &
+                           ( weight_sum > 0 ) )
+
+    cat = np.zeros( len(keep), dtype=[('X_IMAGE', np.float64),
+                                      ('Y_IMAGE', np.float64),
+                                      ('FLUX_AUTO', np.float64),
+                                      ('NUMBER', np.int32)] )
+    cat['X_IMAGE'] = x_sum[keep] / weight_sum[keep] + 1.
+    cat['Y_IMAGE'] = y_sum[keep] / weight_sum[keep] + 1.
+    cat['FLUX_AUTO'] = flux_sum[keep]
+    cat['NUMBER'] = np.arange( 1, len(keep)+1 )
+
+    return cat.view( np.recarray )
+
+def tile_slices( shape, tile_size=default_tile_size, overlap=default_overlap ):
+    '''
+    Cut an image into overlapping tiles
+
+    Each tile is a core of tile_size x tile_size pixels, which
+    together cover the image exactly once, grown by the overlap on
+    each side (within the image).
+
+    INPUT : SHAPE : the shape of the image
+
+    OUTPUT : a list of (tile, core) pairs of (y slice, x slice)
+             in the pixels of the image
+    '''
+    tiles = []
+    for iY in range( 0, shape[0], tile_size ):
+        for iX in range( 0, shape[1], tile_size ):
+            core = ( slice( iY, min( iY+tile_size, shape[0] ) ),
+                     slice( iX, min( iX+tile_size, shape[1] ) ) )
+            tile = ( slice( max( iY-overlap, 0 ),
+                            min( iY+tile_size+overlap, shape[0] ) ),
+                     slice( max( iX-overlap, 0 ),
+                            min( iX+tile_size+overlap, shape[1] ) ) )
+            tiles.append( (tile, core) )
+
+    return tiles
+
+def detect_tile( data, tile, core, conf ):
+    '''
+    Detect the sources in one tile of an image and keep those
+    with the centroid in its core (plus a pixel for the duplicates
+    which are removed in detect_tiled)
+
+    OUTPUT : the catalogue in the pixels of the image and the
+             distance of each source to the edge of the tile
+    '''
+    cat = detect( data[tile], conf )
+
+    cat['X_IMAGE'] += tile[1].start
+    cat['Y_IMAGE'] += tile[0].start
+
+    #0 based pixel positions
+    x = cat['X_IMAGE'] - 1.
+    y = cat['Y_IMAGE'] - 1.
+    keep = ( x >= core[1].start - 1 ) & ( x < core[1].stop + 1 ) & \
+        ( y >= core[0].start - 1 ) & ( y < core[0].stop + 1 )
+    cat = cat[keep]
+
+    #how far inside the tile each source is, the tile edges at the
+    #edge of the image do not cut any sources
+    edges = []
+    if tile[1].start > 0:
+        edges.append( x[keep] - tile[1].start )
+    if tile[1].stop < data.shape[1]:
+        edges.append( tile[1].stop - x[keep] )
+    if tile[0].start > 0:
+        edges.append( y[keep] - tile[0].start )
+    if tile[0].stop < data.shape[0]:
+        edges.append( tile[0].stop - y[keep] )
+    if edges:
+        margin = np.min( edges, axis=0 )
+    else:
+        margin = np.zeros( len(cat) ) + np.inf
+
+    return cat, margin
+
+def detect_tiled( data, conf=None, tile_size=default_tile_size,
+                  overlap=default_overlap, workers=None, match_radius=2. ):
+    '''
+    Detect the sources in a large image in overlapping tiles
+
+    The tiles are detected in a pool of threads (the array work is
+    done in numpy and scipy). Only a tile at a time is read from a
+    memory mapped image. A source near the border of two cores can
+    be found in both tiles, these are merged by matching the positions
+    with a kd-tree and keeping the detection furthest inside its tile.
+
+    INPUT : DATA : the 2d image
+            CONF : the settings from read_conf, None for the defaults
+
+    KEYWORDS :
+        TILE_SIZE : the size of the core of a tile, rounded up to
+                    a multiple of BACK_SIZE so that the background
+                    mesh is the same in all tiles
+        OVERLAP : the overlap on each side of a tile, this should be
+                  larger than the largest source
+        WORKERS : the number of tiles detected at once, defaults to the
+                  number of cpus
+        MATCH_RADIUS : sources closer than this (pixels) from
+                       different tiles are the same
+
+    OUTPUT : a record array of NUMBER, X_IMAGE, Y_IMAGE, FLUX_AUTO
+    '''
+    if conf is None:
+        conf = read_conf()
+
+    back_size = conf['BACK_SIZE']
+    tile_size = int( np.ceil( tile_size / float(back_size) ) )*back_size
+    overlap = int( np.ceil( overlap / float(back_size) ) )*back_size
+
+    tiles = tile_slices( data.shape, tile_size, overlap )
+
+    if workers is None:
+        workers = mp.cpu_count()
+    workers = min( workers, len(tiles) )
+
+    if workers > 1:
+        pool = ThreadPool( processes=workers )
+        try:
+            results = pool.map( lambda item: detect_tile( data, item[0], item[1],
+                                                          conf ), tiles )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [ detect_tile( data, iTile, iCore, conf )
+                    for iTile, iCore in tiles ]
+
+    cat = np.concatenate( [ iCat for iCat, iMargin in results ] )
+    margin = np.concatenate( [ iMargin for iCat, iMargin in results ] )
+    tile = np.concatenate( [ np.zeros( len(iCat), dtype=int ) + iTile
+                             for iTile, (iCat, iMargin) in enumerate(results) ] )
+
+    #the same source found in two tiles
+    keep = np.ones( len(cat), dtype=bool )
+    if len(cat) > 1:
+        tree = spatial.cKDTree( np.column_stack( (cat['X_IMAGE'], cat['Y_IMAGE']) ) )
+        for iFirst, iSecond in sorted( tree.query_pairs( match_radius ) ):
+            if tile[iFirst] == tile[iSecond]:
+                continue
+            if margin[iFirst] >= margin[iSecond]:
+                keep[iSecond] = False
+            else:
+                keep[iFirst] = False
+
+    cat = cat[keep]
+    cat = cat[ np.lexsort( (cat['X_IMAGE'], cat['Y_IMAGE']) ) ]
+    cat['NUMBER'] = np.arange( 1, len(cat)+1 )
+
+    return cat.view( np.recarray )
+
+def write_catalogue( cat, cat_name, params=None ):
+    '''
+    Write a catalogue as a sextractor ascii catalogue, so that it
+    can be read by TweakReg (and asciidata) as the sextractor ones
+    '''
+    if params is None:
+        params = catalogue_params
+
+    catfile = open( cat_name, 'wb' )
+    for iParam, iName in enumerate( params ):
+        catfile.write( "#%4i %s\n" % (iParam+1, iName) )
+    for iSource in cat:
+        catfile.write( ' '.join([ '%i' % iSource[iName] if iName == 'NUMBER'
+                                  else '%.4f' % iSource[iName]
+                                  for iName in params ])+'\n' )
+    catfile.close()
+
+def run( image, cat_name=None, conf_file=None, conf_args={}, ext=0,
+         tile_size=default_tile_size, workers=None ):
+    '''
+    Detect the sources in a fits image
+
+    INPUT : IMAGE : the fits file name, or the 2d image itself
+
+    KEYWORDS :
+        CAT_NAME : if given the catalogue is written to this file
+                   as a sextractor ascii catalogue
+        CONF_FILE : the sextractor config to take the settings from
+        CONF_ARGS : a dictionary of settings overriding the config
+        EXT : the extension of the image in the fits file
+        TILE_SIZE : images larger than this (pixels a side) are
+                    detected in tiles, see detect_tiled
+        WORKERS : the number of tiles detected at once
+
+    OUTPUT : a record array of NUMBER, X_IMAGE, Y_IMAGE, FLUX_AUTO
+    '''
+    conf = read_conf( conf_file, conf_args )
+
+    if isinstance( image, str ):
+        hdulist = fits.open( image, memmap=True )
+        data = hdulist[ext].data
+    else:
+        hdulist = None
+        data = image
+
+    if max( data.shape ) > tile_size:
+        cat = detect_tiled( data, conf, tile_size=tile_size, workers=workers )
+    else:
+        cat = detect( data, conf )
+
+    if hdulist is not None:
+        hdulist.close()
+
+    if cat_name is not None:
+        write_catalogue( cat, cat_name )
+
+    return cat
@@ -14,13 +14,22 @@ import numpy as np
 import csv as c
 import os
 import glob
+import shutil
+import copy
+import multiprocessing as mp
 import drizzlepac 
 from  drizzlepac import astrodrizzle
 from drizzlepac import tweakreg
 from drizzlepac import tweakback
 from subprocess import call
 import tweakreg_sextract as tweaksex
+import align_match as align_match
+import singles as singles
+import drizzle_sweep as drizzle_sweep
 import pyfits as fits
+import instrument as instrument
+import workdir as workdir
+import header_index as header_index
 
 def drizzle(input_filename, cluster, filter, \
             combine_type='iminmed', \
@@ -29,7 +38,11 @@ def drizzle(input_filename, cluster, filter, \
             outputfilename=None,
             jref_path='../', search_rad=1.0, thresh=1.0,
             files=None, drizzle_kernel='square', 
-            pixel_scale=0.03, wht_file='ERR'):
+            pixel_scale=0.03, wht_file='ERR', final=True, workers=None,
+            single_workers=None, psf_catalogue=None,
+            cutout_size=singles.default_cutout_size, compress_singles=False,
+            quick_look=False, quick_binning=4, reuse_cr=False,
+            detector='sextractor'):
 
     '''
     PURPOSE : TO STACK TOGETHER IMAGES FROM DIFFERENT EPOCHS
@@ -70,7 +83,20 @@ def drizzle(input_filename, cluster, filter, \
       - wcs_update : DO I WANT TO UPDATE THE WCS HEADERS? DEFAULT=True
       - individual : DO I WANT TO DRIZZLE EACH OBS RUN INDIVUALLY AND TWEAKBACK DEFAILT =True, \
       - single : DO I WANT TO DRIZZLE EACH IMAGE ONTO ITS ON FRAME FOR PURPOSE OF PSF EST DEF=False):
+                 THE ALIGNED FLTS ARE DRIZZLED INTO singles/ (see singles.py)
       - single_only : ONCE DRIZZLING INIDIVIUDALLY, RETURN AND STOP
+      - single_workers : THE NUMBER OF EXPOSURES DRIZZLED AT ONCE WHEN SINGLE, DEFAULT
+                         THE NUMBER OF CPUS. EACH HAS ONE FRAME ON DISK AT A TIME
+      - psf_catalogue : AN ASCII CATALOGUE OF THE RA AND DEC OF THE PSF STARS, IF GIVEN
+                        ONLY CUTOUTS OF CUTOUT_SIZE PIXELS AROUND THESE ARE KEPT OF THE SINGLES
+      - compress_singles : WRITE THE SINGLES TILE COMPRESSED AS FLOAT32
+      - quick_look : ONCE ALIGNED WRITE A QUICK LOOK OUTPUTFILENAME_quick_drz.fits, QUICK_BINNING
+                     TIMES COARSER THAN PIXEL_SCALE, TO CHECK THE ALIGNMENT (see quick_drizzle)
+      - reuse_cr : KEEP THE SKY AND COSMIC RAYS OF THE FINAL DRIZZLE IN drizzle_cache/ AND
+                   REUSE THEM WHEN ONLY PIXEL_SCALE, DRIZZLE_KERNEL OR WHT_FILE HAVE CHANGED,
+                   SO ONLY THE FINAL STAGE OF ASTRODRIZZLE IS RERUN (see drizzle_sweep.py)
+      - detector : HOW THE SOURCES OF THE RUN DRIZZLES ARE FOUND FOR TWEAKREG, 'sextractor'
+                   OR 'numpy' TO DETECT THEM IN PROCESS (see tweakreg_sextract.py)
       - outputfilename : the string of the output file. If not given the name defauilts to
                          CLUSTER_FILTER_drz_sci.fits
       - jref_path : string, the location of the calibration files for distortion etc
@@ -85,6 +111,11 @@ def drizzle(input_filename, cluster, filter, \
       - wht_file : tye of weight file to be output
             'ERR' : Inverse variance
             'EXP' : effective exposure time
+      - final : DO I WANT TO DO THE FINAL DRIZZLE. IF FALSE STOP ONCE THE FLTS ARE ALIGNED
+                (used by main.main so the alignment and final drizzle are separate stages)
+      - workers : THE NUMBER OF OBSERVATION RUNS DRIZZLED AT ONCE, DEFAULT ONE PER RUN UP TO
+                  THE NUMBER OF CPUS (see drizzle_fields), AND THE NUMBER OF PROCESSES
+                  UPDATING THE WCS OF THE FLTS (see update_wcs)
             
     FOR MORE SEE 
        http://documents.stsci.edu/hst/HST_overview/documents/DrizzlePac/ch43.html
@@ -108,18 +139,6 @@ def drizzle(input_filename, cluster, filter, \
     else:
         input_filename = ','.join(files)
         
-    if single:
-        call(["mkdir", "singles"])
-        
-        for iflt in files:
-            iDrz = iflt.split("_")[0]
-            drizzle( iflt, iDrz, filter, \
-                     outputfilename=iDrz,
-                     jref_path=jref_path)
-            call(["mv", iDrz+"_drz_sci.fits","singles"])
-
-            
-   
     if len(files) == 1:
         combine_type='minimum'
         
@@ -137,7 +156,7 @@ def drizzle(input_filename, cluster, filter, \
     #1. FIRST UPDATE THE WCS
     #------------------------------------------
     if wcs_update:
-        update_wcs( input_filename, files=files )
+        update_wcs( input_filename, files=files, workers=workers )
     
     
     #2. NOW GET THE OBSERVATION DATES AND DRIZZLE THEM TOGETHER
@@ -152,27 +171,55 @@ def drizzle(input_filename, cluster, filter, \
     
     if len(uniqueObs) > 1 and individual is True:
         drizzle_fields( obsRun, fltList, cluster, filter,
-                        thresh=thresh, search_rad=search_rad )
+                        thresh=thresh, search_rad=search_rad,
+                        workers=workers, detector=detector )
     else:
         print 'All observations taken on the same run'
+
+    #A QUICK LOOK OF THE ALIGNED FLTS BEFORE THE LONG DRIZZLE
+    if quick_look:
+        quick_drizzle( files, outputfilename, pixel_scale=pixel_scale,
+                       binning=quick_binning )
+
+    #THE SINGLES OF THE ALIGNED FLTS
+    if single:
+        singles.drizzle_singles( files, workers=single_workers,
+                                 pixel_scale=pixel_scale,
+                                 drizzle_kernel=drizzle_kernel,
+                                 wht_file=wht_file,
+                                 psf_catalogue=psf_catalogue,
+                                 cutout_size=cutout_size,
+                                 compress=compress_singles )
+        if single_only:
+            return
+
+    if not final:
+        return
     #4. NOW DRIZZLE TOGETHER ALL THE TWEAK FLT IMAGES
 
 
-    astrodrizzle.AstroDrizzle( input_filename, \
-                                output=str(outputfilename), \
-                                final_wcs=True, \
-                                final_scale=pixel_scale, \
-                                final_pixfrac=0.8, \
-                                combine_type=combine_type, \
-                                final_kernel=drizzle_kernel,\
-                                   final_wht_type=wht_file)
+    if reuse_cr:
+        drizzle_sweep.drizzle_sweep( files, [{'pixel_scale':pixel_scale,
+                                              'drizzle_kernel':drizzle_kernel,
+                                              'wht_file':wht_file,
+                                              'output':str(outputfilename)}],
+                                     outputfilename, combine_type=combine_type )
+        return
+
+    with instrument.stage('astrodrizzle', exposure=str(outputfilename)):
+        astrodrizzle.AstroDrizzle( input_filename, \
+                                    output=str(outputfilename), \
+                                    final_wcs=True, \
+                                    final_scale=pixel_scale, \
+                                    final_pixfrac=0.8, \
+                                    combine_type=combine_type, \
+                                    final_kernel=drizzle_kernel,\
+                                       final_wht_type=wht_file)
                                 
     
 
 
   
-    if single:
-        call(["mv", "singles/*", "."])
     '''
     FOR REFERENCE:
 
@@ -200,12 +247,18 @@ def drizzle(input_filename, cluster, filter, \
     final_refimage='ref_image_drz_sci.fits'
     '''
     
-def update_wcs( input_filename, files=None):
+def update_wcs( input_filename, files=None, workers=1):
     '''
     PURPOSE : TO UPDATE THE WCS USING THE DRIZZLEPAC
 
     NOT SO EASY AS DIFFERENT AGED OBSERVATIONS APPEARS TO NEED DIFFERENT
     UPDATE WCS
+
+    KEYWORDS : WORKERS : THE NUMBER OF PROCESSES TO UPDATE THE FLTS IN,
+               NONE FOR THE NUMBER OF CPUS. THE FLTS ARE GROUPED BY
+               THEIR DISTORTION FILES (IDCTAB, NPOLFILE, D2IMFILE) SO
+               EACH PROCESS READS THE TABLES OF A GROUP ONCE
+               (see cache_distortion_tables)
     '''
         
     #If i am updating various flt files some new some old thne
@@ -216,13 +269,98 @@ def update_wcs( input_filename, files=None):
 
     if files is None:
         files = glob.glob(input_filename)
-    
+
+    if workers is None:
+        workers = mp.cpu_count()
+
+    if workers > 1 and len(files) > 1 and not mp.current_process().daemon:
+        batches = distortion_batches( files, workers )
+        pool = mp.Pool( processes=min( workers, len(batches) ) )
+        try:
+            pool.map( update_wcs_batch, batches, chunksize=1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        update_wcs_batch( files )
+
+def update_wcs_batch( files ):
+    '''
+    Update the wcs of a list of flts in this process, the
+    distortion tables are read once for all of them.
+    Module level so it can be used with Pool.map
+    '''
+    cache_distortion_tables()
+
+    for iFile in files:
+        with instrument.stage('updatewcs', exposure=iFile):
+            updatewcs.updatewcs(iFile)
+
+def distortion_batches( files, workers ):
+    '''
+    Split the flts into batches that share their distortion files,
+    large groups are split so there is work for all the workers
+
+    OUTPUT : a list of lists of flts
+    '''
+    headers = header_index.read_headers( files,
+                        keywords=['IDCTAB', 'NPOLFILE', 'D2IMFILE'] )
+
+    groups = {}
     for iFile in files:
-        updatewcs.updatewcs(iFile)
+        key = tuple([ headers[iFile][iKeyword]
+                      for iKeyword in ['IDCTAB', 'NPOLFILE', 'D2IMFILE'] ])
+        groups.setdefault( key, [] ).append( iFile )
+
+    size = int( np.ceil( len(files) / float(workers) ) )
+    batches = []
+    for iKey in sorted( groups.keys() ):
+        for iStart in range( 0, len(groups[iKey]), size ):
+            batches.append( groups[iKey][iStart:iStart+size] )
 
+    return batches
 
+_distortion_cache = {}
 
-def drizzle_fields( obsDates, fltList, cluster, filter, search_rad=1, thresh=1):
+def _cached( function ):
+    '''
+    Keep the result of reading a distortion table for the same
+    arguments (and reference directories), a copy is returned
+    so the cached arrays are never changed
+    '''
+    def wrapper( *args, **kwargs ):
+        key = (function.__module__, function.__name__, args,
+               tuple(sorted(kwargs.items())),
+               os.environ.get('jref'), os.environ.get('iref'))
+        if key not in _distortion_cache:
+            _distortion_cache[key] = function( *args, **kwargs )
+        return copy.deepcopy( _distortion_cache[key] )
+    wrapper.cached = True
+    return wrapper
+
+def cache_distortion_tables():
+    '''
+    Make stwcs read each IDCTAB, NPOLFILE and D2IMFILE table only once
+    in this process, rather than again for every flt that it updates.
+    The readers are wrapped in place (as the stsci_patches), which
+    is done once per process.
+    '''
+    from stwcs.distortion import mutil
+    from stwcs.updatewcs import npol, det2im
+
+    if not getattr( mutil.readIDCtab, 'cached', False ):
+        mutil.readIDCtab = _cached( mutil.readIDCtab )
+
+    for iCorr in [ npol.NPOLCorr, det2im.DET2IMCorr ]:
+        getData = iCorr.__dict__['getData'].__func__
+        if not getattr( getData, 'cached', False ):
+            iCorr.getData = classmethod( _cached( getData ) )
+
+
+
+def drizzle_fields( obsDates, fltList, cluster, filter, search_rad=1, thresh=1,
+                    seed_offsets=True, max_shift=5., seed_tolerance=2.,
+                    workers=None, detector='sextractor'):
     '''
     PURPOSE : IF THERE ARE OBSERVATIONS FROM DIFFERENT DATES / OBSRUNS
     THEN DRIZZLE THE DATES THAT ARE THE SAME TOGETHER
@@ -234,6 +372,25 @@ def drizzle_fields( obsDates, fltList, cluster, filter, search_rad=1, thresh=1):
     
     thresh=1.0
     search_rad=1.0 #Often this parameter is too big if the images hardly overlap. Keep at 1 if limited sources
+
+    seed_offsets=True : first find the offset of each run to the reference
+                        catalogue with align_match (searching up to max_shift
+                        arcseconds) and give it to TweakReg, which then only
+                        matches within seed_tolerance pixels of it (plus the
+                        rotation found times the radius of the sources, as
+                        TweakReg is only given the offset). If an offset is
+                        not found TweakReg searches by itself
+
+    workers=None : the number of observation runs drizzled at once in
+                   separate processes, default one per run up to the
+                   number of cpus. Each run is drizzled in its own
+                   directory (see drizzle_run) as astrodrizzle writes
+                   files with fixed names
+
+    detector='sextractor' : how the sources of the run drizzles are found
+                            for TweakReg, 'numpy' detects them in process
+                            instead of running sextractor on each
+                            (see tweakreg_sextract.py)
     '''
     outputfilename = cluster+'_'+filter
 
@@ -245,26 +402,33 @@ def drizzle_fields( obsDates, fltList, cluster, filter, search_rad=1, thresh=1):
     call(["mkdir", "keep"])
         
 
+    runs = []
     for iDate in uniqueObs:
         obsDrizzle = np.array(fltList)[ np.array(obsDates) == str(iDate) ]
-        drizzleString = ",".join(obsDrizzle)
         print iDate
         print obsDrizzle
 
         if not os.path.isfile("keep/"+str(iDate)+"_drz_sci.fits"):
-            astrodrizzle.AstroDrizzle(drizzleString, \
-                                        output=str(iDate), \
-                                        final_wcs=True, \
-                                        final_scale=0.03, \
-                                        final_pixfrac=0.8, \
-                                        combine_type='iminmed')
-                                          
-                                        
-            call(["cp",str(iDate)+"_drz_sci.fits","keep"])
-    
+            runs.append( (str(iDate), list(obsDrizzle)) )
         else:
             call(["cp","keep/"+str(iDate)+"_drz_sci.fits","."])
 
+    #Each run is independent so they are drizzled at the same time,
+    #unless this is already in a (daemon) worker which cant have its own
+    if workers is None:
+        workers = min( len(runs), mp.cpu_count() )
+
+    if workers > 1 and len(runs) > 1 and not mp.current_process().daemon:
+        pool = mp.Pool( processes=workers )
+        try:
+            pool.map( drizzle_run, runs )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for iRun in runs:
+            drizzle_run( iRun )
+
             
             
             
@@ -287,37 +451,304 @@ def drizzle_fields( obsDates, fltList, cluster, filter, search_rad=1, thresh=1):
     
 
     #Run sextractor on the images
-    tweaksex.tweakreg_sextract(drzList,'catfile')
+    with instrument.stage('tweakreg_sextract', exposure=filter):
+        tweaksex.tweakreg_sextract(drzList,'catfile', detector=detector)
     refDate=obsDates[1]#
     refimage=drzList[1]#
     drzString= ",".join(drzList)
 
 
     
-    tweaksex.ref_sex( refimage )
+    with instrument.stage('tweakreg_sextract', exposure=refimage):
+        tweaksex.ref_sex( refimage )
     
-    tweakreg.TweakReg(drzString, \
-                        residplot='both', \
-                        see2dplot=True, \
-                        threshold=np.float(thresh), \
-                        searchrad=np.float(search_rad), \
-                        fitgeometry='rscale', updatehdr='True', \
-                        refimage=refimage, 
-                        catfile='catfile', \
-                        xcol=1, ycol=2, fluxcol=3, \
-                        minobj=2, \
-                        refcat='reference.cat', \
-                        refxcol=1, refycol=2, rfluxcol=3)
+    tweak_args = {'residplot':'both', 
+                  'threshold':np.float(thresh), 
+                  'fitgeometry':'rscale', 'updatehdr':'True', 
+                  'refimage':refimage, 
+                  'xcol':1, 'ycol':2, 'fluxcol':3, 
+                  'minobj':2, 
+                  'refcat':'reference.cat', 
+                  'refxcol':1, 'refycol':2, 'rfluxcol':3}
+
+    offsets = None
+    if seed_offsets:
+        with instrument.stage('align_match', exposure=filter):
+            offsets = align_match.match_offsets( 'catfile', 'reference.cat',
+                                                 refimage, max_shift=max_shift )
+
+    if offsets is not None and \
+            all([ offsets[iDrz]['found'] for iDrz in drzList ]):
+        #Each run is fitted to the reference catalogue on its own,
+        #so TweakReg is given the offset of each run in turn
+        catalogues = dict( align_match.read_catfile('catfile') )
+        for iDrz in drzList:
+            iCatfile = 'catfile_'+iDrz[:-5]
+            open( iCatfile, 'wb' ).write( "%s %s\n" % (iDrz, catalogues[iDrz]) )
+
+            #TweakReg is not given the rotation, so allow for it
+            iTolerance = align_match.seed_tolerance( offsets[iDrz],
+                                                     seed_tolerance )
+
+            with instrument.stage('tweakreg', exposure=iDrz):
+                tweakreg.TweakReg(iDrz, \
+                                    catfile=iCatfile, \
+                                    use2dhist=False, \
+                                    xoffset=offsets[iDrz]['xoffset'], \
+                                    yoffset=offsets[iDrz]['yoffset'], \
+                                    tolerance=iTolerance, \
+                                    **tweak_args)
+    else:
+        with instrument.stage('tweakreg', exposure=filter):
+            tweakreg.TweakReg(drzString, \
+                                see2dplot=True, \
+                                searchrad=np.float(search_rad), \
+                                catfile='catfile', \
+                                **tweak_args)
                           
     for iDate in uniqueObs:
         if iDate != obsDates:
             TweakFLT= np.array(fltList)[ np.array(obsDates) == str(iDate) ]
         tweakString = ",".join(TweakFLT)
         print tweakString
-        tweakback.tweakback( str(iDate)+'_drz_sci.fits', \
-                                input=tweakString )
+        with instrument.stage('tweakback', exposure=str(iDate)):
+            tweakback.tweakback( str(iDate)+'_drz_sci.fits', \
+                                    input=tweakString )
+
+
+
+def drizzle_run( run ):
+    '''
+    PURPOSE : DRIZZLE THE FLTS OF ONE OBSERVATION RUN IN ITS OWN
+              DIRECTORY, SO THAT SEVERAL RUNS CAN BE DRIZZLED AT ONCE
+
+    INPUTS : RUN : A TUPLE OF THE NAME OF THE RUN AND THE LIST OF ITS FLTS
+
+    The flts are copied into drizzle_<run>/ and astrodrizzle is run
+    there (see workdir.py). Its updates of the flts (sky, cosmic rays)
+    are copied back, the <run>_drz_*.fits are moved back and the
+    drz_sci copied to keep/. Module level so it can be used with Pool.map
+    '''
+    iDate, obsDrizzle = run
+
+    runDir = 'drizzle_'+iDate
+    if os.path.isdir( runDir ):
+        shutil.rmtree( runDir )
+
+    drizzleString = ",".join([ os.path.basename( iFlt )
+                               for iFlt in obsDrizzle ])
+    with instrument.stage('astrodrizzle_run', exposure=iDate):
+        workdir.run_in_directory( runDir, astrodrizzle.AstroDrizzle,
+                                  args=(drizzleString,),
+                                  kwargs={'output':iDate,
+                                          'final_wcs':True,
+                                          'final_scale':0.03,
+                                          'final_pixfrac':0.8,
+                                          'combine_type':'iminmed'},
+                                  files=obsDrizzle,
+                                  products=[iDate+'_drz_*.fits'] )
+    shutil.rmtree( runDir )
+
+    call(["cp",iDate+"_drz_sci.fits","keep"])
+
+def quick_drizzle( files, outputfilename, pixel_scale=0.03, binning=4,
+                   kernel='square', good_bits=0 ):
+    '''
+    PURPOSE : A QUICK LOOK DRIZZLE OF THE FLTS ONTO A COARSE GRID, TO
+              CHECK THE ALIGNMENT IN SECONDS BEFORE THE FULL ASTRODRIZZLE
+
+    INPUTS : FILES : THE LIST OF FLTS
+             OUTPUTFILENAME : THE OUTPUT IS OUTPUTFILENAME_quick_drz.fits
+
+    KEYWORDS :
+      - pixel_scale : the pixel scale of the full drizzle
+      - binning : the quick look is binning times coarser than pixel_scale
+      - kernel : 'point' : each flt pixel goes to the output pixel of its centre
+                 'square' : each flt pixel is spread over the output pixels
+                            it covers, approximated by a grid of points
+      - good_bits : the DQ flags that are still used (as final_bits)
+
+    The pixels of each chip are mapped through the updated wcs of the flt
+    (with the distortion) onto a tangent plane grid around the centre of
+    all the flts, north up. The corners of the pixels are mapped, so the
+    flux is scaled by the area of each pixel on the grid. There is no
+    sky subtraction or cosmic ray rejection, the exposures are combined
+    as a mean weighted by their exposure time.
+
+    OUTPUT : the name of the quick look, with the image (electrons/s)
+             in the primary and the exposure time weight in WHT
+    '''
+    from stwcs import wcsutil
+
+    scale = pixel_scale*binning/3600.
+
+    #The chips and their outline on the sky
+    chips = []
+    outline_ra = []
+    outline_dec = []
+    for iFlt in files:
+        hdus = fits.open( iFlt )
+        for iHdu in hdus[1:]:
+            if iHdu.header.get('EXTNAME') != 'SCI':
+                continue
+            chips.append( (iFlt, iHdu.header['EXTVER']) )
+            wcs = wcsutil.HSTWCS( hdus, ext=('SCI', iHdu.header['EXTVER']) )
+            ny, nx = iHdu.data.shape
+            x = np.array([0.5, nx/2., nx+0.5, nx+0.5, nx+0.5, nx/2., 0.5, 0.5])
+            y = np.array([0.5, 0.5, 0.5, ny/2., ny+0.5, ny+0.5, ny+0.5, ny/2.])
+            ra, dec = wcs.all_pix2world( x, y, 1 )
+            outline_ra.append( ra )
+            outline_dec.append( dec )
+        hdus.close()
+
+    #The grid around the mean direction of the outlines
+    outline_ra = np.radians( np.concatenate( outline_ra ) )
+    outline_dec = np.radians( np.concatenate( outline_dec ) )
+    centre = np.array([ np.cos(outline_dec)*np.cos(outline_ra),
+                        np.cos(outline_dec)*np.sin(outline_ra),
+                        np.sin(outline_dec) ]).mean( axis=1 )
+    ra0 = np.degrees( np.arctan2( centre[1], centre[0] ) ) % 360.
+    dec0 = np.degrees( np.arctan2( centre[2], np.hypot( centre[0], centre[1] ) ) )
+
+    xi, eta = _tangent_plane( np.degrees(outline_ra), np.degrees(outline_dec),
+                              ra0, dec0 )
+    crpix1 = np.ceil( xi.max()/scale ) + 2.
+    crpix2 = np.ceil( -eta.min()/scale ) + 2.
+    nx_out = int( crpix1 + np.ceil( -xi.min()/scale ) + 2 )
+    ny_out = int( crpix2 + np.ceil( eta.max()/scale ) + 2 )
+
+    flux = np.zeros( nx_out*ny_out )
+    weight = np.zeros( nx_out*ny_out )
+
+    for iFlt, iChip in chips:
+        with instrument.stage('quick_drizzle', exposure=iFlt):
+            hdus = fits.open( iFlt )
+            wcs = wcsutil.HSTWCS( hdus, ext=('SCI', iChip) )
+            data = hdus['SCI', iChip].data.astype( np.float64 )
+            try:
+                good = ( hdus['DQ', iChip].data & ~np.int64(good_bits) ) == 0
+            except KeyError:
+                good = np.ones( data.shape, dtype=bool )
+            exptime = hdus[0].header['EXPTIME']
+            if '/S' not in str( hdus['SCI', iChip].header.get('BUNIT', '') ).upper():
+                data /= exptime
+            hdus.close()
+
+            #blocks of flt pixels no larger than the output pixels
+            nbin = max( 1, int( pixel_scale*binning / wcs.pscale ) )
+            ny = data.shape[0] // nbin
+            nx = data.shape[1] // nbin
+            data = ( data*good )[:ny*nbin, :nx*nbin].reshape( ny, nbin, nx, nbin ).sum( axis=(1, 3) )
+            ngood = good[:ny*nbin, :nx*nbin].reshape( ny, nbin, nx, nbin ).sum( axis=(1, 3) )
+            data = np.where( ngood > 0, data*nbin**2/np.maximum( ngood, 1 ), 0. )
+            chip_weight = exptime*ngood/float( nbin**2 )
+
+            #the corners of the blocks on the grid (from 0), as the
+            #distortion is smooth the wcs is only evaluated every
+            #step corners and interpolated in between
+            step = max( 1, 32 // nbin )
+            y, x = np.mgrid[0:ny//step+2, 0:nx//step+2]*step
+            ra, dec = wcs.all_pix2world( 0.5 + x.ravel()*nbin,
+                                         0.5 + y.ravel()*nbin, 1 )
+            xi, eta = _tangent_plane( ra, dec, ra0, dec0 )
+            x = _bilinear( ( crpix1 - 1. - xi/scale ).reshape( x.shape ),
+                           step, ny+1, nx+1 )
+            y = _bilinear( ( crpix2 - 1. + eta/scale ).reshape( y.shape ),
+                           step, ny+1, nx+1 )
+
+            #the area of each block on the grid
+            area = 0.5*np.abs( ( x[1:, 1:] - x[:-1, :-1] )*( y[:-1, 1:] - y[1:, :-1] ) -
+                               ( x[:-1, 1:] - x[1:, :-1] )*( y[1:, 1:] - y[:-1, :-1] ) )
+
+            if kernel == 'point':
+                nsub = 1
+            elif kernel == 'square':
+                #points at most half an output pixel apart
+                nsub = max( 2, int( np.ceil( 2.*np.sqrt( np.median( area ) ) ) ) )
+            else:
+                raise ValueError( "Quick look kernel must be 'point' or 'square'" )
+
+            use = chip_weight > 0
+            point_weight = chip_weight[use] / nsub**2
+            point_flux = point_weight*data[use] / np.maximum( area[use], 1e-12 )
+
+            #the points within each block are bilinear between its
+            #corners, x = x0 + u*dx + v*dy + u*v*dxy
+            corners = []
+            for iCoord in [x, y]:
+                corners.append( ( iCoord[:-1, :-1][use],
+                                  ( iCoord[:-1, 1:] - iCoord[:-1, :-1] )[use],
+                                  ( iCoord[1:, :-1] - iCoord[:-1, :-1] )[use],
+                                  ( iCoord[1:, 1:] - iCoord[1:, :-1] -
+                                    iCoord[:-1, 1:] + iCoord[:-1, :-1] )[use] ) )
+
+            for iSub in ( np.arange( nsub ) + 0.5 ) / nsub:
+                for jSub in ( np.arange( nsub ) + 0.5 ) / nsub:
+                    ix, iy = [ np.floor( c0 + iSub*cx + jSub*cy + iSub*jSub*cxy +
+                                         0.5 ).astype( np.int64 )
+                               for c0, cx, cy, cxy in corners ]
+                    inside = ( ix >= 0 ) & ( ix < nx_out ) & ( iy >= 0 ) & ( iy < ny_out )
+                    index = iy[inside]*nx_out + ix[inside]
+                    flux += np.bincount( index, minlength=nx_out*ny_out,
+                                         weights=point_flux[inside] )
+                    weight += np.bincount( index, minlength=nx_out*ny_out,
+                                           weights=point_weight[inside] )
+
+    image = np.where( weight > 0, flux / np.maximum( weight, 1e-30 ), 0. )
+
+    header = fits.Header()
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = ra0
+    header['CRVAL2'] = dec0
+    header['CRPIX1'] = crpix1
+    header['CRPIX2'] = crpix2
+    header['CD1_1'] = -scale
+    header['CD1_2'] = 0.
+    header['CD2_1'] = 0.
+    header['CD2_2'] = scale
+    header['BUNIT'] = 'ELECTRONS/S'
+    header['NDRIZIM'] = ( len(chips), 'Number of chips in the quick look' )
+    header['D001KERN'] = ( kernel, 'Quick look kernel' )
+
+    output = str(outputfilename)+'_quick_drz.fits'
+    hdus = fits.HDUList( [ fits.PrimaryHDU( data=image.reshape( ny_out, nx_out ).astype( np.float32 ),
+                                            header=header ),
+                           fits.ImageHDU( data=weight.reshape( ny_out, nx_out ).astype( np.float32 ),
+                                          name='WHT' ) ] )
+    hdus.writeto( output, clobber=True )
+
+    return output
+
+def _bilinear( mesh, step, ny, nx ):
+    '''
+    Bilinear interpolation of a mesh with a point every step
+    rows and columns onto all ny x nx rows and columns
+    '''
+    y = np.arange( ny ) / float(step)
+    x = np.arange( nx ) / float(step)
+    y0 = np.minimum( y.astype(int), mesh.shape[0]-2 )
+    x0 = np.minimum( x.astype(int), mesh.shape[1]-2 )
+    wy = ( y - y0 )[:, np.newaxis]
+    wx = ( x - x0 )[np.newaxis, :]
+
+    return ( ( 1-wy )*( ( 1-wx )*mesh[y0][:, x0] + wx*mesh[y0][:, x0+1] ) +
+             wy*( ( 1-wx )*mesh[y0+1][:, x0] + wx*mesh[y0+1][:, x0+1] ) )
+
+def _tangent_plane( ra, dec, ra0, dec0 ):
+    '''
+    The gnomonic projection (degrees) of ra and dec about ra0, dec0,
+    xi to the east and eta to the north
+    '''
+    ra = np.radians( ra ) - np.radians( ra0 )
+    dec = np.radians( dec )
+    dec0 = np.radians( dec0 )
 
+    cosc = np.sin(dec0)*np.sin(dec) + np.cos(dec0)*np.cos(dec)*np.cos(ra)
+    xi = np.cos(dec)*np.sin(ra) / cosc
+    eta = ( np.cos(dec0)*np.sin(dec) - np.sin(dec0)*np.cos(dec)*np.cos(ra) ) / cosc
 
+    return np.degrees( xi ), np.degrees( eta )
 
 def obs_name( input_filename, files=None ):
     '''
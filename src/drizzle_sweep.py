@@ -0,0 +1,267 @@
+'''
+drizzle_sweep.py
+
+Drizzle the same flts with several sets of final parameters
+(pixel_scale, drizzle_kernel, wht_file), e.g. to compare the
+'square' and 'lanczos3' kernels, without redoing the cosmic ray
+rejection for each.
+
+Only the final stage of astrodrizzle depends on these, but a rerun
+also redoes the sky, the separate drizzles, the median, the blot
+and driz_cr, which is most of the time. Here the full astrodrizzle
+is run once, for the first set. This leaves the sky of each chip
+in MDRIZSKY and the cosmic rays flagged (crbit) in the DQ of the
+flts, and both are kept in a cache file,
+
+   drizzle_cache/<hash>.fits
+
+with the hash taken over the science data, the primary wcs of the
+science headers and the DQ of the flts, apart from the crbit
+themselves, and over the combine_type. The other keywords are left
+out, as tweakback and astrodrizzle rewrite these (WCSNAME, the
+alternate wcs, MDRIZSKY, the history) each time they are run. The other sets, and any later
+sweep of the same flts, then only run the final drizzle with the
+cached sky and cosmic rays. Each of these is run on copies of the
+flts in its own directory, so they can be run at the same time and
+the flts themselves are not changed.
+
+Usage :
+    drizzle_sweep.drizzle_sweep( glob.glob('j*_flt.fits'),
+                                 [{'drizzle_kernel':'square', 'pixel_scale':0.03},
+                                  {'drizzle_kernel':'lanczos3', 'pixel_scale':0.05}],
+                                 output='A2744_F814W', workers=2 )
+
+'''
+import os as os
+import shutil as shutil
+import hashlib as hashlib
+import multiprocessing as mp
+import numpy as np
+import pyfits as fits
+import instrument as instrument
+import workdir as workdir
+
+#the DQ flag of the cosmic rays (crbit of astrodrizzle)
+crbit = 4096
+
+default_cache_dir = 'drizzle_cache'
+
+#the keywords of the primary wcs of the science headers that the
+#sky and cosmic rays depend on, and the SIP distortion (A_*, B_*)
+wcs_keywords = ['CTYPE1', 'CTYPE2', 'CRPIX1', 'CRPIX2', 'CRVAL1', 'CRVAL2',
+                'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2']
+
+default_final = {'pixel_scale':0.03, 'drizzle_kernel':'square',
+                 'wht_file':'ERR'}
+
+
+def drizzle_sweep( files, sweep, output, combine_type='iminmed',
+                   workers=1, cache_dir=default_cache_dir ):
+    '''
+    Drizzle the flts for each set of final parameters
+
+    INPUT : FILES : the list of flts
+            SWEEP : a list of dictionaries of the final parameters,
+                    pixel_scale, drizzle_kernel and wht_file (see
+                    drizzle.drizzle), missing ones are the defaults.
+                    'output' gives the name of the output of a set
+            OUTPUT : the default name of the outputs, which is
+                     OUTPUT_<kernel>_<scale> for each set
+
+    KEYWORDS :
+        COMBINE_TYPE : how the images are combined for the median
+        WORKERS : the number of sets drizzled at once
+        CACHE_DIR : where the sky and cosmic rays are cached
+
+    OUTPUT : the list of the output names, the drizzles are
+             <output>_drz_sci.fits etc.
+    '''
+    jobs = []
+    for iSet in sweep:
+        job = dict( default_final )
+        job.update( iSet )
+        if 'output' not in job:
+            job['output'] = '%s_%s_%s' % (output, job['drizzle_kernel'],
+                                          str(job['pixel_scale']))
+        job['files'] = [ os.path.abspath( iFlt ) for iFlt in files ]
+        jobs.append( job )
+    outputs = [ iJob['output'] for iJob in jobs ]
+
+    if not os.path.isdir( cache_dir ):
+        os.makedirs( cache_dir )
+
+    with instrument.stage('sweep_hash', exposure=output):
+        cache_file = os.path.join( os.path.abspath( cache_dir ),
+                                   cr_hash( files, combine_type )+'.fits' )
+
+    #the full astrodrizzle of the first set gives the sky and
+    #the cosmic rays of the others
+    if not os.path.isfile( cache_file ):
+        full_drizzle( files, jobs[0], combine_type )
+        write_cache( files, cache_file )
+        jobs = jobs[1:]
+
+    for iJob in jobs:
+        iJob['cache_file'] = cache_file
+
+    workdir.absolute_reference_paths()
+
+    if workers > 1 and len(jobs) > 1 and not mp.current_process().daemon:
+        pool = mp.Pool( processes=min( workers, len(jobs) ) )
+        try:
+            pool.map( final_drizzle, jobs, chunksize=1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for iJob in jobs:
+            final_drizzle( iJob )
+
+    return outputs
+
+def cr_hash( files, combine_type ):
+    '''
+    The hash of what the sky and the cosmic rays of the flts
+    depend on : the science data and primary wcs and the DQ
+    (but crbit) of each chip, and the combine_type
+    '''
+    md5 = hashlib.md5()
+    md5.update( combine_type )
+
+    for iFlt in sorted( files, key=os.path.basename ):
+        md5.update( os.path.basename( iFlt ) )
+        hdus = fits.open( iFlt, memmap=True )
+        for iHdu in hdus[1:]:
+            extname = iHdu.header.get('EXTNAME')
+            if extname == 'SCI':
+                md5.update( repr([ (iKeyword, iHdu.header.get(iKeyword))
+                                   for iKeyword in wcs_keywords ]) )
+                md5.update( repr(sorted([ (iKeyword, iHdu.header[iKeyword])
+                                          for iKeyword in iHdu.header.keys()
+                                          if iKeyword[:2] in ['A_', 'B_'] ])) )
+                md5.update( np.ascontiguousarray( iHdu.data ).tostring() )
+            elif extname == 'DQ':
+                md5.update( np.ascontiguousarray( iHdu.data & ~crbit ).tostring() )
+        hdus.close()
+
+    return md5.hexdigest()
+
+def full_drizzle( files, job, combine_type ):
+    '''
+    The full astrodrizzle of the flts in place for the final
+    parameters of a job, as the final drizzle of drizzle.drizzle
+    '''
+    from drizzlepac import astrodrizzle
+
+    with instrument.stage('astrodrizzle', exposure=job['output']):
+        astrodrizzle.AstroDrizzle( ','.join( files ), \
+                                   output=str(job['output']), \
+                                   final_wcs=True, \
+                                   final_scale=job['pixel_scale'], \
+                                   final_pixfrac=0.8, \
+                                   combine_type=combine_type, \
+                                   final_kernel=job['drizzle_kernel'], \
+                                   final_wht_type=job['wht_file'])
+
+def write_cache( files, cache_file ):
+    '''
+    Keep the sky (MDRIZSKY) and the cosmic rays (crbit of the DQ)
+    of each chip of the flts, one extension (EXTNAME CR) per chip
+    with the flt and the sky in its header
+    '''
+    hdus = fits.HDUList( [ fits.PrimaryHDU() ] )
+
+    for iFlt in files:
+        flt = fits.open( iFlt )
+        for iHdu in flt[1:]:
+            if iHdu.header.get('EXTNAME') != 'SCI':
+                continue
+            chip = iHdu.header.get('EXTVER', 1)
+            cosmic = ( flt['DQ', chip].data & crbit ) != 0
+            iCache = fits.CompImageHDU( data=cosmic.astype( np.int16 ),
+                                        compression_type='RICE_1' )
+            iCache.header['EXTNAME'] = 'CR'
+            iCache.header['FLT'] = os.path.basename( iFlt )
+            iCache.header['CHIP'] = chip
+            iCache.header['MDRIZSKY'] = iHdu.header.get('MDRIZSKY', 0.)
+            hdus.append( iCache )
+        flt.close()
+
+    #written next to it first so it is never half written
+    hdus.writeto( cache_file+'.tmp', clobber=True )
+    os.rename( cache_file+'.tmp', cache_file )
+
+def restore_cache( files, cache_file, sky_file ):
+    '''
+    Put the cached cosmic rays in the DQ of (copies of) the flts
+    and write the cached sky of each chip to the astrodrizzle
+    skyfile SKY_FILE
+    '''
+    sky = {}
+    cosmic = {}
+    cache = fits.open( cache_file )
+    for iHdu in cache[1:]:
+        key = (iHdu.header['FLT'], iHdu.header['CHIP'])
+        cosmic[key] = iHdu.data != 0
+        sky[key] = iHdu.header['MDRIZSKY']
+    cache.close()
+
+    lines = []
+    for iFlt in files:
+        flt = fits.open( iFlt, mode='update' )
+        chips = sorted([ iHdu.header.get('EXTVER', 1) for iHdu in flt[1:]
+                         if iHdu.header.get('EXTNAME') == 'SCI' ])
+        for iChip in chips:
+            key = (os.path.basename( iFlt ), iChip)
+            dq = flt['DQ', iChip].data
+            flt['DQ', iChip].data = ( dq & ~np.array( crbit, dtype=dq.dtype ) ) | \
+                ( cosmic[key]*crbit ).astype( dq.dtype )
+        flt.close()
+
+        lines.append( iFlt+' '+' '.join([ repr( sky[(os.path.basename( iFlt ), iChip)] )
+                                          for iChip in chips ]) )
+
+    open( sky_file, 'wb' ).write( '\n'.join( lines )+'\n' )
+
+def final_drizzle( job ):
+    '''
+    Only the final drizzle of a job, with the cached sky and cosmic
+    rays, on copies of the flts in sweep_<output>/ whose products
+    are moved back (see workdir.py). Module level so it can be used
+    with Pool.map
+    '''
+    sweepDir = 'sweep_'+job['output']
+    if os.path.isdir( sweepDir ):
+        shutil.rmtree( sweepDir )
+
+    try:
+        with instrument.stage('astrodrizzle_final', exposure=job['output']):
+            workdir.run_in_directory( sweepDir, _final_drizzle, args=(job,),
+                                      files=job['files'],
+                                      products=[job['output']+'_drz_*.fits'],
+                                      copy_back=False )
+    finally:
+        shutil.rmtree( sweepDir )
+
+def _final_drizzle( job ):
+    '''
+    The final drizzle of a job, in its directory of copied flts
+    '''
+    from drizzlepac import astrodrizzle
+
+    flts = [ os.path.basename( iFlt ) for iFlt in job['files'] ]
+    restore_cache( flts, job['cache_file'], 'sweep.sky' )
+    astrodrizzle.AstroDrizzle( ','.join( flts ), \
+                               output=str(job['output']), \
+                               resetbits=0, \
+                               skysub=True, \
+                               skyfile='sweep.sky', \
+                               driz_separate=False, \
+                               median=False, \
+                               blot=False, \
+                               driz_cr=False, \
+                               final_wcs=True, \
+                               final_scale=job['pixel_scale'], \
+                               final_pixfrac=0.8, \
+                               final_kernel=job['drizzle_kernel'], \
+                               final_wht_type=job['wht_file'])
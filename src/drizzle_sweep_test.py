@@ -0,0 +1,164 @@
+"""
+Unittest classes for the sky and cosmic ray cache of drizzle_sweep.py
+
+Run from src/ with
+   python drizzle_sweep_test.py
+"""
+import unittest
+import os, shutil, tempfile
+import numpy as np
+import pyfits as fits
+import drizzle_sweep
+import stages
+
+
+def make_flt(filename):
+    """
+    An flt with one chip of SCI and DQ
+    """
+    header = fits.Header()
+    for keyword, value in [('CTYPE1', 'RA---TAN-SIP'), ('CTYPE2', 'DEC--TAN-SIP'),
+                           ('CRPIX1', 50.), ('CRPIX2', 50.),
+                           ('CRVAL1', 150.), ('CRVAL2', 2.),
+                           ('CD1_1', -1.4e-5), ('CD1_2', 0.),
+                           ('CD2_1', 0.), ('CD2_2', 1.4e-5),
+                           ('A_ORDER', 2), ('A_0_2', 1e-6),
+                           ('WCSNAME', 'IDC_v1')]:
+        header[keyword] = value
+    sci = fits.ImageHDU(data=np.random.RandomState(0).normal(size=(100, 100)),
+                        header=header, name='SCI')
+    dq = fits.ImageHDU(data=np.zeros((100, 100), dtype=np.int16), name='DQ')
+    fits.HDUList([fits.PrimaryHDU(), sci, dq]).writeto(filename)
+
+def tweakback(filename):
+    """
+    What tweakback does to an flt with the same solution : it writes
+    the wcs again under a new name and keeps the old one
+    """
+    flt = fits.open(filename, mode='update')
+    header = flt['SCI', 1].header
+    header['WCSNAMEA'] = header['WCSNAME']
+    header['CRVAL1A'] = header['CRVAL1']
+    header['WCSNAME'] = 'TWEAK'
+    header['CRVAL1'] = float(header['CRVAL1'])
+    header.add_history('tweakback')
+    flt.close()
+
+def astrodrizzle(filename):
+    """
+    What astrodrizzle does to an flt : the sky and the cosmic rays
+    """
+    flt = fits.open(filename, mode='update')
+    flt['SCI', 1].header['MDRIZSKY'] = 12.5
+    flt['SCI', 1].header.add_history('skymatch')
+    flt['DQ', 1].data[10:12, 20] |= drizzle_sweep.crbit
+    flt.close()
+
+def align_stage(files, log):
+    """
+    The per run drizzles and tweakback of the align: stage
+    """
+    for iFlt in files:
+        astrodrizzle(iFlt)
+        tweakback(iFlt)
+    open(log, 'ab').write('align\n')
+
+def drz_stage(files, pixel_scale, log):
+    """
+    The final drizzle of the drz: stage with reuse_cr, which
+    only needs the final drizzle if the cache is there
+    """
+    cache_file = drizzle_sweep.cr_hash(files, 'iminmed')+'.fits'
+    if os.path.isfile(cache_file):
+        open(log, 'ab').write('final %s\n' % pixel_scale)
+    else:
+        for iFlt in files:
+            astrodrizzle(iFlt)
+        drizzle_sweep.write_cache(files, cache_file)
+        open(log, 'ab').write('full %s\n' % pixel_scale)
+
+
+class Test_CrHash(unittest.TestCase):
+    """
+    A test class for the hash of the sky and cosmic ray cache
+    """
+    def setUp(self):
+        """
+        A working directory with an flt
+        """
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+
+        self.flt = 'j01_flt.fits'
+        make_flt(self.flt)
+        self.log = os.path.join(self.workdir, 'stages.log')
+
+    def tearDown(self):
+        """
+        Remove the working directory
+        """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def testRewrittenHeader(self):
+        """
+        Test that the hash does not change when tweakback and
+        astrodrizzle rewrite the flt with the same result
+        """
+        start = drizzle_sweep.cr_hash([self.flt], 'iminmed')
+        astrodrizzle(self.flt)
+        tweakback(self.flt)
+        self.assertEqual(drizzle_sweep.cr_hash([self.flt], 'iminmed'), start)
+
+    def testChangedFlt(self):
+        """
+        Test that the hash changes with the data, the wcs and
+        the combine_type
+        """
+        start = drizzle_sweep.cr_hash([self.flt], 'iminmed')
+        self.assertNotEqual(drizzle_sweep.cr_hash([self.flt], 'median'), start)
+
+        flt = fits.open(self.flt, mode='update')
+        flt['SCI', 1].header['CRVAL1'] = 150.001
+        flt.close()
+        moved = drizzle_sweep.cr_hash([self.flt], 'iminmed')
+        self.assertNotEqual(moved, start)
+
+        flt = fits.open(self.flt, mode='update')
+        flt['SCI', 1].data[0, 0] += 1.
+        flt.close()
+        self.assertNotEqual(drizzle_sweep.cr_hash([self.flt], 'iminmed'), moved)
+
+    def pipeline(self, pixel_scale):
+        """
+        The align: and drz: stages of main.main with reuse_cr
+        """
+        graph = stages.StageGraph()
+        graph.add_stage('align:F', align_stage,
+                        inputs=[self.flt], modifies=[self.flt],
+                        params={'search_rad':1.},
+                        args=([self.flt], self.log))
+        graph.add_stage('drz:F', drz_stage,
+                        inputs=[self.flt], modifies=[self.flt],
+                        params={'pixel_scale':pixel_scale},
+                        depends=['align:F'],
+                        args=([self.flt], pixel_scale, self.log))
+        graph.run()
+
+        ran = open(self.log, 'rb').read().splitlines()
+        os.remove(self.log)
+        return ran
+
+    def testParamsOnlyRerun(self):
+        """
+        Test that a rerun through the stage graph with only a new
+        pixel scale reuses the cache
+        """
+        self.assertEqual(self.pipeline(0.03), ['align', 'full 0.03'])
+        self.assertEqual(self.pipeline(0.05), ['final 0.05'])
+
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_CrHash)
+    unittest.TextTestRunner(verbosity=2).run(suite)
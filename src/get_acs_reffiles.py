@@ -6,12 +6,18 @@ And then to download missing ones.
 
 
 import os as os
+import glob as glob
+import json as json
 import pyfits as py
+from multiprocessing.pool import ThreadPool
+import instrument as instrument
+import reffile_cache as reffile_cache
 
 
+@instrument.timed('reffiles')
 def get_acs_reffiles( cte_file, ext='all',
                     acs_reffiles_location = 'ftp://ftp.stsci.edu/cdbs/jref/',
-                      add_jref=True ):
+                      add_jref=True, cache_root=None ):
     '''
     For the input acs_file i will look in the header and check
     for the required calibration files
@@ -26,18 +32,43 @@ def get_acs_reffiles( cte_file, ext='all',
 
     OPTIONAL INPUT: EXT : the file extension to specifially download. If not set
                           defaults to 'all', and will download all extensions
+                    ACS_REFFILES_LOCATION : the server to get the files from, can also
+                          be a local directory (a copy of cdbs/jref) to work offline
+                    CACHE_ROOT : the directory of the reference file cache shared
+                          by all clusters (see reffile_cache.py). If not set defaults
+                          to $HST_REFFILE_CACHE or ~/.hst_reduction/reffiles
 
     UPDATE :
        1. Scraping the file from  'ftp://ftp.stsci.edu/cdbs/jref/' using curl
           instead of 'https://hst-crds.stsci.edu/browse' using wget -m -nd -r -A.fits
           which is much cleaner. Only, if it fails because this is not a exhaustive database
           we should bare in mind
+       2. Files are now kept in a cache shared between clusters and only
+          fetched from the server the first time they are needed
 
     '''
+    cache = reffile_cache.RefFileCache( root=cache_root,
+                                        server=acs_reffiles_location )
 
     print 'Getting ACS referenes files for ',cte_file
-    header = py.open( cte_file )[0].header
-    
+    header = py.getheader( cte_file )
+
+    for get_file, save_file in required_reffiles( header, ext=ext,
+                                                  add_jref=add_jref ):
+        fetch_reffile( get_file, save_file, cache, add_jref=add_jref )
+
+
+def required_reffiles( header, ext='all', add_jref=True ):
+    '''
+    Find the reference files listed in the header of an exposure
+
+    INPUT : HEADER : the primary header of a raw or cte file
+
+    OPTIONAL INPUT: EXT : the file extension wanted, or 'all'
+                    ADD_JREF : save the files with 'jref' on the front
+
+    OUTPUT : a list of (name on the server, name to save as) for each file
+    '''
     req_calibration_files = []
     for i in header.keys():
         if header[i] == True:
@@ -56,20 +87,84 @@ def get_acs_reffiles( cte_file, ext='all',
                 get_file = 'xa81724cj_cte.fits'
 
             if (ext == 'all') | (ext == get_file_ext):
-                if not os.path.isfile( save_file ):
-                    if not os.path.isfile( get_file ) :
-                        print("FETCHING %s\n" %get_file)
-                        os.system("curl -O "+acs_reffiles_location+"/"+get_file)
-                        if not os.path.isfile(get_file):
-                            raise ValueError('Error in obtaining the reference file')
-                        os.system("mv "+get_file+" "+save_file)
-                    else:
-                        if add_jref:
-                            os.system("mv "+get_file+" "+save_file)
+                req_calibration_files.append( (get_file, save_file) )
+
+    return req_calibration_files
+
+def fetch_reffile( get_file, save_file, cache, add_jref=True ):
+    '''
+    Get one reference file from the cache (or server) if it
+    is not already at save_file
+    '''
+    if not os.path.isfile( save_file ):
+        if not os.path.isfile( get_file ) :
+            cache.get( get_file, save_file )
+        else:
+            if add_jref:
+                os.system("mv "+get_file+" "+save_file)
+
+
+def plan_acs_reffiles( files='j*q_raw.fits', ext='all', add_jref=True,
+                       acs_reffiles_location = 'ftp://ftp.stsci.edu/cdbs/jref/',
+                       cache_root=None, workers=4,
+                       manifest_file='reffiles.manifest' ):
+    '''
+    Get the reference files for a whole set of exposures at once
+
+    Rather than each exposure opening its header and checking its
+    reference files one by one, the headers of all the exposures are
+    read once, the unique set of reference files is found and each
+    is fetched (from the cache, local mirror or server) exactly once,
+    several at the same time.
+
+    OPTIONAL INPUT : FILES : a string (wildcard) or list of the raw files
+                     EXT, ADD_JREF, ACS_REFFILES_LOCATION, CACHE_ROOT : see get_acs_reffiles
+                     WORKERS : the number of files fetched at the same time
+                     MANIFEST_FILE : the json file the manifest is written to, None for no file
+
+    OUTPUT : the manifest, a dictionary of
+             'exposures' : raw file --> list of its reference files (as saved)
+             'types' : extension (e.g. bia, drk, pfl) --> list of unique reference files
+    '''
+    if isinstance( files, str ):
+        files = sorted(glob.glob( files ))
+
+    cache = reffile_cache.RefFileCache( root=cache_root,
+                                        server=acs_reffiles_location )
 
-                
+    manifest = {'exposures':{}, 'types':{}}
+    unique_files = {}
+    for iFile in files:
+        header = py.getheader( iFile )
+        reffiles = required_reffiles( header, ext=ext, add_jref=add_jref )
 
+        manifest['exposures'][iFile] = [ save_file for get_file, save_file in reffiles ]
+        for get_file, save_file in reffiles:
+            unique_files[save_file] = get_file
 
-        
+    print("%i exposures need %i unique reference files" %
+          (len(files), len(unique_files)))
 
-                
+    for save_file, get_file in sorted(unique_files.items()):
+        file_type = get_file.split('_')[1][:3]
+        manifest['types'].setdefault( file_type, [] ).append( save_file )
+
+    pool = ThreadPool( processes=workers )
+    try:
+        pool.map( lambda item: fetch_reffile( item[1], item[0], cache,
+                                              add_jref=add_jref ),
+                  sorted(unique_files.items()) )
+    finally:
+        pool.close()
+        pool.join()
+
+    if manifest_file is not None:
+        json.dump( manifest, open( manifest_file, 'wb' ), indent=1 )
+
+    return manifest
+
+def read_manifest( manifest_file='reffiles.manifest' ):
+    '''
+    Read the manifest written by plan_acs_reffiles
+    '''
+    return json.load( open( manifest_file, 'rb' ) )
@@ -11,7 +11,7 @@ Date : March 21 2013 BIRTHDYA!
 
 '''
 import csv as c
-import pyfits as py
+import header_index as header_index
 import numpy as np
 
 def get_hst_band( calacs_file_list='calacs.lis'):
@@ -44,24 +44,25 @@ def get_hst_band( calacs_file_list='calacs.lis'):
 
     images = []
     detector=[]
-    #loop through each image and find the detector
-
     for image in cte_obj:
+        images.extend( [ iImage for iImage in image if iImage != '' ] )
 
-        for i in xrange(len(image)):
+    #the filters of all the images come from the header index,
+    #each header is read once and only if it has changed
+    headers = header_index.read_headers( images )
 
-            hdulist = py.open(image[i])
+    #loop through each image and find the detector
+    for i in xrange(len(images)):
 
-            filter1 = hdulist[0].header["FILTER1"]
-            filter2 = hdulist[0].header["FILTER2"]
+        filter1 = headers[images[i]]["FILTER1"]
+        filter2 = headers[images[i]]["FILTER2"]
 
-            if filter1 == 'CLEAR1L':
-                detector.append(filter2)
-            else:
-                detector.append(filter1)
+        if filter1 == 'CLEAR1L':
+            detector.append(filter2)
+        else:
+            detector.append(filter1)
 
-            images.append(image[i])            
-            detector_ob.write(str(image[i])+' '+str(detector[i])+'\n')
+        detector_ob.write(str(images[i])+' '+str(detector[i])+'\n')
 
             
     filters = np.unique(detector)
@@ -75,6 +76,22 @@ def get_hst_band( calacs_file_list='calacs.lis'):
 
              
     return filters
+
+def read_hst_bands( detector_file='detector.lis' ):
+    '''
+    Read back the hst bands found by a previous call to
+    get_hst_band, without opening any of the fits files.
+
+    KEYWORDS : detector_file : the list of images and their
+               detector written by get_hst_band
+
+    OUTPUTS : the unique hst filters
+    '''
+    detector = []
+    for line in open(detector_file,"rb").readlines()[1:]:
+        detector.append(line.split()[1])
+
+    return np.unique(detector)
     
 
 if __name__ == "__main__":
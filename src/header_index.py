@@ -0,0 +1,105 @@
+'''
+header_index.py
+
+An index of the primary header keywords that the pipeline
+needs from each exposure (target name, exposure time, filters...)
+
+Rather than each check and stage opening every fits file again,
+the primary headers are read once (header only, the data is never
+touched and the file is closed) and the keywords are kept in a
+small json table in the working directory, keyed by the path of
+the file and its modification time and size. The table is only
+re-read from the fits file if the file has changed.
+
+Usage :
+    headers = header_index.read_headers( glob.glob('j*_raw.fits') )
+    print headers['jabc01abq_raw.fits']['TARGNAME']
+
+'''
+import os as os
+import json as json
+import glob as glob
+import pyfits as fits
+
+default_keywords = ['ROOTNAME', 'TARGNAME', 'EXPTIME', 'FILTER1', 'FILTER2',
+                    'DATE-OBS', 'TIME-OBS', 'DETECTOR']
+
+default_index_file = 'hst_headers.index'
+
+
+def read_headers( files='j*_raw.fits', keywords=None, index_file=None ):
+    '''
+    Get the primary header keywords of a set of exposures
+
+    INPUT : FILES : a string (wildcard) or a list of the fits files
+
+    KEYWORDS :
+        KEYWORDS : the list of header keywords wanted, defaults to
+                   default_keywords. Keywords missing from a header are None
+        INDEX_FILE : the json table of the headers already read,
+                     None for the default (hst_headers.index)
+
+    OUTPUT : a dictionary of file name --> dictionary of keyword --> value
+    '''
+    if isinstance( files, str ):
+        files = sorted(glob.glob( files ))
+    if keywords is None:
+        keywords = default_keywords
+    if index_file is None:
+        index_file = default_index_file
+
+    if os.path.isfile( index_file ):
+        index = json.load( open( index_file, 'rb' ) )
+    else:
+        index = {}
+
+    headers = {}
+    changed = False
+    for iFits in files:
+        key = os.path.abspath( iFits )
+        stat = os.stat( iFits )
+        entry = index.get( key )
+
+        if entry is not None and ( entry['mtime'] != stat.st_mtime or \
+                                   entry['size'] != stat.st_size ):
+            entry = None
+
+        if entry is None or \
+                not all([ iKeyword in entry['keywords'] for iKeyword in keywords ]):
+            #keep any keywords other stages have asked for as well
+            wanted = set(keywords) | set(default_keywords)
+            if entry is not None:
+                wanted |= set(entry['keywords'].keys())
+
+            header = fits.getheader( iFits, 0 )
+            entry = {'mtime':stat.st_mtime, 'size':stat.st_size,
+                     'keywords':dict([ (iKeyword, header.get( iKeyword ))
+                                       for iKeyword in wanted ])}
+            index[key] = entry
+            changed = True
+
+        headers[iFits] = dict([ (iKeyword, entry['keywords'][iKeyword])
+                                for iKeyword in keywords ])
+
+    if changed:
+        tmp_file = index_file+'.tmp'
+        json.dump( index, open( tmp_file, 'wb' ) )
+        os.rename( tmp_file, index_file )
+
+    return headers
+
+def get_keyword( files, keyword, index_file=None ):
+    '''
+    The value of one keyword for each of the files, in the same order
+
+    INPUT : FILES : a string (wildcard) or a list of the fits files
+            KEYWORD : the header keyword
+
+    OUTPUT : a list of the values
+    '''
+    if isinstance( files, str ):
+        files = sorted(glob.glob( files ))
+
+    headers = read_headers( files, keywords=[keyword], index_file=index_file )
+
+    return [ headers[iFits][keyword] for iFits in files ]
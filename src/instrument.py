@@ -0,0 +1,267 @@
+'''
+instrument.py
+
+Timing, memory and I/O instrumentation of the stages of the
+reduction.
+
+Each stage is wrapped in
+
+   with instrument.stage('calacs', exposure=iCTE_file):
+       ...
+
+or decorated with @instrument.timed('calacs'), which appends one
+json line per call to the trace file (hst_reduction_trace.jsonl)
+with
+
+   stage : the name of the stage
+   exposure : the exposure (or run / filter) the stage was run on
+   pid : the process it was run in
+   start : the unix time the stage started
+   wall : the wall time in seconds
+   cpu : the user+system cpu time in seconds, including any
+         subprocesses (calacs, arctic, idl) that finished in the stage
+   maxrss_mb : the peak resident memory of the process in the stage
+               in MB, where the peak can be reset (linux, see
+               _reset_peak_rss), otherwise the peak of the process
+               so far
+   rss_scope : 'stage' or 'process', which of the two maxrss_mb is
+   child_maxrss_mb : the peak resident memory of the largest
+               subprocess that finished so far (not only in the
+               stage), in MB
+   read_bytes, write_bytes : the bytes read and written in the stage,
+               including subprocesses that finished in the stage
+   status : 'ok' or 'error'
+
+As each record is a single appended line, the workers of the pool
+in main.main can all write to the same trace file. At the end of
+a run summary() prints a table of where the time went.
+
+'''
+import os as os
+import sys
+import time as time
+import json as json
+import resource as resource
+from contextlib import contextmanager
+from functools import wraps
+
+trace_file = 'hst_reduction_trace.jsonl'
+
+#the peak memory of each stage that is running in this process,
+#innermost last, as resetting the peak for an inner stage loses
+#it for the stages around it
+_stage_peaks = []
+
+
+def _io_counters():
+    '''
+    The bytes read and written by this process and its reaped
+    children. Uses /proc/self/io where there is one (linux),
+    otherwise the block counts of getrusage.
+    '''
+    if os.path.isfile('/proc/self/io'):
+        counters = {}
+        for line in open('/proc/self/io', 'rb'):
+            key, value = line.split(':')
+            counters[key.strip()] = int(value)
+        return counters['rchar'], counters['wchar']
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self_usage.ru_inblock + child_usage.ru_inblock)*512, \
+        (self_usage.ru_oublock + child_usage.ru_oublock)*512
+
+def _maxrss_mb( who=resource.RUSAGE_SELF ):
+    '''
+    The high-water mark of the resident memory in MB of this
+    process or (RUSAGE_CHILDREN) its largest reaped child, over
+    their whole life (ru_maxrss is in kB on linux, bytes on mac)
+    '''
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss/1024.**2
+    return maxrss/1024.
+
+def _reset_peak_rss():
+    '''
+    Reset the peak resident memory (VmHWM) of this process to
+    its current resident memory, by writing 5 to
+    /proc/self/clear_refs (linux 4.0 on)
+
+    OUTPUT : True if it was reset
+    '''
+    try:
+        clear_refs = open('/proc/self/clear_refs', 'wb')
+        clear_refs.write('5')
+        clear_refs.close()
+    except (IOError, OSError):
+        return False
+    return True
+
+def _peak_rss_mb():
+    '''
+    The peak resident memory (VmHWM) in MB of this process since
+    it was last reset, None where there is no /proc/self/status
+    '''
+    try:
+        for line in open('/proc/self/status', 'rb'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])/1024.
+    except (IOError, OSError):
+        pass
+    return None
+
+def _cpu_time():
+    '''
+    The user+system time of this process and its reaped children
+    '''
+    times = os.times()
+    return times[0]+times[1]+times[2]+times[3]
+
+def available_memory():
+    '''
+    The memory in bytes available to start new processes, from
+    MemAvailable in /proc/meminfo where there is one (linux),
+    otherwise the physical memory of the machine
+    '''
+    if os.path.isfile('/proc/meminfo'):
+        for line in open('/proc/meminfo', 'rb'):
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1])*1024
+
+    return os.sysconf('SC_PHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+
+
+@contextmanager
+def stage( name, exposure=None, trace=None ):
+    '''
+    Context manager that records one stage in the trace file
+
+    INPUT : NAME : the name of the stage, e.g. 'calacs'
+    KEYWORDS :
+        EXPOSURE : the exposure, obs run or filter the stage is for
+        TRACE : the trace file, default instrument.trace_file
+    '''
+    if trace is None:
+        trace = trace_file
+
+    #the peak of the stages around this one so far, before it is reset
+    peak = _peak_rss_mb()
+    if _stage_peaks and peak is not None:
+        _stage_peaks[-1] = max(_stage_peaks[-1], peak)
+    reset = peak is not None and _reset_peak_rss()
+    _stage_peaks.append( 0. )
+
+    start = time.time()
+    start_cpu = _cpu_time()
+    start_read, start_write = _io_counters()
+    status = 'error'
+
+    try:
+        yield
+        status = 'ok'
+    finally:
+        end_read, end_write = _io_counters()
+
+        peak = max(_stage_peaks.pop(), _peak_rss_mb() or 0.)
+        if _stage_peaks:
+            _stage_peaks[-1] = max(_stage_peaks[-1], peak)
+        if reset:
+            maxrss, scope = peak, 'stage'
+        else:
+            maxrss, scope = _maxrss_mb(), 'process'
+
+        record = {'stage':name, 'exposure':exposure, 'pid':os.getpid(),
+                  'start':start, 'wall':time.time()-start,
+                  'cpu':_cpu_time()-start_cpu,
+                  'maxrss_mb':maxrss,
+                  'rss_scope':scope,
+                  'child_maxrss_mb':_maxrss_mb(resource.RUSAGE_CHILDREN),
+                  'read_bytes':end_read-start_read,
+                  'write_bytes':end_write-start_write,
+                  'status':status}
+
+        traceobj = open( trace, 'ab' )
+        traceobj.write( json.dumps(record)+'\n' )
+        traceobj.close()
+
+def timed( name ):
+    '''
+    Decorator version of stage. If the first argument of the
+    decorated function is a string it is taken as the exposure.
+    '''
+    def decorator( function ):
+        @wraps(function)
+        def wrapper( *args, **kwargs ):
+            if len(args) > 0 and isinstance(args[0], str):
+                exposure = args[0]
+            else:
+                exposure = None
+            with stage( name, exposure=exposure ):
+                return function( *args, **kwargs )
+        return wrapper
+    return decorator
+
+
+def reset( trace=None ):
+    '''
+    Remove the trace file at the start of a run
+    '''
+    if trace is None:
+        trace = trace_file
+    if os.path.isfile( trace ):
+        os.remove( trace )
+
+def read_trace( trace=None ):
+    '''
+    Read the trace file
+
+    OUTPUT : a list of the records (dictionaries) in the trace
+    '''
+    if trace is None:
+        trace = trace_file
+    if not os.path.isfile( trace ):
+        return []
+    return [ json.loads(line) for line in open( trace, 'rb' )
+             if len(line.strip()) > 0 ]
+
+def summary( trace=None ):
+    '''
+    Print a table of the total wall and cpu time, peak memory
+    and I/O of each stage in the trace, in the order the stages
+    first started.
+
+    OUTPUT : a dictionary of the totals for each stage
+    '''
+    records = read_trace( trace )
+    records.sort( key=lambda record: record['start'] )
+
+    order = []
+    totals = {}
+    for iRecord in records:
+        name = iRecord['stage']
+        if name not in totals:
+            order.append( name )
+            totals[name] = {'calls':0, 'errors':0, 'wall':0., 'cpu':0.,
+                            'maxrss_mb':0., 'read_bytes':0, 'write_bytes':0}
+        totals[name]['calls'] += 1
+        totals[name]['errors'] += iRecord['status'] != 'ok'
+        totals[name]['wall'] += iRecord['wall']
+        totals[name]['cpu'] += iRecord['cpu']
+        totals[name]['maxrss_mb'] = max(totals[name]['maxrss_mb'],
+                                        iRecord['maxrss_mb'])
+        totals[name]['read_bytes'] += iRecord['read_bytes']
+        totals[name]['write_bytes'] += iRecord['write_bytes']
+
+    print('%-20s %6s %6s %10s %10s %10s %10s %10s' %
+          ('STAGE', 'CALLS', 'ERRORS', 'WALL(s)', 'CPU(s)',
+           'RSS(MB)', 'READ(MB)', 'WRITE(MB)'))
+    for name in order:
+        print('%-20s %6i %6i %10.1f %10.1f %10.1f %10.1f %10.1f' %
+              (name, totals[name]['calls'], totals[name]['errors'],
+               totals[name]['wall'], totals[name]['cpu'],
+               totals[name]['maxrss_mb'],
+               totals[name]['read_bytes']/1024.**2,
+               totals[name]['write_bytes']/1024.**2))
+
+    return totals
@@ -32,6 +32,7 @@ Need to be in the correct directory for this to work
 
 '''
 import cte_correct as cte
+import get_acs_reffiles as gar
 import run_calacs as run_calacs
 import get_hst_band as ghb
 import drizzle as drizzle
@@ -39,14 +40,22 @@ import numpy as np
 import glob as glob
 import os as os
 import sys
+import shutil as shutil
 import argparse as ap
 import pyfits as fits
+import multiprocessing as mp
 import CheckTargName as CheckTargets
 import CheckExposureTime as CheckExposureTime
+import stages as stages
+import instrument as instrument
+import workdir as workdir
 
 def main( cluster, single=False, drizzle_kernel='square', idl=False,
           pixel_scale=0.03, wht_file='ERR', jref_path='./',\
-              search_rad=1., thresh=1.):
+              search_rad=1., thresh=1., workers=1, amp_workers=1,
+              drizzle_workers=1, drizzle_memory=None,
+              single_workers=None, psf_catalogue=None, compress_singles=False,
+              quick_look=False, reuse_cr=False, detector='sextractor'):
     '''
     The main function to do what is explained in docs/README
 
@@ -57,6 +66,23 @@ def main( cluster, single=False, drizzle_kernel='square', idl=False,
              These are used for PSF estimation.
              WARNING: If you are drizzling together a lot of images
              this will produce a lot of data (Each drz image is ~300mb)
+             unless only the cutouts around the PSF_CATALOGUE stars are
+             kept or they are compressed (see singles.py)
+        SINGLE_WORKERS: the number of exposures drizzled at once when SINGLE,
+             default the number of cpus
+        PSF_CATALOGUE: an ascii catalogue of the RA and DEC of the PSF stars,
+             if given only cutouts around these are kept of the singles
+        COMPRESS_SINGLES: write the singles tile compressed as float32
+        QUICK_LOOK: once a filter is aligned write a coarse quick look
+             drizzle, CLUSTER_FILTER_quick_drz.fits, to check the
+             alignment before the final drizzle (see drizzle.quick_drizzle)
+        REUSE_CR: keep the sky and cosmic rays of the final drizzle of each
+             filter, so a rerun with another PIXEL_SCALE, DRIZZLE_KERNEL or
+             WHT_FILE only redoes the final stage of astrodrizzle
+             (see drizzle_sweep.py)
+        DETECTOR: how the sources of the run drizzles are found to align
+             them, 'sextractor' or 'numpy' to detect them in process
+             (see tweakreg_sextract.py)
         Following are drizzle options, see drizzle.py for more:
 
         DRIZZLE_KERNEL : The kernel used in the final drizzlign stage
@@ -65,30 +91,119 @@ def main( cluster, single=False, drizzle_kernel='square', idl=False,
         IDL : If true use the idl version of the CTI corretion
         SEARCH_RAD: the search radius for when aligning images, can be either a float of an array. If array must be the same length as the number of filters
         THRESH: S/N thresh for sources to be used to align imagescan be either afloat of an array. If array must be the same length as the number of filters
+        WORKERS: the number of processes to run the per-exposure stages
+             (cte correction, calacs and the wcs update) in. Each raw
+             file is independent until the drizzle stage so these are
+             farmed out and joined before the bands are found.
+             Default is 1, i.e. one exposure at a time.
+        AMP_WORKERS: the number of the four amplifiers of each exposure
+             that arctic corrects at the same time. Bear in mind the total
+             number of processes is WORKERS x AMP_WORKERS.
+        DRIZZLE_WORKERS: the number of filters aligned and drizzled at the
+             same time. Each filter is then drizzled in its own directory,
+             drizzle_<filter>, on copies of its flts whose changes are
+             copied back. The directory keeps its per run drizzles (keep/),
+             the final drizzle is moved back up. Default is 1, i.e. one
+             filter at a time in this directory.
+        DRIZZLE_MEMORY: the peak memory of the drizzle of a filter in GB.
+             A filter is only started when this fits in the memory that is
+             still available. Default is estimated from the size of the
+             flts of each filter (see drizzle_memory_estimate).
+
+    Each stage is a node in a stages.StageGraph, which keeps the hashes
+    of the inputs and parameters of every stage in hst_reduction.stages.
+    A rerun only redoes the stages that are stale, so e.g. changing the
+    PIXEL_SCALE or DRIZZLE_KERNEL only reruns the final astrodrizzle.
+
+    The wall time, cpu time, peak memory and I/O of each stage and
+    exposure are written to hst_reduction_trace.jsonl (see instrument.py)
+    and summarised in a table at the end of the run.
 
     '''
     os.environ['jref'] = jref_path
 
+    if psf_catalogue is not None:
+        psf_catalogue = os.path.abspath( psf_catalogue )
+
     sys.stdout = Logger("hst_reduction.log")
 
+    #The per stage timing, memory and I/O of this run
+    #are traced in hst_reduction_trace.jsonl
+    instrument.reset()
+
     #Test for the environment variable
 
     if 'HST_REDUCTION' not in os.environ.keys():
         raise ValueError("HST_REDUCTION KEYWORD NOT FOUND IN ENVIRMENT VARIABLE PLEASE ADD")
     
     #ALso check that the taget names are all the same
-    CheckTargets.CheckTargName()
-    #and that the exposure time > 0
-    CheckExposureTime.CheckExposureTime()
+    with instrument.stage('checks'):
+        CheckTargets.CheckTargName()
+        #and that the exposure time > 0
+        CheckExposureTime.CheckExposureTime()
     
-    #1. Run the cte correction on the data
-    cte.cte_correct( idl=idl )
+    graph = stages.StageGraph()
+
+    if workers > 1:
+        pool = mp.Pool( processes=workers )
+    else:
+        pool = None
+
+    #1 & 2. Run the cte correction on the data and flat field
+    #each image with calacs. Each exposure is independent so
+    #these are run in the pool if there is one
+    raw_files = sorted(glob.glob('j*q_raw.fits'))
+
+    #The idl cte correction needs the bias files of each exposure,
+    #find the unique set for all exposures and get each once
+    if idl:
+        graph.add_stage( 'reffiles', gar.plan_acs_reffiles,
+                         inputs=raw_files, outputs=['reffiles.manifest'],
+                         params={'jref_path':jref_path},
+                         kwargs={'files':raw_files, 'ext':'bia',
+                                 'add_jref':False} )
+        cte_depends = ['reffiles']
+        reffiles_manifest = 'reffiles.manifest'
+    else:
+        cte_depends = []
+        reffiles_manifest = None
+
+    cte_files = []
+    flt_stages = []
+    for iRaw_File in raw_files:
+        iCTE_file = iRaw_File[:-9]+"_cte_raw.fits"
+        flt_file = iCTE_file[:-9]+'_flt.fits'
+
+        graph.add_stage( 'cte_raw:'+iRaw_File, cte.cte_correct,
+                         inputs=[iRaw_File], outputs=[iCTE_file],
+                         params={'idl':idl},
+                         depends=cte_depends,
+                         kwargs={'files':iRaw_File, 'idl':idl,
+                                 'amp_workers':amp_workers,
+                                 'reffiles_manifest':reffiles_manifest} )
+
+        graph.add_stage( 'flt:'+iRaw_File, flat_field,
+                         inputs=[iCTE_file], outputs=[flt_file],
+                         params={'jref_path':jref_path},
+                         depends=['cte_raw:'+iRaw_File],
+                         args=(iCTE_file, jref_path) )
+
+        cte_files.append( iCTE_file )
+        flt_stages.append( 'flt:'+iRaw_File )
 
-    #2. Flat field the image with calacs
-    run_calacs.run_calacs( )
-    
     #3. Get all the bands that are involved
-    hst_filters = ghb.get_hst_band()
+    graph.add_stage( 'bands', get_bands,
+                     inputs=cte_files, outputs=['detector.lis'],
+                     depends=flt_stages, args=(cte_files,) )
+
+    try:
+        graph.run( pool=pool )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    hst_filters = ghb.read_hst_bands()
 
     #4. Prepare for drizzling by moving some jref files back
     #   to original name
@@ -100,20 +215,151 @@ def main( cluster, single=False, drizzle_kernel='square', idl=False,
         thresh = np.zeros(len(hst_filters))+thresh
 
 
+    if drizzle_workers > 1:
+        jref_path = os.path.abspath( jref_path )+os.sep
+
     for iCount, iFilter in enumerate(hst_filters):
         
         fileobj = open( iFilter+'.lis', 'rb')
         flts = [ iFlt[0:13]+'_flt.fits' for iFlt in fileobj ]
-        drizzle.drizzle( 'USING FILES', cluster, iFilter,
-                         files=flts,
-                         jref_path=jref_path, single=single,
-                         search_rad=search_rad, thresh=thresh,
-                         pixel_scale=pixel_scale,
-                         drizzle_kernel=drizzle_kernel,
-                         wht_file=wht_file)
+        fileobj.close()
+
+        #5. Align the observation runs of this filter, the per run
+        #drizzles are kept in keep/ if there is more than one run
+        obsRun, fltList = drizzle.obs_name( None, files=flts )
+        uniqueObs = np.unique(np.array(obsRun))
+
+        #The drizzles write astrodrizzle files with the same names, so
+        #to run the filters at the same time each is in its own directory
+        if drizzle_workers > 1:
+            filterDir = 'drizzle_'+iFilter
+        else:
+            filterDir = ''
+
+        if len(uniqueObs) > 1:
+            keep = [ os.path.join( filterDir, 'keep', str(iDate)+'_drz_sci.fits' )
+                     for iDate in uniqueObs ]
+        else:
+            keep = []
+
+        if drizzle_memory is None:
+            memory = drizzle_memory_estimate( flts )
+        else:
+            memory = drizzle_memory*1024**3
+
+        align_kwargs = {'files':flts, 'jref_path':jref_path,
+                        'search_rad':search_rad[iCount],
+                        'thresh':thresh[iCount],
+                        'quick_look':quick_look,
+                        'detector':detector,
+                        'wcs_update':False, 'final':False}
+        drz_kwargs = {'files':flts, 'jref_path':jref_path,
+                      'single':single, 'pixel_scale':pixel_scale,
+                      'drizzle_kernel':drizzle_kernel,
+                      'wht_file':wht_file,
+                      'single_workers':single_workers,
+                      'psf_catalogue':psf_catalogue,
+                      'compress_singles':compress_singles,
+                      'reuse_cr':reuse_cr,
+                      'wcs_update':False, 'individual':False}
+        if drizzle_workers > 1:
+            align_function = workdir.run_in_directory
+            align_args = (filterDir, drizzle.drizzle,
+                          ('USING FILES', cluster, iFilter), align_kwargs, flts,
+                          [cluster+'_'+iFilter+'_quick_drz.fits'])
+            align_kwargs = {}
+            drz_function = workdir.run_in_directory
+            drz_args = (filterDir, drizzle.drizzle,
+                        ('USING FILES', cluster, iFilter), drz_kwargs, flts,
+                        [cluster+'_'+iFilter+'_drz_*.fits', 'singles/*'])
+            drz_kwargs = {}
+        else:
+            align_function = drz_function = drizzle.drizzle
+            align_args = drz_args = ('USING FILES', cluster, iFilter)
 
+        #The flts are copied into the directory and their changes
+        #(the tweaked wcs, the sky) copied back (see workdir.py), so
+        #the stages read and change the flts here
+        if quick_look:
+            quick = [ cluster+'_'+iFilter+'_quick_drz.fits' ]
+        else:
+            quick = []
 
+        graph.add_stage( 'align:'+iFilter, align_function,
+                         inputs=flts, outputs=keep+quick, modifies=flts,
+                         params={'search_rad':search_rad[iCount],
+                                 'thresh':thresh[iCount],
+                                 'quick_look':quick_look,
+                                 'detector':detector},
+                         depends=['bands'],
+                         args=align_args, kwargs=align_kwargs,
+                         memory=memory )
 
+        #6. The final drizzle of the aligned flts, single_workers
+        #only sets how many singles are drizzled at once so it
+        #is not a parameter of the products
+        graph.add_stage( 'drz:'+iFilter, drz_function,
+                         inputs=flts, modifies=flts,
+                         outputs=[cluster+'_'+iFilter+'_drz_sci.fits'],
+                         params={'single':single, 'pixel_scale':pixel_scale,
+                                 'drizzle_kernel':drizzle_kernel,
+                                 'wht_file':wht_file,
+                                 'psf_catalogue':psf_catalogue,
+                                 'compress_singles':compress_singles,
+                                 'reuse_cr':reuse_cr},
+                         depends=['align:'+iFilter],
+                         args=drz_args, kwargs=drz_kwargs,
+                         memory=memory )
+
+    #The filters are drizzled at the same time in their own
+    #directories if there are drizzle_workers, as many as
+    #fit in the memory available
+    graph.run( processes=drizzle_workers,
+               max_memory=instrument.available_memory() )
+
+    instrument.summary()
+
+
+def drizzle_memory_estimate( flts ):
+    '''
+    A rough estimate of the peak memory in bytes of the astrodrizzle
+    of a filter, twice the size of its flts (the median combination
+    holds a single drizzled image of each exposure on the output grid)
+    '''
+    return 2*sum([ os.path.getsize( iFlt ) for iFlt in flts
+                   if os.path.isfile( iFlt ) ])
+
+def flat_field( cte_file, jref_path='./' ):
+    '''
+    Flat field a single cte corrected exposure with calacs
+    and update the wcs of the resulting flt.
+
+    INPUT : CTE_FILE : the name of the cte corrected raw file
+    KEYWORDS :
+        JREF_PATH : the location of the reference files
+    '''
+    os.environ['jref'] = jref_path
+
+    run_calacs.run_calacs( FitsFiles=cte_file, calacs_list_name=None )
+
+    flt_file = cte_file[:-9]+'_flt.fits'
+    drizzle.update_wcs( flt_file, files=[flt_file] )
+
+def get_bands( cte_files ):
+    '''
+    Write the list of calac'd files and split them
+    in to lists for each hst filter.
+
+    INPUT : CTE_FILES : a list of the cte corrected raw files
+
+    OUTPUT : the hst filters (see get_hst_band)
+    '''
+    calacs_list = open('calacs.lis','wb')
+    for iCTE_file in cte_files:
+        calacs_list.write( iCTE_file+'\n' )
+    calacs_list.close()
+
+    return ghb.get_hst_band()
 
     
 class Logger(object):
@@ -126,6 +372,10 @@ class Logger(object):
         self.terminal.write(message)
         self.log.write(message)
 
+    def flush(self):
+        self.terminal.flush()
+        self.log.flush()
+
 
 if __name__ == '__main__':
     method_name, cluster = sys.argv[0], sys.argv[1]
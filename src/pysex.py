@@ -16,15 +16,23 @@ Usage:
     cat = pysex.run(myimage, params=['X_IMAGE', 'Y_IMAGE', 'FLUX_APER'], conf_args={'PHOT_APERTURES':5})
     print cat['FLUX_APER']
 
+    #skip the ascii catalogue, sextractor writes a fits table that is
+    #read straight into a numpy record array
+    cat = pysex.run(myimage, params=['X_IMAGE', 'Y_IMAGE'], catalog_type='FITS_LDAC')
+
 """
 
-import os, shutil, sys
+import os, shutil, sys, tempfile, subprocess
 import asciidata
 import numpy as np
 import glob
 
 command = 'sex'
 
+#the sextractor catalogue types that are read without asciidata
+#and the extension holding the table of objects
+fits_catalog_types = {'FITS_1.0':1, 'FITS_LDAC':2}
+
 
 def _reg_path(filename):
     if isinstance(filename, str) and len(filename)>0 and filename[0] != os.path.sep:
@@ -33,33 +41,34 @@ def _reg_path(filename):
         return filename
 
 def isolate(function):
+    '''
+    Run the function in its own unique temporary workspace, which
+    is passed as the workspace keyword and removed afterwards.
+    The working directory of the process is never changed, so
+    several runs can go on at once from threads.
+    '''
     def wrapper(*args, **kwargs):
-        _tmp_dir = '.pysex.%s'%os.getpid()
-        try:
-            os.mkdir(_tmp_dir)
-        except: pass #already existing. TODO: generate random number instead
-        sys.path.append(os.getcwd())
-        os.chdir(_tmp_dir)
+        _tmp_dir = tempfile.mkdtemp(prefix='.pysex.', dir=os.getcwd())
+        kwargs['workspace'] = _tmp_dir
     
         try:
             return function(*args, **kwargs)
         except:
             raise
         finally:
-            os.chdir('..')
             shutil.rmtree(_tmp_dir)
 
     return wrapper
 
-def _check_files(conf_file, conf_args, verbose=True):
+def _check_files(conf_file, conf_args, verbose=True, workspace='.'):
     if conf_file is None:
-        os.system("%s -d > .pysex.sex"%command)
-        conf_file = '.pysex.sex'
+        conf_file = os.path.join(workspace, '.pysex.sex')
+        os.system("%s -d > %s"%(command, conf_file))
     
     
         if verbose:
             print 'No filter file found, using default filter'
-        f = open('.pysex.conv', 'w')
+        f = open(os.path.join(workspace, '.pysex.conv'), 'w')
         print>>f, """CONV NORM
 # 3x3 ``all-ground'' convolution mask with FWHM = 2 pixels.
 1 2 1
@@ -70,7 +79,7 @@ def _check_files(conf_file, conf_args, verbose=True):
     if not conf_args.has_key('STARNNW_NAME') or not os.path.isfile(conf_args['STARNNW_NAME']):
         if verbose:
             print 'No NNW file found, using default NNW config'
-        f = open('.pysex.nnw', 'w')
+        f = open(os.path.join(workspace, '.pysex.nnw'), 'w')
         print>>f, """NNW
 # Neural Network Weights for the SExtractor star/galaxy classifier (V1.3)
 # inputs:    9 for profile parameters + 1 for seeing.
@@ -104,12 +113,12 @@ def _check_files(conf_file, conf_args, verbose=True):
     
     return conf_file, conf_args
     
-def _setup(conf_file, params):
+def _setup(conf_file, params, workspace='.'):
     try:
-        shutil.copy(conf_file, '.pysex.sex')
+        shutil.copy(conf_file, os.path.join(workspace, '.pysex.sex'))
     except:
         pass #already created in _check_files
-    f=open('.pysex.param', 'w')
+    f=open(os.path.join(workspace, '.pysex.param'), 'w')
     print>>f, '\n'.join(params)
     f.close()
     
@@ -131,19 +140,33 @@ def _read_cat( catName ):
     cat = asciidata.open(catName)
     return cat
 
-def _cleanup(conf,dirname):
+def _read_fits_cat( catName, catalog_type ):
+    '''
+    Read a FITS_1.0 or FITS_LDAC catalogue into a record array
+
+    The table is read into memory and copied, and the file closed,
+    so it stays available once the catalogue has been cleaned up
+    '''
+    import pyfits
+    hdulist = pyfits.open( catName, memmap=False )
+    cat = hdulist[fits_catalog_types[catalog_type]].data.copy()
+    hdulist.close()
+    return cat
+
+def _cleanup(conf,dirname,workspace='.'):
     #if 'CHECKIMAGE_TYPE' in conf and 'CHECKIMAGE_NAME' in conf:
      #   shutil.copy(conf['CHECKIMAGE_NAME'], '..') #TODO: this is an incomplete solution!!
     
-    files = [f for f in os.listdir('.') if '.pysex.' in f]
+    files = [f for f in os.listdir(workspace) if '.pysex.' in f]
     for f in files:
-        os.remove(f)
+        os.remove(os.path.join(workspace, f))
     
-    keepfiles = [ f for f in glob.iglob("*") ]
+    keepfiles = [ f for f in glob.iglob(os.path.join(workspace, "*")) ]
     for i in keepfiles:
         shutil.copy(i,dirname)
 
-def run(image='', imageref='', params=[], param_file=None, conf_file=None, conf_args={}):
+def run(image='', imageref='', params=[], param_file=None, conf_file=None, conf_args={},
+        catalog_type=None):
     """
     Run sextractor on the given image with the given parameters.
     
@@ -152,8 +175,12 @@ def run(image='', imageref='', params=[], param_file=None, conf_file=None, conf_
     params: list of catalog's parameters to be returned
     conf_file: optional, filename of the sextractor catalog to be used
     conf_args: optional, list of arguments to be passed to sextractor (overrides the parameters in the conf file)
+    catalog_type: optional, 'FITS_1.0' or 'FITS_LDAC' to have sextractor write a fits
+                  table which is read directly, bypassing the ascii catalog and asciidata.
+                  Note vector parameters such as FLUX_APER(3) are then a single column
+                  of vectors rather than FLUX_APER, FLUX_APER1, FLUX_APER2
     
-    Returns an asciidata catalog containing the sextractor output
+    Returns a record array of the sextractor output
     
     Usage exemple:
         import pysex
@@ -189,7 +216,7 @@ def run(image='', imageref='', params=[], param_file=None, conf_file=None, conf_
     imref = _reg_path(imageref) if isinstance(imageref, str) else imageref
     cfg = _reg_path(conf_file) if isinstance(conf_file, str) else conf_file
     
-    cat = run_wrap(im, imref, params, cfg, conf_args)
+    cat = run_wrap(im, imref, params, cfg, conf_args, catalog_type)
 
     
 
@@ -197,9 +224,17 @@ def run(image='', imageref='', params=[], param_file=None, conf_file=None, conf_
         
 
 @isolate
-def run_wrap(image='', imageref='', params=[], conf_file=None, conf_args={}):
+def run_wrap(image='', imageref='', params=[], conf_file=None, conf_args={},
+             catalog_type=None, workspace='.'):
+    #do not carry the settings over to the next call
+    conf_args = dict(conf_args)
     if not conf_args.has_key('CATALOG_NAME'):
         conf_args['CATALOG_NAME'] = '.pysex.cat'
+    if catalog_type is not None:
+        if catalog_type not in fits_catalog_types:
+            raise ValueError("catalog_type must be one of %s" % \
+                                 ', '.join(fits_catalog_types.keys()))
+        conf_args['CATALOG_TYPE'] = catalog_type
     conf_args['PARAMETERS_NAME'] = '.pysex.param'
     if 'VERBOSE_TYPE' in conf_args and conf_args['VERBOSE_TYPE']!='QUIET':
         verbose = True
@@ -209,17 +244,17 @@ def run_wrap(image='', imageref='', params=[], conf_file=None, conf_args={}):
     
     if not type(image) == type(''):
         import pyfits
-        im_name = _reg_path('.pysex.fits')
+        im_name = os.path.join(workspace, '.pysex.fits')
         pyfits.writeto(im_name, image.transpose())
     else: im_name = image
     if not type(imageref) == type(''):
         import pyfits
-        imref_name =  _reg_path('.pysex.ref.fits')
+        imref_name =  os.path.join(workspace, '.pysex.ref.fits')
         pyfits.writeto(imref_name, imageref.transpose())
     else: imref_name = imageref
     conf_file = conf_file
-    conf_file, conf_args = _check_files(conf_file, conf_args, verbose)
-    _setup(conf_file, params)
+    conf_file, conf_args = _check_files(conf_file, conf_args, verbose, workspace)
+    _setup(conf_file, params, workspace)
     try:
         workdir=os.path.dirname(image)
     except:
@@ -228,40 +263,156 @@ def run_wrap(image='', imageref='', params=[], conf_file=None, conf_args={}):
 
     cmd = _get_cmd(im_name, imref_name, conf_args)
     
-    res = os.system(cmd)
+    #relative file names are in the workspace
+    res = subprocess.call(cmd, shell=True, cwd=workspace)
     
     if res:
         print "Error during sextractor execution!"
-        _cleanup(conf_args, workdir)
+        _cleanup(conf_args, workdir, workspace)
         return
-    cat = _read_cat(conf_args['CATALOG_NAME'])
-    _cleanup(conf_args, workdir)
+    catName = os.path.join(workspace, conf_args['CATALOG_NAME'])
+    if catalog_type is not None:
+        cat = _read_fits_cat(catName, catalog_type)
+        _cleanup(conf_args, workdir, workspace)
+        return cat
+    
+    cat = _read_cat(catName)
+    _cleanup(conf_args, workdir, workspace)
 
     catFits = cat.tofits()
     
     return catFits.data
 
+class ObjCatalogue(object):
+    """
+    A sextractor catalogue indexed by position for fast lookups
+
+    The kd-tree of the positions is built once for the catalogue,
+    and all of the positions asked for are looked up in one batch.
+
+    Usage exemple:
+        objs = pysex.ObjCatalogue(cat)
+        x, flux = objs.get(['X_IMAGE', 'FLUX_APER(3)'], star_positions, tol=5.)
+        mine, theirs, distance = objs.match(pysex.ObjCatalogue(other_cat))
+    """
+    def __init__(self, cat, xcol='X_IMAGE', ycol='Y_IMAGE'):
+        """
+        cat: the catalogue, a record array as returned by run
+        xcol, ycol: the columns of the positions
+        """
+        import scipy.spatial
+        self.cat = cat
+        self.xy = np.column_stack((np.asarray(cat[xcol], dtype=float),
+                                   np.asarray(cat[ycol], dtype=float)))
+        self.tree = scipy.spatial.cKDTree(self.xy)
+
+    def __len__(self):
+        return len(self.xy)
+
+    def query(self, pos, tol=10.):
+        """
+        Find the nearest object to each position
+
+        pos: a position (x, y) or an array of N positions
+        tol: the largest distance of a match
+
+        Returns the distances and the indices of the nearest objects,
+        the index is -1 where there is no object closer than tol
+        """
+        distance, index = self.tree.query(np.asarray(pos, dtype=float),
+                                          distance_upper_bound=tol)
+        index = np.where(distance < tol, index, -1)
+        return distance, index
+
+    def column(self, param):
+        """
+        The values of a parameter for all objects
+
+        A multi-aperture parameter such as FLUX_APER(3) is returned as
+        an array of shape (N, 3), from the FLUX_APER, FLUX_APER1, FLUX_APER2
+        columns of an ascii catalogue or the vector column of a fits one.
+        """
+        if '(' not in param:
+            return np.asarray(self.cat[param])
+
+        name = param.split('(')[0]
+        naper = int(param.split('(')[1].split(')')[0])
+        values = np.asarray(self.cat[name])
+        if values.ndim == 2:
+            return values[:, :naper]
+        return np.column_stack([values]+[np.asarray(self.cat[name+str(i)])
+                                         for i in range(1, naper)])
+
+    def get(self, params, pos, tol=10.):
+        """
+        The parameters of the nearest object to each position
+
+        params: the list of catalogue parameters, e.g. FLUX_APER(3)
+                for the multi-aperture fluxes
+        pos: an array of N positions (x, y)
+        tol: the largest distance of a match
+
+        Returns a masked array for each parameter, of length N (or N x
+        apertures), masked where there is no object closer than tol
+        """
+        distance, index = self.query(pos, tol)
+        missing = index < 0
+        ret = []
+        for p in params:
+            values = self.column(p)[np.where(missing, 0, index)]
+            mask = missing if values.ndim == 1 else \
+                np.repeat(missing[:, np.newaxis], values.shape[1], axis=1)
+            ret += [np.ma.array(values, mask=mask)]
+        return ret
+
+    def match(self, other, tol=1.):
+        """
+        Cross match with another catalogue
+
+        Each object is matched to the nearest object of the other
+        catalogue within tol, keeping only the closest pair when
+        several objects match the same object of the other catalogue.
+
+        other: an ObjCatalogue
+        tol: the largest distance of a match
+
+        Returns the indices of the matched objects in this and in
+        the other catalogue, and their distances
+        """
+        distance, index = other.query(self.xy, tol)
+        mine = np.flatnonzero(index >= 0)
+        order = mine[np.argsort(distance[mine], kind='mergesort')]
+        theirs, first = np.unique(index[order], return_index=True)
+        mine = order[first]
+        mine.sort()
+        return mine, index[mine], distance[mine]
+
 def get_obj_cat(cat, params, pos, tol=10.):
-    import scipy.spatial
+    """
+    The parameters of the object nearest to pos, or None for each
+    parameter if there is no object closer than tol.
+
+    cat can be an ObjCatalogue, so that the kd-tree is only built once
+    when many objects are looked up in the same catalogue. For many
+    positions at once use ObjCatalogue.get.
+    """
+    if not isinstance(cat, ObjCatalogue):
+        cat = ObjCatalogue(cat)
     try:
-        tree = scipy.spatial.cKDTree(zip(cat['X_IMAGE'], cat['Y_IMAGE']))
-        distance, index = tree.query(pos)
-        if distance < tol:
+        distance, index = cat.query(pos, tol)
+        if index >= 0:
             ret = []
             for p in params:
+                value = cat.column(p)[index]
                 if "FLUX_APER(" in p:
-                    aper = p.split('(')[1].split(')')[0]
-                    f = [cat['FLUX_APER'][index]]
-                    f += [cat['FLUX_APER'+str(i)][index] for i in range(1, int(aper))]
-                    ret += [f]
-                else:
-                    ret += [cat[p][index]]
+                    value = list(value)
+                ret += [value]
             return ret
+        elif np.isinf(distance):
+            #the kd-tree gives an infinite distance beyond tol
+            print 'Unsuccessful sextraction: no object within tol', tol
         else:
             print 'Unsuccessful sextraction:', distance, '> tol'
-    except: 
-        print 'Asciidata error'
+    except (KeyError, ValueError, IndexError), err:
+        print 'Catalogue error', err
     return [None for p in params]
-    
-    
-        
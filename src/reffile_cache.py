@@ -0,0 +1,227 @@
+'''
+reffile_cache.py
+
+A local cache of the HST reference files (bias, dark, flat,
+idctab etc...) that is shared by all clusters, so that each
+new cluster directory does not have to download the same files
+again.
+
+The cache lives in a root directory (default ~/.hst_reduction/reffiles,
+or the environment variable HST_REFFILE_CACHE) with
+
+   objects/ab/abcdef...  : the files, named by the md5 of their content
+   index.json            : reference file name --> md5, size and last use
+   index.lock            : lock so processes can share the cache
+
+Files are fetched from the upstream server (or a local directory
+acting as the server, e.g. a copy of cdbs/jref, so it works offline)
+only if they are not in the cache, and are hard linked (or copied if
+on a different disk) into the jref directory of the cluster.
+
+If the cache grows past max_size the least recently used files
+are removed.
+
+'''
+import os as os
+import json as json
+import time as time
+import shutil as shutil
+import hashlib as hashlib
+import fcntl as fcntl
+import tempfile as tempfile
+import subprocess as subprocess
+
+
+default_root = os.path.join( os.path.expanduser('~'), '.hst_reduction', 'reffiles' )
+
+class RefFileCache(object):
+    '''
+    The shared reference file cache
+
+    KEYWORDS :
+        ROOT : the directory of the cache, default HST_REFFILE_CACHE or
+               ~/.hst_reduction/reffiles
+        SERVER : where to get missing files from, either a url
+                 (ftp://, http://, https://) or a local directory
+        MAX_SIZE : the maximum size of the cache in bytes, default 20Gb
+    '''
+    def __init__(self, root=None, server='ftp://ftp.stsci.edu/cdbs/jref/',
+                 max_size=20*1024**3):
+        if root is None:
+            root = os.environ.get( 'HST_REFFILE_CACHE', default_root )
+
+        self.root = root
+        self.server = server
+        self.max_size = max_size
+        self.index_file = os.path.join( root, 'index.json' )
+
+        if not os.path.isdir( os.path.join( root, 'objects' ) ):
+            os.makedirs( os.path.join( root, 'objects' ) )
+
+    def _lock( self ):
+        lockobj = open( os.path.join( self.root, 'index.lock' ), 'a' )
+        fcntl.flock( lockobj, fcntl.LOCK_EX )
+        return lockobj
+
+    def _unlock( self, lockobj ):
+        fcntl.flock( lockobj, fcntl.LOCK_UN )
+        lockobj.close()
+
+    def _read_index( self ):
+        if os.path.isfile( self.index_file ):
+            return json.load( open( self.index_file, 'rb' ) )
+        return {}
+
+    def _write_index( self, index ):
+        tmp_file = self.index_file+'.tmp'
+        json.dump( index, open( tmp_file, 'wb' ), indent=1 )
+        os.rename( tmp_file, self.index_file )
+
+    def object_path( self, md5 ):
+        '''
+        Where the file with this md5 is kept in the cache
+        '''
+        return os.path.join( self.root, 'objects', md5[:2], md5 )
+
+    def lookup( self, reffile ):
+        '''
+        The path in the cache of a reference file, or None if
+        it is not in the cache
+        '''
+        lockobj = self._lock()
+        try:
+            entry = self._read_index().get( reffile )
+        finally:
+            self._unlock( lockobj )
+
+        if entry is None or not os.path.isfile( self.object_path( entry['md5'] ) ):
+            return None
+
+        return self.object_path( entry['md5'] )
+
+    def get( self, reffile, save_file ):
+        '''
+        Put the reference file at save_file, fetching it from the
+        server only if it is not already in the cache
+
+        INPUT : REFFILE : the name of the reference file, e.g. 'xa81724cj_cte.fits'
+                SAVE_FILE : where the file is wanted, e.g. jref/jrefxa81724cj_cte.fits
+
+        OUTPUT : the path of the file in the cache
+        '''
+        # the download is done outside the lock so that
+        # several files can be fetched at the same time
+        if self.lookup( reffile ) is None:
+            fetched = self._fetch( reffile )
+        else:
+            print("%s found in the reference file cache" % reffile)
+            fetched = None
+
+        lockobj = self._lock()
+        try:
+            index = self._read_index()
+            entry = index.get( reffile )
+
+            if entry is None or not os.path.isfile( self.object_path( entry['md5'] ) ):
+                if fetched is None:
+                    fetched = self._fetch( reffile )
+                entry = fetched
+                index[reffile] = entry
+
+            entry['last_used'] = time.time()
+            self._evict( index, keep=reffile )
+            self._write_index( index )
+
+            cached_file = self.object_path( entry['md5'] )
+            self._link( cached_file, save_file )
+        finally:
+            self._unlock( lockobj )
+
+        return cached_file
+
+    def _fetch( self, reffile ):
+        '''
+        Get a file from the server in to the cache
+
+        OUTPUT : the index entry of the file
+        '''
+        print("FETCHING %s\n" % reffile)
+        tmp_dir = tempfile.mkdtemp( dir=self.root )
+        tmp_file = os.path.join( tmp_dir, reffile )
+
+        try:
+            if self.server.split(':')[0] in ['ftp', 'http', 'https']:
+                #-f so an http error is a failure and not an error page,
+                #a partial file is removed with tmp_dir
+                status = subprocess.call( ['curl', '-f', '-s', '-o', tmp_file,
+                                           self.server+"/"+reffile] )
+                if status != 0:
+                    raise ValueError('Error in obtaining the reference file %s '
+                                     '(curl exit status %i)' % (reffile, status))
+            elif os.path.isfile( os.path.join( self.server, reffile ) ):
+                shutil.copy( os.path.join( self.server, reffile ), tmp_file )
+
+            if not os.path.isfile( tmp_file ):
+                raise ValueError('Error in obtaining the reference file %s' % reffile)
+
+            md5 = file_md5( tmp_file )
+            if not os.path.isdir( os.path.dirname( self.object_path( md5 ) ) ):
+                os.makedirs( os.path.dirname( self.object_path( md5 ) ) )
+            os.rename( tmp_file, self.object_path( md5 ) )
+        finally:
+            shutil.rmtree( tmp_dir, ignore_errors=True )
+
+        return {'md5':md5, 'size':os.path.getsize( self.object_path( md5 ) ),
+                'last_used':time.time()}
+
+    def _link( self, cached_file, save_file ):
+        '''
+        Hard link the cached file to save_file, copy it if
+        they are on different disks
+        '''
+        if os.path.exists( save_file ):
+            os.remove( save_file )
+        try:
+            os.link( cached_file, save_file )
+        except OSError:
+            shutil.copy( cached_file, save_file )
+
+    def _evict( self, index, keep=None ):
+        '''
+        Remove the least recently used files until the cache
+        is smaller than max_size. Files shared by several names
+        (same md5) are only counted once.
+        '''
+        objects = {}
+        for name, entry in index.items():
+            last_used = max( entry['last_used'],
+                             objects.get( entry['md5'], {'last_used':0} )['last_used'] )
+            objects[entry['md5']] = {'size':entry['size'], 'last_used':last_used}
+
+        total = sum([ objects[md5]['size'] for md5 in objects ])
+        keep_md5 = index[keep]['md5'] if keep in index else None
+
+        for md5 in sorted( objects, key=lambda md5: objects[md5]['last_used'] ):
+            if total <= self.max_size:
+                break
+            if md5 == keep_md5:
+                continue
+
+            print("Removing %s from the reference file cache" % md5)
+            if os.path.isfile( self.object_path( md5 ) ):
+                os.remove( self.object_path( md5 ) )
+            for name in [ name for name in index if index[name]['md5'] == md5 ]:
+                del index[name]
+            total -= objects[md5]['size']
+
+
+def file_md5( filename ):
+    '''
+    The md5 of the content of a file
+    '''
+    md5 = hashlib.md5()
+    fileobj = open( filename, 'rb' )
+    for chunk in iter(lambda: fileobj.read(2**20), b''):
+        md5.update( chunk )
+    fileobj.close()
+    return md5.hexdigest()
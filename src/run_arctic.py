@@ -2,22 +2,23 @@ import multi_to_single_fits as mts
 import pyfits as fits
 import os as os
 
-def run_arctic( image_name, outfile ):
+def run_arctic( image_name, outfile, amp_workers=1 ):
     '''
     Run te script by James
+
+    KEYWORDS : amp_workers : the number of amplifiers to correct
+               at the same time (up to 4)
     '''
 
-    os.system('arctic_acs.sh '+image_name)
+    os.system('arctic_acs.sh '+image_name+' --workers=%i' % amp_workers)
 
     imageID = image_name.split('_')[0]
     GeneratedOutfile=imageID+'_cte.fits'
     DesiredFileName = imageID+'_cte_raw.fits'
     
+    #The single amplifier images (_rawA-D, _cteA-D) are kept in a
+    #scratch directory by arctic_acs.py and removed there
     os.system('mv '+GeneratedOutfile+' '+DesiredFileName)
-    os.system('rm -fr '+imageID+'_rawA.fits')
-    os.system('rm -fr '+imageID+'_rawB.fits')
-    os.system('rm -fr '+imageID+'_rawC.fits')
-    os.system('rm -fr '+imageID+'_rawD.fits')
 
 
 
@@ -23,8 +23,10 @@ import os as os
 from acstools import calacs
 import glob as glob
 import get_acs_reffiles as gar
+import instrument as instrument
 
-def run_calacs( FitsFiles='j*_cte_raw.fits',jref_path='./' ):
+def run_calacs( FitsFiles='j*_cte_raw.fits',jref_path='./',
+                calacs_list_name='calacs.lis' ):
     '''
     PURPOSE : This script will take in a bunch of CTE files
               and loop through each one, finding the required
@@ -32,6 +34,9 @@ def run_calacs( FitsFiles='j*_cte_raw.fits',jref_path='./' ):
               flat field the FitsFiles.
 
     OPTIONAL INPUT : fitsfile : a string of the fitsfile including the path to calacs
+                     calacs_list_name : the name of the list of calac'd files to write,
+                                        if None no list is written (used when
+                                        main.main runs each exposure in its own process)
 
     OUTPUT : N images with the extension FLT which will be the flat fielded
              images of FitsFiles, where N is the number of input images
@@ -39,7 +44,8 @@ def run_calacs( FitsFiles='j*_cte_raw.fits',jref_path='./' ):
              A file called 'calacs.lis' which is a list of the files
              which were run through calacs    
     '''
-    calacs_list = open('calacs.lis','wb')
+    if calacs_list_name is not None:
+        calacs_list = open(calacs_list_name,'wb')
     #First make sure i have all the files i need to
     #calac
 
@@ -50,13 +56,16 @@ def run_calacs( FitsFiles='j*_cte_raw.fits',jref_path='./' ):
         else:
             add_jref=True
         #gar.get_acs_reffiles( iCTE_file, ext='all',add_jref=add_jref)
-        calacs_list.write( iCTE_file+'\n' )
+        if calacs_list_name is not None:
+            calacs_list.write( iCTE_file+'\n' )
         print("Running CALACS on %s" %
               iCTE_file )
         flt_file = iCTE_file[:-9]+'_flt.fits'
         if not os.path.isfile( flt_file ):
-            calacs.calacs(iCTE_file)
+            with instrument.stage('calacs', exposure=iCTE_file):
+                calacs.calacs(iCTE_file)
         else:
             print('Already ran CALACS on %s' % iCTE_file)
             
-    calacs_list.close()
+    if calacs_list_name is not None:
+        calacs_list.close()
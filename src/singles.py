@@ -0,0 +1,299 @@
+'''
+singles.py
+
+Drizzle each exposure onto its own frame, for the PSF estimation.
+
+Each single full frame drizzle is ~300mb (and astrodrizzle writes
+several more files of the same size on the way), so drizzling every
+flt of a cluster used to fill the disk. Here the exposures are
+drizzled in a pool of workers, each in its own scratch directory
+which is removed as soon as the product is written, so at most
+WORKERS frames are on disk at any time. The product is either
+
+   - singles/<root>_drz_sci.fits : the full frame, optionally
+     tile compressed as float32 (the image is then in extension 1)
+   - singles/<root>_psf.fits : only cutouts around the stars of a
+     catalogue (e.g. the PSF stars), one extension per star
+
+As there is only one exposure, the cosmic ray steps of astrodrizzle
+(driz_separate, median, blot, driz_cr) are skipped.
+
+Usage :
+    singles.drizzle_singles( glob.glob('j*_flt.fits'), workers=4,
+                             psf_catalogue='psf_stars.cat' )
+
+'''
+import os as os
+import shutil as shutil
+import tempfile as tempfile
+import multiprocessing as mp
+import numpy as np
+import pyfits as fits
+import instrument as instrument
+import workdir as workdir
+
+#the width in pixels of the cutouts around each star
+default_cutout_size = 64
+
+#the quantisation of the float32 images when compressed, higher
+#keeps more precision (see the pyfits CompImageHDU)
+default_quantize_level = 16.
+
+
+def drizzle_singles( files, output_dir='singles', workers=None,
+                     pixel_scale=0.03, drizzle_kernel='square',
+                     wht_file='ERR', psf_catalogue=None,
+                     cutout_size=default_cutout_size, compress=False,
+                     quantize_level=default_quantize_level,
+                     scratch_dir=None ):
+    '''
+    Drizzle each flt onto its own frame
+
+    INPUT : FILES : the list of flts
+
+    KEYWORDS :
+        OUTPUT_DIR : where the products are written
+        WORKERS : the number of exposures drizzled at once, default
+                  the number of cpus. This also bounds the disk used
+        PIXEL_SCALE, DRIZZLE_KERNEL, WHT_FILE : as for drizzle.drizzle
+        PSF_CATALOGUE : an ascii catalogue with the RA and DEC of
+                        stars in the first two columns, if given only
+                        the cutouts around these are kept
+        CUTOUT_SIZE : the width of the cutouts in pixels
+        COMPRESS : write the images tile compressed as float32
+        QUANTIZE_LEVEL : the quantisation of the compression
+        SCRATCH_DIR : where the frames are drizzled, default here,
+                      (e.g. a local disk)
+
+    OUTPUT : the list of the products written
+
+    Exposures whose product already exists and was made with the
+    same keywords (see single_parameters) are not drizzled again
+    '''
+    if not os.path.isdir( output_dir ):
+        os.makedirs( output_dir )
+
+    if psf_catalogue is not None:
+        psf_catalogue = os.path.abspath( psf_catalogue )
+
+    workdir.absolute_reference_paths()
+
+    jobs = []
+    for iFlt in files:
+        job = {'flt':os.path.abspath( iFlt ),
+               'output_dir':os.path.abspath( output_dir ),
+               'pixel_scale':pixel_scale,
+               'drizzle_kernel':drizzle_kernel,
+               'wht_file':wht_file,
+               'psf_catalogue':psf_catalogue,
+               'cutout_size':cutout_size,
+               'compress':compress,
+               'quantize_level':quantize_level,
+               'scratch_dir':os.path.abspath( scratch_dir or '.' )}
+
+        if is_current( job ):
+            print 'Single of %s already exists' % iFlt
+        else:
+            jobs.append( job )
+
+    if workers is None:
+        workers = mp.cpu_count()
+
+    if workers > 1 and len(jobs) > 1 and not mp.current_process().daemon:
+        pool = mp.Pool( processes=min( workers, len(jobs) ) )
+        try:
+            products = pool.map( drizzle_single, jobs, chunksize=1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        products = [ drizzle_single( iJob ) for iJob in jobs ]
+
+    return products
+
+def single_root( flt ):
+    '''
+    The name of the single of an flt, e.g. jabc01abq
+    '''
+    return os.path.basename( flt ).split('_')[0]
+
+def single_product( job ):
+    '''
+    The name of the file written for a job of drizzle_single
+    '''
+    if job['psf_catalogue'] is not None:
+        suffix = '_psf.fits'
+    else:
+        suffix = '_drz_sci.fits'
+
+    return os.path.join( job['output_dir'], single_root( job['flt'] )+suffix )
+
+def single_parameters( job ):
+    '''
+    The keywords of a job that its product depends on, as they are
+    written in the primary header of the product
+    '''
+    return [('SPIXSCAL', job['pixel_scale']),
+            ('SKERNEL', job['drizzle_kernel']),
+            ('SWHTTYPE', job['wht_file']),
+            ('SPSFCAT', os.path.basename( job['psf_catalogue'] or '' )),
+            ('SCUTSIZE', job['cutout_size']),
+            ('SCOMPRES', bool( job['compress'] )),
+            ('SQUANTLV', job['quantize_level'])]
+
+def is_current( job ):
+    '''
+    Whether the product of a job exists and was made with the same
+    keywords, so it does not need to be drizzled again
+    '''
+    product = single_product( job )
+    if not os.path.isfile( product ):
+        return False
+
+    header = fits.getheader( product, 0 )
+    for iKeyword, iValue in single_parameters( job ):
+        if iKeyword not in header or header[iKeyword] != iValue:
+            print 'Single %s was made with other keywords, redoing' % product
+            return False
+
+    return True
+
+def drizzle_single( job ):
+    '''
+    Drizzle one flt in a scratch directory and write its product
+
+    INPUT : JOB : a dictionary of the flt and the keywords of
+                  drizzle_singles
+
+    OUTPUT : the product written
+
+    Module level so it can be used with Pool.map
+    '''
+    from drizzlepac import astrodrizzle
+
+    root = single_root( job['flt'] )
+    scratch = tempfile.mkdtemp( prefix='single_'+root+'.',
+                                dir=job['scratch_dir'] )
+    try:
+        #on a copy of the flt, which is left as it is
+        with instrument.stage('astrodrizzle_single', exposure=root):
+            workdir.run_in_directory( scratch, astrodrizzle.AstroDrizzle,
+                                      args=(os.path.basename( job['flt'] ),),
+                                      kwargs={'output':root,
+                                              'in_memory':True,
+                                              'clean':True,
+                                              'driz_separate':False,
+                                              'median':False,
+                                              'blot':False,
+                                              'driz_cr':False,
+                                              'final_wcs':True,
+                                              'final_scale':job['pixel_scale'],
+                                              'final_pixfrac':0.8,
+                                              'final_kernel':job['drizzle_kernel'],
+                                              'final_wht_type':job['wht_file']},
+                                      files=[job['flt']], copy_back=False )
+
+        drz_sci = os.path.join( scratch, root+'_drz_sci.fits' )
+        product = single_product( job )
+
+        if job['psf_catalogue'] is not None:
+            hdus = cutouts( drz_sci, job['psf_catalogue'],
+                            cutout_size=job['cutout_size'],
+                            compress=job['compress'],
+                            quantize_level=job['quantize_level'] )
+            #still written (with no cutouts) so it is not drizzled again
+            if len(hdus) == 1:
+                print 'No stars of %s on %s' % (job['psf_catalogue'], root)
+        else:
+            data, header = fits.getdata( drz_sci, header=True )
+            if job['compress']:
+                hdus = fits.HDUList( [ fits.PrimaryHDU(),
+                                       image_hdu( data, header, True,
+                                                  job['quantize_level'] ) ] )
+            else:
+                hdus = fits.HDUList( [ fits.PrimaryHDU( data=np.float32( data ),
+                                                        header=header ) ] )
+
+        for iKeyword, iValue in single_parameters( job ):
+            hdus[0].header[iKeyword] = iValue
+
+        #written next to the product first so it is never half written
+        tmp = product+'.tmp'
+        hdus.writeto( tmp, clobber=True )
+        os.rename( tmp, product )
+
+        return product
+    finally:
+        shutil.rmtree( scratch )
+
+def image_hdu( data, header, compress, quantize_level ):
+    '''
+    An image extension of the data as float32, tile compressed if compress
+    '''
+    hdu = fits.ImageHDU( data=np.asarray( data, dtype=np.float32 ),
+                         header=header )
+    if compress:
+        #from the header of the image hdu, which has BITPIX etc.
+        return fits.CompImageHDU( data=hdu.data, header=hdu.header,
+                                  compression_type='RICE_1',
+                                  quantize_level=quantize_level )
+    else:
+        return hdu
+
+def cutouts( drz_sci, psf_catalogue, cutout_size=default_cutout_size,
+             compress=False, quantize_level=default_quantize_level ):
+    '''
+    Cut out the stars of a catalogue from a drizzled image
+
+    INPUT : DRZ_SCI : the drizzled image
+            PSF_CATALOGUE : the ascii catalogue with RA and DEC
+                            in the first two columns
+
+    OUTPUT : an HDUList of the header of the image and one
+             extension (EXTNAME PSF) per star that is wholly and
+             not only partly on the image. The wcs of each cutout is
+             shifted to it and PSF_RA, PSF_DEC, PSF_X and PSF_Y
+             (in the pixels of the image) give the star
+    '''
+    from stwcs import wcsutil
+
+    data, header = fits.getdata( drz_sci, header=True )
+    wcs = wcsutil.HSTWCS( drz_sci )
+
+    stars = np.loadtxt( psf_catalogue, usecols=(0, 1), ndmin=2 )
+    x, y = wcs.all_world2pix( stars[:, 0], stars[:, 1], 1 )
+
+    primary = fits.PrimaryHDU( header=header )
+    hdus = fits.HDUList( [ primary ] )
+
+    half = cutout_size // 2
+    for iStar in range( len( stars ) ):
+        #the corner of the cutout, counted from 0
+        x0 = int( np.round( x[iStar] ) ) - 1 - half
+        y0 = int( np.round( y[iStar] ) ) - 1 - half
+        if x0 < 0 or y0 < 0 or x0 + cutout_size > data.shape[1] or \
+                y0 + cutout_size > data.shape[0]:
+            continue
+
+        cutout = data[ y0:y0+cutout_size, x0:x0+cutout_size ]
+        #outside the footprint of the exposure
+        if not np.any( cutout ):
+            continue
+
+        iHeader = fits.Header()
+        for iKeyword in ['CTYPE1', 'CTYPE2', 'CRVAL1', 'CRVAL2',
+                         'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2']:
+            if iKeyword in header:
+                iHeader[iKeyword] = header[iKeyword]
+        iHeader['CRPIX1'] = header['CRPIX1'] - x0
+        iHeader['CRPIX2'] = header['CRPIX2'] - y0
+        iHeader['EXTNAME'] = 'PSF'
+        iHeader['EXTVER'] = len( hdus )
+        iHeader['PSF_RA'] = stars[iStar, 0]
+        iHeader['PSF_DEC'] = stars[iStar, 1]
+        iHeader['PSF_X'] = x[iStar]
+        iHeader['PSF_Y'] = y[iStar]
+
+        hdus.append( image_hdu( cutout, iHeader, compress, quantize_level ) )
+
+    return hdus
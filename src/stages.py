@@ -0,0 +1,385 @@
+'''
+stages.py
+
+A dependency graph of the stages of the reduction so that a
+rerun only redoes the stages whose inputs or parameters have
+changed since the last time they were run.
+
+Each stage declares the files it reads, the files it writes,
+the parameters it is run with and the stages it depends on.
+After a stage is run the md5 of each of its inputs and a hash
+of its parameters are stored in a state file in the working
+directory. On the next run a stage is only rerun if
+
+   1. it has never been run
+   2. one of its outputs is missing
+   3. the content of one of its inputs has changed
+   4. one of its parameters has changed
+   5. one of the stages it depends on has just been rerun
+
+The graph for the pipeline goes
+
+   raw --> cte_raw --> flt --> per filter lists
+                        |
+                        --> per run drz --> tweaked flt --> final drz
+
+So for example changing the PIXEL_SCALE only reruns the final
+astrodrizzle of each filter.
+
+Stages that change files in place (e.g. tweakback on the flts)
+list these as inputs and as MODIFIES. The hash is taken after the
+stage has run, so the stage is not seen as stale the next time
+round. When a stage later in the graph changes the same files in
+place (e.g. the final astrodrizzle adds the sky and the cosmic
+rays to the flts) their hashes are recorded again for the stages
+it depends on, as these changes are not new inputs of those.
+
+Author : David Harvey
+
+'''
+import os as os
+import sys
+import json as json
+import hashlib as hashlib
+import traceback as traceback
+import multiprocessing as mp
+
+
+class Stage(object):
+    '''
+    A single node in the graph of stages
+
+    INPUTS : NAME : a unique string naming the stage
+             FUNCTION : the (module level) function that runs the stage
+
+    KEYWORDS :
+        INPUTS : list of files the stage reads
+        OUTPUTS : list of files the stage writes. Outputs that are
+                  not also inputs are removed before a stale stage is
+                  rerun, so the isfile checks in each stage dont skip it
+        PARAMS : dictionary of the parameters that change the result
+        DEPENDS : list of the names of the stages that need to be run first
+        MODIFIES : list of the files the stage changes in place, these
+                   are recorded again for the stages it depends on
+        ARGS, KWARGS : the arguments the function is called with
+        MEMORY : an estimate of the peak memory of the stage in bytes,
+                 used to throttle the stages run in processes
+    '''
+    def __init__(self, name, function, inputs=None, outputs=None,
+                 params=None, depends=None, modifies=None, args=(),
+                 kwargs=None, memory=0):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs or [])
+        self.outputs = list(outputs or [])
+        self.params = dict(params or {})
+        self.depends = list(depends or [])
+        self.modifies = list(modifies or [])
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.memory = memory
+
+    def __call__(self):
+        return self.function( *self.args, **self.kwargs )
+
+
+def run_stage( stage ):
+    '''
+    Run a stage, module level so it can be used with Pool.map
+
+    OUTPUT : True if the stage ran, False if it failed, in which
+             case the traceback is printed
+    '''
+    try:
+        stage()
+    except Exception:
+        print('Stage %s failed' % stage.name)
+        traceback.print_exc()
+        return False
+
+    return True
+
+def run_stage_process( stage ):
+    '''
+    Run a stage as the target of a process, which exits with
+    status 1 if it fails
+    '''
+    if not run_stage( stage ):
+        sys.exit( 1 )
+
+def run_processes( stage_list, processes, max_memory=None ):
+    '''
+    Run stages at the same time, each in its own process
+
+    Unlike the workers of a Pool these processes are not daemons,
+    so a stage can use a pool of its own. At most PROCESSES stages
+    are run at once, and if MAX_MEMORY (bytes) is given a stage is
+    only started once the memory estimates of the running stages
+    and its own fit in it. Stages are started in order, and a stage
+    larger than MAX_MEMORY on its own is run when nothing else is.
+
+    INPUTS : STAGE_LIST : the list of stages
+             PROCESSES : the number of stages run at once
+    KEYWORDS :
+        MAX_MEMORY : the memory the stages can use together
+
+    OUTPUT : the names of the stages that failed
+    '''
+    waiting = list(stage_list)
+    running = []
+    failed = []
+
+    while len(waiting) > 0 or len(running) > 0:
+        used = sum([ iStage.memory for iProcess, iStage in running ])
+        while len(waiting) > 0 and len(running) < processes and \
+                ( max_memory is None or len(running) == 0 or
+                  used + waiting[0].memory <= max_memory ):
+            iStage = waiting.pop(0)
+            iProcess = mp.Process( target=run_stage_process, args=(iStage,) )
+            iProcess.start()
+            running.append( (iProcess, iStage) )
+            used += iStage.memory
+
+        running[0][0].join( 1. )
+        for iProcess, iStage in list(running):
+            if not iProcess.is_alive():
+                iProcess.join()
+                running.remove( (iProcess, iStage) )
+                if iProcess.exitcode != 0:
+                    failed.append( iStage.name )
+
+    return failed
+
+
+class StageGraph(object):
+    '''
+    The graph of stages and the record of what has been run
+
+    KEYWORDS :
+        STATE_FILE : the json file where the hashes of each stage
+                     are kept between runs
+    '''
+    def __init__(self, state_file='hst_reduction.stages'):
+        self.state_file = state_file
+        self.stages = {}
+        self.order = []
+        self.complete = []
+        self.ran = []
+
+        if os.path.isfile( state_file ):
+            self.state = json.load( open(state_file, 'rb') )
+        else:
+            self.state = {'files':{}, 'stages':{}}
+
+    def add_stage( self, name, function, **kwargs ):
+        '''
+        Add a stage to the graph, see Stage for the keywords
+        '''
+        if name in self.stages:
+            raise ValueError('Stage %s already in the graph' % name)
+
+        self.stages[name] = Stage( name, function, **kwargs )
+        self.order.append( name )
+
+        return self.stages[name]
+
+    def file_hash( self, filename ):
+        '''
+        The md5 of the content of a file
+
+        The md5 is cached against the size and modification time
+        of the file so the large fits files are only read when
+        they have actually been touched.
+
+        OUTPUT : the hex digest or None if the file doesnt exist
+        '''
+        if not os.path.isfile( filename ):
+            return None
+
+        stat = os.stat( filename )
+        key = os.path.abspath( filename )
+        cached = self.state['files'].get( key )
+
+        if cached is not None and \
+                cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+
+        md5 = hashlib.md5()
+        fileobj = open( filename, 'rb' )
+        for chunk in iter(lambda: fileobj.read(2**20), b''):
+            md5.update( chunk )
+        fileobj.close()
+
+        self.state['files'][key] = [stat.st_size, stat.st_mtime, md5.hexdigest()]
+
+        return md5.hexdigest()
+
+    def params_hash( self, params ):
+        '''
+        A hash of the parameters of a stage
+        '''
+        return hashlib.md5( repr(sorted(params.items())) ).hexdigest()
+
+    def is_stale( self, name ):
+        '''
+        Check whether the stage needs to be (re)run
+
+        A stage that has never been recorded, but whose outputs all
+        exist (e.g. from a run before the graph existed) is trusted
+        and just recorded, the same as the old isfile checks, as long
+        as none of the stages it depends on have just been rerun.
+        '''
+        stage = self.stages[name]
+        record = self.state['stages'].get( name )
+
+        for iOutput in stage.outputs:
+            if not os.path.exists( iOutput ):
+                return True
+
+        rerun_depends = [ iDepend for iDepend in stage.depends
+                          if iDepend in self.ran ]
+        if len(rerun_depends) > 0:
+            return True
+
+        if record is None:
+            if len(stage.outputs) > 0:
+                self.record( name )
+                return False
+            return True
+
+        if record['params'] != self.params_hash( stage.params ):
+            return True
+
+        if sorted(record['inputs'].keys()) != sorted(stage.inputs):
+            return True
+
+        for iInput in stage.inputs:
+            if record['inputs'][iInput] != self.file_hash( iInput ):
+                return True
+
+        return False
+
+    def record( self, name ):
+        '''
+        Store the hashes of the inputs and the parameters of a stage
+        '''
+        stage = self.stages[name]
+
+        self.state['stages'][name] = \
+            {'inputs': dict([ (iInput, self.file_hash(iInput))
+                              for iInput in stage.inputs ]),
+             'params': self.params_hash( stage.params )}
+
+        self.save()
+
+    def ancestors( self, name ):
+        '''
+        The names of all the stages a stage depends on, directly or not
+        '''
+        ancestors = []
+        todo = list(self.stages[name].depends)
+        while len(todo) > 0:
+            iName = todo.pop(0)
+            if iName not in ancestors and iName in self.stages:
+                ancestors.append( iName )
+                todo.extend( self.stages[iName].depends )
+
+        return ancestors
+
+    def record_modified( self, name ):
+        '''
+        Record again the hashes of the files a stage changed in place
+        for the stages it depends on that read them, so these are
+        not seen as stale because of it
+        '''
+        stage = self.stages[name]
+        for iAncestor in self.ancestors( name ):
+            record = self.state['stages'].get( iAncestor )
+            if record is None:
+                continue
+            for iFile in stage.modifies:
+                if iFile in record['inputs']:
+                    record['inputs'][iFile] = self.file_hash( iFile )
+
+        self.save()
+
+    def save( self ):
+        '''
+        Write the state to disk
+        '''
+        json.dump( self.state, open(self.state_file, 'wb'), indent=1 )
+
+    def clean( self, name ):
+        '''
+        Remove the outputs of a stale stage that are not also its inputs
+        '''
+        stage = self.stages[name]
+        for iOutput in stage.outputs:
+            if iOutput not in stage.inputs and os.path.isfile( iOutput ):
+                os.remove( iOutput )
+
+    def run( self, pool=None, processes=1, max_memory=None ):
+        '''
+        Run all the stale stages of the graph in order of dependency
+
+        Stages are run in waves of those whose dependencies have all
+        completed. If a multiprocessing pool is given each wave is
+        mapped over the pool, if processes > 1 the stages of a wave are
+        each run in a process of their own (see run_processes),
+        otherwise they are run one at a time.
+        Stages that are complete from a previous call to run are not
+        checked again. If a stage fails the others of its wave are
+        still run and recorded, and then a RuntimeError is raised.
+
+        KEYWORDS : POOL : a multiprocessing pool
+                   PROCESSES : the number of stages run at once in processes
+                   MAX_MEMORY : the memory in bytes the stages run in
+                                processes can use together
+        '''
+        todo = [ iName for iName in self.order if iName not in self.complete ]
+
+        while len(todo) > 0:
+            wave = [ iName for iName in todo
+                     if all([ iDepend in self.complete
+                              for iDepend in self.stages[iName].depends ]) ]
+
+            if len(wave) == 0:
+                raise ValueError('Stages %s have missing or circular dependencies'
+                                 % ', '.join(todo))
+
+            stale = [ iName for iName in wave if self.is_stale( iName ) ]
+
+            for iName in wave:
+                if iName not in stale:
+                    print('Stage %s is up to date' % iName)
+
+            for iName in stale:
+                print('Running stage %s' % iName)
+                self.clean( iName )
+
+            stale_stages = [ self.stages[iName] for iName in stale ]
+            if pool is not None and len(stale) > 1:
+                status = pool.map( run_stage, stale_stages )
+                failed = [ iName for iName, iStatus in zip(stale, status)
+                           if not iStatus ]
+            elif processes > 1 and len(stale) > 1:
+                failed = run_processes( stale_stages, processes,
+                                        max_memory=max_memory )
+            else:
+                failed = [ iStage.name for iStage in stale_stages
+                           if not run_stage( iStage ) ]
+
+            #the stages that ran are recorded even if others failed,
+            #so they are not redone next time
+            for iName in stale:
+                if iName not in failed:
+                    self.record( iName )
+                    self.record_modified( iName )
+                    self.ran.append( iName )
+
+            if len(failed) > 0:
+                raise RuntimeError('Stages %s failed' % ', '.join(failed))
+
+            self.complete.extend( wave )
+            todo = [ iName for iName in todo if iName not in wave ]
+
@@ -0,0 +1,146 @@
+"""
+Unittest classes for the stage graph of stages.py
+
+Run from src/ with
+   python stages_test.py
+"""
+import unittest
+import os, shutil, tempfile
+import stages
+
+
+def append_stage(filename, name, log):
+    """
+    A stage that changes its file in place, like astrodrizzle
+    and tweakback change the flts, and logs that it ran
+    """
+    open(filename, 'ab').write(name+'\n')
+    open(log, 'ab').write(name+'\n')
+
+def fail_stage(filename, name, log):
+    """
+    A stage that fails
+    """
+    raise IOError('%s failed' % name)
+
+def write_stage(filename, name, log):
+    """
+    A stage that writes a product and logs that it ran
+    """
+    open(filename, 'wb').write(name+'\n')
+    open(log, 'ab').write(name+'\n')
+
+
+class Test_StageGraph(unittest.TestCase):
+    """
+    A test class for the reruns of the stage graph
+    """
+    def setUp(self):
+        """
+        A working directory with an flt
+        """
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+
+        open('flt.fits', 'wb').write('flt\n')
+        self.log = os.path.join(self.workdir, 'stages.log')
+
+    def tearDown(self):
+        """
+        Remove the working directory
+        """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def ran(self):
+        """
+        The stages that ran since the last call
+        """
+        if not os.path.isfile(self.log):
+            return []
+        names = open(self.log, 'rb').read().split()
+        os.remove(self.log)
+        return names
+
+    def pipeline(self, pixel_scale=0.03):
+        """
+        The align and final drizzle of main.main, which both
+        change the flt in place
+        """
+        graph = stages.StageGraph()
+        graph.add_stage('align:F', append_stage,
+                        inputs=['flt.fits'], outputs=['keep.fits'],
+                        modifies=['flt.fits'],
+                        params={'search_rad':1.},
+                        args=('flt.fits', 'align:F', self.log))
+        graph.add_stage('keep:F', write_stage,
+                        inputs=['flt.fits'], outputs=['keep.fits'],
+                        depends=['align:F'],
+                        args=('keep.fits', 'keep:F', self.log))
+        graph.add_stage('drz:F', append_stage,
+                        inputs=['flt.fits'], outputs=[],
+                        modifies=['flt.fits'],
+                        params={'pixel_scale':pixel_scale},
+                        depends=['keep:F'],
+                        args=('flt.fits', 'drz:F', self.log))
+        graph.run()
+        return self.ran()
+
+    def testRerun(self):
+        """
+        Test that an unchanged rerun runs nothing
+        """
+        self.assertEqual(self.pipeline(), ['align:F', 'keep:F', 'drz:F'])
+        self.assertEqual(self.pipeline(), [])
+
+    def testParamsOnly(self):
+        """
+        Test that changing a parameter of the final drizzle
+        only reruns the final drizzle
+        """
+        self.pipeline()
+        self.assertEqual(self.pipeline(pixel_scale=0.05), ['drz:F'])
+        self.assertEqual(self.pipeline(pixel_scale=0.05), [])
+
+    def testChangedInput(self):
+        """
+        Test that a change of the flt from outside the graph
+        reruns everything that reads it
+        """
+        self.pipeline()
+        open('flt.fits', 'ab').write('new\n')
+        self.assertEqual(self.pipeline(), ['align:F', 'keep:F', 'drz:F'])
+
+    def testRerunDepends(self):
+        """
+        Test that a stage is rerun when a stage it depends
+        on has just been rerun
+        """
+        self.pipeline()
+        os.remove('keep.fits')
+        self.assertEqual(self.pipeline(), ['align:F', 'keep:F', 'drz:F'])
+
+    def testFailedStage(self):
+        """
+        Test that the stages of a wave that ran are recorded
+        when another stage of the wave fails
+        """
+        for processes in [1, 2]:
+            graph = stages.StageGraph('processes%i.stages' % processes)
+            product = 'G%i.fits' % processes
+            graph.add_stage('drz:F', fail_stage,
+                            outputs=['F.fits'],
+                            args=('F.fits', 'drz:F', self.log))
+            graph.add_stage('drz:G', write_stage,
+                            outputs=[product],
+                            args=(product, 'drz:G', self.log))
+            self.assertRaises(RuntimeError, graph.run, processes=processes)
+            self.assertEqual(self.ran(), ['drz:G'])
+            self.assert_('drz:G' in graph.state['stages'])
+            self.assert_('drz:F' not in graph.state['stages'])
+
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_StageGraph)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -4,43 +4,90 @@ catalogues that will be used in TweakReg in the alignment process
 
 '''
 import pysex as sex
+import detect as detect
 import os as os
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 
 def tweakreg_sextract( files_to_sextract, catfile_name,
-                       sexfile_dir=None):
+                       sexfile_dir=None, workers=None, detector='sextractor'):
     '''
     Systematically loop through each file and sextract the sources
     and write them in a catalogue
 
     It has to output the catalogue in pixels using the files tweak.sex
     and tweak.param
+
+    Each sextractor run is in its own workspace so the files are
+    sextracted at the same time in a pool of threads (sextractor
+    itself is a separate process). The catfile for TweakReg is
+    written once all of the catalogues exist.
     
     INPUT : files_to_sextract : a python list of file names to source extract
             catfile_name : name of the file containing the image and catalogue names
+
+    KEYWORDS :
+            workers : the number of sextractor runs at once, defaults to
+                      one per file up to the number of cpus. 1 runs them in turn
+            detector : 'sextractor' to run sextractor, or 'numpy' to detect
+                       the sources in process with detect.py, using the
+                       same tweak.sex settings
     
     OUTPUT : A source catalogue for each 
     '''
     if sexfile_dir is None:
         sexfile_dir = '/'.join(os.path.abspath(__file__).\
                                    split('/')[:-1])+'/tweak_sex/'
+
+    if workers is None:
+        workers = min( len(files_to_sextract), mp.cpu_count() )
+
+    outcat_names = [ iFile[:-5]+'_sex.cat' for iFile in files_to_sextract ]
+
+    if workers > 1:
+        pool = ThreadPool( processes=workers )
+        try:
+            pool.map( lambda item: sextract_file( item[0], item[1], sexfile_dir,
+                                                  detector=detector ),
+                      zip(files_to_sextract, outcat_names) )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for iFile, iCat in zip(files_to_sextract, outcat_names):
+            sextract_file( iFile, iCat, sexfile_dir, detector=detector )
                                    
     catfile = open( catfile_name, "wb")
 
-    for iFile in files_to_sextract:
-        outcat_name = iFile[:-5]+'_sex.cat'
-        conf_file = sexfile_dir+'tweak.sex'
-        filter_name = sexfile_dir+'gauss_5.0_9x9.conv'
-        starnnw_name = sexfile_dir+'default.nnw'
-        param_file =  sexfile_dir+'tweak.param'
+    for iFile, iCat in zip(files_to_sextract, outcat_names):
+        catfile.write("%s %s\n" % (iFile, iCat) )
+
+    catfile.close()
+
+def sextract_file( image, outcat_name, sexfile_dir, detector='sextractor' ):
+    '''
+    Sextract the sources of a single image into the pixel
+    catalogue outcat_name for TweakReg
+    '''
+    conf_file = sexfile_dir+'tweak.sex'
+    filter_name = sexfile_dir+'gauss_5.0_9x9.conv'
+    starnnw_name = sexfile_dir+'default.nnw'
+    param_file =  sexfile_dir+'tweak.param'
+
+    if detector == 'numpy':
+        return detect.run( image, cat_name=outcat_name, conf_file=conf_file,
+                           conf_args={'FILTER_NAME':filter_name} )
+    elif detector != 'sextractor':
+        raise ValueError("detector must be 'sextractor' or 'numpy'")
         
-        sexCat = sex.run(   iFile,
-                            conf_file=conf_file,
-                            param_file=param_file, \
-                            conf_args={'CATALOG_NAME':outcat_name,
-                                       'FILTER_NAME':filter_name,
-                                       'STARNNW_NAME':starnnw_name})
-
-        catfile.write("%s %s\n" % (iFile, outcat_name) )
+    sexCat = sex.run(   image,
+                        conf_file=conf_file,
+                        param_file=param_file, \
+                        conf_args={'CATALOG_NAME':outcat_name,
+                                   'FILTER_NAME':filter_name,
+                                   'STARNNW_NAME':starnnw_name})
+
+    return sexCat
 
 
         
@@ -0,0 +1,100 @@
+'''
+workdir.py
+
+Run a stage in its own working directory, so that stages which
+write files with fixed names (astrodrizzle, tweakreg) can be run
+at the same time.
+
+The files a stage works on are copied into the directory, not
+linked. When pyfits updates a file whose header has grown it writes
+a temporary file and renames it over the old one, which replaces a
+link rather than the file it points to (so e.g. the tweaked wcs
+would be lost). The copies that the stage changed are copied back
+over the originals once it is done.
+
+Usage :
+    workdir.run_in_directory( 'drizzle_F814W', drizzle.drizzle,
+                              args=('USING FILES', cluster, 'F814W'),
+                              kwargs={'files':flts}, files=flts,
+                              products=[cluster+'_F814W_drz_*.fits'] )
+
+'''
+import os as os
+import glob as glob
+import shutil as shutil
+import instrument as instrument
+
+
+def absolute_reference_paths():
+    '''
+    Make the reference file directories (jref, iref) absolute, as
+    they are relative to where we started and not the directory a
+    stage is run in
+    '''
+    for iRef in ['jref', 'iref']:
+        if iRef in os.environ and not os.path.isabs( os.environ[iRef] ):
+            os.environ[iRef] = os.path.abspath( os.environ[iRef] )+os.sep
+
+def run_in_directory( workdir, function, args=(), kwargs=None,
+                      files=(), products=(), copy_back=True ):
+    '''
+    Run a function in its own working directory
+
+    INPUT : WORKDIR : the directory, made if it doesnt exist
+            FUNCTION, ARGS, KWARGS : the function and its arguments
+
+    KEYWORDS :
+        FILES : the files copied into the directory (by their base name)
+        PRODUCTS : wildcards of the files (relative to the directory)
+                   that are moved back up once the function is done
+        COPY_BACK : copy the files that the function changed back
+                    over the originals. The copies are then removed
+
+    OUTPUT : what the function returns
+    '''
+    if not os.path.isdir( workdir ):
+        os.makedirs( workdir )
+
+    absolute_reference_paths()
+
+    #the trace of the stages stays in this directory
+    instrument.trace_file = os.path.abspath( instrument.trace_file )
+
+    copies = []
+    for iFile in files:
+        copy = os.path.join( workdir, os.path.basename( iFile ) )
+        if os.path.lexists( copy ):
+            os.remove( copy )
+        shutil.copy2( iFile, copy )
+        copies.append( (iFile, copy, _stamp( copy )) )
+
+    cwd = os.getcwd()
+    os.chdir( workdir )
+    try:
+        result = function( *args, **(kwargs or {}) )
+    finally:
+        os.chdir( cwd )
+
+    for iFile, copy, stamp in copies:
+        if copy_back and _stamp( copy ) != stamp:
+            #copied next to it first so it is never half written
+            shutil.copy2( copy, iFile+'.tmp' )
+            os.rename( iFile+'.tmp', iFile )
+        os.remove( copy )
+
+    for iProduct in products:
+        for iFile in glob.glob( os.path.join( workdir, iProduct ) ):
+            destination = os.path.relpath( iFile, workdir )
+            if os.path.dirname( destination ) != '' and \
+                    not os.path.isdir( os.path.dirname( destination ) ):
+                os.makedirs( os.path.dirname( destination ) )
+            shutil.move( iFile, destination )
+
+    return result
+
+def _stamp( filename ):
+    '''
+    The size and modification time of a file, to tell if it changed
+    '''
+    stat = os.stat( filename )
+    return stat.st_size, stat.st_mtime